@@ -1,46 +1,137 @@
 import uuid
-import base64
+import json
+import asyncio
 import os
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from typing import List, Optional
+from fastapi import APIRouter, Depends, UploadFile, File, Form, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 
-from app.services.generation_service import generation_service
-from app.models.schemas import TextTo3DRequest, ImageTo3DRequest, GenerationStatus
+from app.services.backend import generation_service
+from app.services.batches import batch_service
+from app.services.progress import progress_broker
+from app.services.task_store import TERMINAL_STATUSES
+from app.services.scheduler import PRIORITIES, QueueFullError
+from app.services.admission import ResourceLimitExceeded
+from app.services.stage_artifacts import StageOutputsUnavailable
+from app.models.schemas import (
+    TextTo3DRequest, ImageTo3DRequest, TextureFromTaskRequest, GenerationStatus, BatchStatus
+)
+from app.utils.archive_utils import iter_archive_images, stream_tar, stream_zip
+from app.utils.file_utils import finalize_artifact, preview_path
+from app.utils.http_utils import serve_artifact
 from app.utils.logger import logger
 
 router = APIRouter(prefix="/api/v1", tags=["generation"])
 
+async def _submission_response(task_id: str, queue_position: int) -> JSONResponse:
+    """Response for a newly submitted task; cache hits are already completed"""
+    status = await run_in_threadpool(generation_service.get_task_status, task_id)
+    return JSONResponse({
+        'task_id': task_id,
+        'status': status.get('status', 'pending'),
+        'message': status.get('message', 'Generation queued'),
+        'queue_position': queue_position,
+        'download_url': status.get('download_url'),
+        'estimate': status.get('estimate'),
+        'eta': status.get('eta'),
+        'quality_overrides': status.get('quality_overrides')
+    })
+
+def _too_busy(e: QueueFullError) -> HTTPException:
+    """429 carrying when to retry and the ETA the request would have had"""
+    headers = {}
+    if getattr(e, 'retry_after', None):
+        headers['Retry-After'] = str(e.retry_after)
+    if getattr(e, 'eta', None) is not None:
+        headers['X-Queue-ETA'] = f"{e.eta:.0f}"
+    return HTTPException(status_code=429, detail=str(e), headers=headers or None)
+
+def _client_key(http_request: Request, client_key: Optional[str]) -> str:
+    """Fair-share key of the caller: the X-Client-Key header, else its address"""
+    if client_key:
+        return client_key
+    return http_request.client.host if http_request.client else 'anonymous'
+
+def _check_priority(priority: Optional[str]):
+    if priority is not None and priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+
 @router.post('/text-to-3d', response_model=GenerationStatus)
-async def text_to_3d(request: TextTo3DRequest):
+async def text_to_3d(
+    request: TextTo3DRequest,
+    http_request: Request,
+    client_key: Optional[str] = Header(None, alias='X-Client-Key')
+):
     """Generate 3D model from text prompt"""
     try:
-        if not generation_service.txt2img:
+        if 'txt2img' not in generation_service.models:
             raise HTTPException(status_code=400, detail='Text-to-image generation is not enabled')
+        _check_priority(request.priority)
         
         task_id = str(uuid.uuid4())
-        generation_service.start_text_to_3d_generation(task_id, request)
+        # submitting writes the task and its queue entry to SQLite
+        queue_position = await run_in_threadpool(
+            generation_service.start_text_to_3d_generation, task_id, request,
+            client=_client_key(http_request, client_key))
 
-        logger.info(f"Started text-to-3D generation task: {task_id}")
+        logger.info(f"Queued text-to-3D generation task: {task_id} (position {queue_position})")
 
-        return JSONResponse({
-            'task_id': task_id,
-            'status': 'processing',
-            'message': 'Generation started'
-        })
-    
+        return await _submission_response(task_id, queue_position)
+
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise _too_busy(e)
+    except ResourceLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error in text-to-3D: {e}")
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
     
-@router.post('/image-to-3d', response_model=GenerationStatus)
-async def image_to_3d(
-    image: UploadFile = File(...),
+def _image_params(
     seed: int = Form(0),
     octree_resolution: int = Form(380),
     num_inference_steps: int = Form(50),
+    guidance_scale: float = Form(5.0),
     num_chunks: int = Form(20000),
     output_type: str = Form('trimesh'),
-    enable_texture: bool = Form(True)
+    enable_texture: bool = Form(True),
+    render_size: Optional[int] = Form(None),
+    texture_size: Optional[int] = Form(None),
+    priority: Optional[str] = Form(None),
+    min_octree_resolution: Optional[int] = Form(None),
+    min_inference_steps: Optional[int] = Form(None),
+    min_texture_size: Optional[int] = Form(None),
+    allow_skip_texture: bool = Form(False),
+    preview: bool = Form(False)
+) -> ImageTo3DRequest:
+    """Generation parameters of multipart image uploads"""
+    _check_priority(priority)
+    return ImageTo3DRequest(
+        seed=seed,
+        octree_resolution=octree_resolution,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        num_chunks=num_chunks,
+        output_type=output_type,
+        enable_texture=enable_texture,
+        render_size=render_size,
+        texture_size=texture_size,
+        priority=priority,
+        min_octree_resolution=min_octree_resolution,
+        min_inference_steps=min_inference_steps,
+        min_texture_size=min_texture_size,
+        allow_skip_texture=allow_skip_texture,
+        preview=preview
+    )
+
+@router.post('/image-to-3d', response_model=GenerationStatus)
+async def image_to_3d(
+    http_request: Request,
+    image: UploadFile = File(...),
+    params: ImageTo3DRequest = Depends(_image_params),
+    client_key: Optional[str] = Header(None, alias='X-Client-Key')
 ):
     """Generate 3D model from uploaded image"""
     try:
@@ -48,73 +139,245 @@ async def image_to_3d(
             raise HTTPException(status_code=400, detail='Invalid image file')
         
         image_data = await image.read()
-        image_b64 = base64.b64encode(image_data).decode('utf-8')
-        pil_image = generation_service.process_image_input(image_b64)
-        
-        params = ImageTo3DRequest(
-            seed=seed,
-            octree_resolution=octree_resolution,
-            num_inference_steps=num_inference_steps,
-            num_chunks=num_chunks,
-            output_type=output_type,
-            enable_texture=enable_texture
-        )
+        try:
+            pil_image = await generation_service.preprocess_upload(image_data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         task_id = str(uuid.uuid4())
-        generation_service.start_image_to_3d_generation(task_id, pil_image, params)
+        # hashing the pixels for the result cache is CPU work too
+        queue_position = await run_in_threadpool(
+            generation_service.start_image_to_3d_generation, task_id, pil_image, params,
+            _client_key(http_request, client_key))
 
-        logger.info(f"Started image-to-3D generation task: {task_id}")
+        logger.info(f"Queued image-to-3D generation task: {task_id} (position {queue_position})")
 
-        return JSONResponse({
-            'task_id': task_id,
-            'status': 'processing',
-            'message': 'Generation started'
-        })
-    
+        return await _submission_response(task_id, queue_position)
+
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise _too_busy(e)
+    except ResourceLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error in image-to-3D: {e}")
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+
+@router.post('/batches', response_model=BatchStatus)
+async def create_batch(
+    http_request: Request,
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    params: ImageTo3DRequest = Depends(_image_params),
+    client_key: Optional[str] = Header(None, alias='X-Client-Key')
+):
+    """Generate 3D models from many uploaded images, or a zip of images, with one parameter set"""
+    if not images and archive is None:
+        raise HTTPException(status_code=400, detail='Provide images or a zip archive')
+    for upload in images or []:
+        if not upload.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"Invalid image file: {upload.filename}")
+
+    def sources():
+        # uploads are already spooled to disk, read them one at a time
+        for upload in images or []:
+            yield upload.filename, upload.file.read()
+        if archive is not None:
+            yield from iter_archive_images(archive.file, batch_service.max_item_bytes)
+
+    try:
+        batch = await run_in_threadpool(
+            batch_service.create_batch, sources(), params, _client_key(http_request, client_key))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"Queued batch {batch['batch_id']} of {batch['total']} image(s)")
+    return batch
+
+@router.get('/batches/{batch_id}', response_model=BatchStatus)
+async def get_batch(batch_id: str):
+    """Get batch status with the status of every item"""
+    batch = await run_in_threadpool(batch_service.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail='Batch not found')
+
+    return batch
+
+@router.get('/batches/{batch_id}/download')
+async def download_batch(batch_id: str, format: str = 'zip'):
+    """Download the finished models of a batch as a streamed zip or tar archive"""
+    if format not in ('zip', 'tar'):
+        raise HTTPException(status_code=400, detail='format must be zip or tar')
+    batch = await run_in_threadpool(batch_service.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail='Batch not found')
+
+    stream = stream_zip if format == 'zip' else stream_tar
+    return StreamingResponse(
+        stream(batch_service.archive_entries(batch)),
+        media_type='application/zip' if format == 'zip' else 'application/x-tar',
+        headers={'Content-Disposition': f'attachment; filename="batch_{batch_id[:8]}.{format}"'},
+    )
     
 @router.get('/status/{task_id}', response_model=GenerationStatus)
 async def get_status(task_id: str):
     """Get generation status"""
-    status = generation_service.get_task_status(task_id)
+    status = await run_in_threadpool(generation_service.get_task_status, task_id)
     if status.get('status') == 'not_found':
         raise HTTPException(status_code=404, detail='Task not found')
     
     return status
 
-@router.get('/view/{task_id}')
-async def view_model(task_id: str):
-    """View generated 3D model in browser"""
+@router.delete('/tasks/{task_id}', response_model=GenerationStatus)
+async def cancel_task(task_id: str):
+    """Cancel a queued or running generation task"""
+    cancelled = await run_in_threadpool(generation_service.cancel_task, task_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    if not cancelled:
+        raise HTTPException(status_code=409, detail='Task already finished')
+
+    return await run_in_threadpool(generation_service.get_task_status, task_id)
+
+@router.post('/tasks/{task_id}/texture', response_model=GenerationStatus)
+async def texture_from_task(
+    task_id: str,
+    http_request: Request,
+    request: Optional[TextureFromTaskRequest] = None,
+    client_key: Optional[str] = Header(None, alias='X-Client-Key')
+):
+    """Texture the shape of an earlier task, reusing its stored stage outputs"""
+    request = request or TextureFromTaskRequest()
+    try:
+        _check_priority(request.priority)
+
+        new_task_id = str(uuid.uuid4())
+        # loading the stored outputs reads meshes and images from disk
+        queue_position = await run_in_threadpool(
+            generation_service.start_texture_from_task, new_task_id, task_id, request.dict(),
+            _client_key(http_request, client_key))
+        if queue_position is None:
+            raise HTTPException(status_code=404, detail='Task not found')
+
+        logger.info(f"Queued texturing of task {task_id}: {new_task_id} (position {queue_position})")
+
+        return await _submission_response(new_task_id, queue_position)
+
+    except HTTPException:
+        raise
+    except StageOutputsUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except QueueFullError as e:
+        raise _too_busy(e)
+    except ResourceLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error texturing task {task_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+
+SSE_KEEPALIVE_SECONDS = 15
+
+async def _task_events(task_id: str):
+    """Yield the current task snapshot, then live progress events until the task finishes"""
+    queue = progress_broker.subscribe(task_id)
+    try:
+        # snapshot is read after subscribing so no transition can be missed in between
+        status = await run_in_threadpool(generation_service.get_task_status, task_id)
+        status.pop('file_path', None)
+        yield dict(status, event='status')
+        if status.get('status') in TERMINAL_STATUSES:
+            return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            yield event
+            if event['event'] == 'status' and event.get('status') in TERMINAL_STATUSES:
+                return
+    finally:
+        progress_broker.unsubscribe(task_id, queue)
+
+@router.get('/events/{task_id}')
+async def stream_events(task_id: str):
+    """Stream generation progress as server-sent events"""
+    status = await run_in_threadpool(generation_service.get_task_status, task_id)
+    if status.get('status') == 'not_found':
+        raise HTTPException(status_code=404, detail='Task not found')
+
+    async def event_stream():
+        async for event in _task_events(task_id):
+            if event is None:
+                # comment line keeps idle proxies from closing the connection
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@router.websocket('/ws/{task_id}')
+async def websocket_events(websocket: WebSocket, task_id: str):
+    """Stream generation progress over a WebSocket"""
+    await websocket.accept()
+    status = await run_in_threadpool(generation_service.get_task_status, task_id)
+    if status.get('status') == 'not_found':
+        await websocket.close(code=4404, reason='Task not found')
+        return
+
+    try:
+        async for event in _task_events(task_id):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"Progress websocket for task {task_id} disconnected")
+
+def _completed_artifact(task_id: str):
+    """Path and content hash of a completed task's model, run in the threadpool"""
     status = generation_service.get_task_status(task_id)
+    if status.get('evicted'):
+        raise HTTPException(status_code=410, detail='File was evicted from storage')
     if status.get('status') != 'completed':
         raise HTTPException(status_code=400, detail='File not ready')
     
-    file_path = status.get('file_path', '')
+    file_path = generation_service.get_file_path(task_id)
     if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail='File not found')
-    
-    return FileResponse(
-        file_path,
-        media_type='model/gltf-binary',
-        content_disposition_type='inline',
-    )
+
+    etag = status.get('etag')
+    if etag is None:
+        # artifacts saved before content hashes were recorded
+        etag = finalize_artifact(file_path, False)
+        generation_service.task_store.update(task_id, etag=etag)
+    return file_path, etag
+
+@router.get('/view/{task_id}')
+async def view_model(task_id: str, request: Request):
+    """View generated 3D model in browser"""
+    file_path, etag = await run_in_threadpool(_completed_artifact, task_id)
+    return serve_artifact(request, file_path, etag, 'model/gltf-binary', disposition='inline')
 
 @router.get('/download/{task_id}')
-async def download_file(task_id: str):
+async def download_file(task_id: str, request: Request):
     """Download generated 3D model"""
-    status = generation_service.get_task_status(task_id)
-    if status.get('status') != 'completed':
-        raise HTTPException(status_code=400, detail='File not ready')
-    
-    file_path = status.get('file_path', '')
-    if not file_path or not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail='File not found')
-    
-    return FileResponse(
-        file_path,
-        filename=f"demo_{task_id[:8]}.glb",
-        media_type='model/gltf-binary',
-        content_disposition_type='attachment',
+    file_path, etag = await run_in_threadpool(_completed_artifact, task_id)
+    return serve_artifact(
+        request, file_path, etag, 'model/gltf-binary',
+        disposition='attachment', filename=f"demo_{task_id[:8]}.glb",
     )
+
+@router.get('/preview/{task_id}')
+async def preview_model(task_id: str):
+    """Latest low-resolution preview of a task whose shape is being generated"""
+    file_path = preview_path(task_id)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail='No preview available')
+    # overwritten every few diffusion steps
+    return FileResponse(file_path, media_type='model/gltf-binary', headers={'Cache-Control': 'no-store'})
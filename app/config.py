@@ -1,5 +1,12 @@
 import os
-from typing import Optional
+from typing import Dict, Optional
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    """Parse a comma separated list of key=number pairs"""
+    return {
+        key.strip(): float(number)
+        for key, number in (item.split('=', 1) for item in value.split(',') if '=' in item)
+    }
 
 class Settings:
     def __init__(self):
@@ -18,19 +25,121 @@ class Settings:
         self.low_vram_mode: bool = os.getenv('LOW_VRAM_MODE', 'true').lower() == 'true'
         self.sequential_loading: bool = os.getenv('SEQUENTIAL_LOADING', 'true').lower() == 'true'
 
-        # memory optimization
+        # memory optimization, models are loaded on first use and evicted LRU past these limits
         self.max_concurrent_models: int = int(os.getenv("MAX_CONCURRENT_MODELS", "2"))
+        self.model_device_budget: int = int(float(os.getenv('MODEL_DEVICE_BUDGET_GB', '0')) * 1024 ** 3)
+        self.model_host_budget: int = int(float(os.getenv('MODEL_HOST_BUDGET_GB', '0')) * 1024 ** 3)
+        self.preload_models: list = [
+            name.strip() for name in os.getenv('PRELOAD_MODELS', '').split(',') if name.strip()
+        ]
+
+        # process layout: 'all' serves the API and runs the models in one process, 'api' and 'worker'
+        # split them into processes sharing the SQLite task store and job queue; 'shape-worker' and
+        # 'texture-worker' further split the worker at the texture stages, handing meshes over
+        # through shared memory
+        self.process_role: str = os.getenv('PROCESS_ROLE', 'all')
+        self.api_workers: int = int(os.getenv('API_WORKERS', '1'))
+        self.job_poll_interval: float = float(os.getenv('JOB_POLL_INTERVAL', '0.2'))
+        self.worker_heartbeat_interval: float = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '5'))
+        self.worker_stale_after: float = float(os.getenv('WORKER_STALE_AFTER', '30'))
+
+        # job scheduling
+        self.generation_workers: int = int(os.getenv('GENERATION_WORKERS', '1'))
+        self.max_queue_size: int = int(os.getenv('MAX_QUEUE_SIZE', '32'))
+        self.model_slots: dict = {
+            'txt2img': int(os.getenv('TXT2IMG_SLOTS', '1')),
+            'shape': int(os.getenv('SHAPE_SLOTS', '1')),
+            'texture': int(os.getenv('TEXTURE_SLOTS', '1')),
+        }
+
+        # priority classes and per-client fair share, CLIENT_WEIGHTS is a list of key=weight
+        self.default_priority: str = os.getenv('DEFAULT_PRIORITY', 'normal')
+        self.interactive_workers: int = int(os.getenv('INTERACTIVE_WORKERS', '1'))
+        self.client_weights: dict = _parse_weights(os.getenv('CLIENT_WEIGHTS', ''))
+        self.enable_preemption: bool = os.getenv('ENABLE_PREEMPTION', 'true').lower() == 'true'
+
+        # shape micro-batching, batches are bounded by how many workers reach the shape stage together
+        self.shape_batch_size: int = int(os.getenv('SHAPE_BATCH_SIZE', '4'))
+        self.shape_batch_window: float = float(os.getenv('SHAPE_BATCH_WINDOW_MS', '50')) / 1000
+
+        # admission control, requests estimated past the memory budgets or the queueing bound are refused
+        self.admission_enabled: bool = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+        self.admission_device_budget: int = int(float(os.getenv('ADMISSION_DEVICE_GB', '0')) * 1024 ** 3)
+        self.admission_host_budget: int = int(float(os.getenv('ADMISSION_HOST_GB', '0')) * 1024 ** 3)
+        self.max_queue_seconds: float = float(os.getenv('MAX_QUEUE_SECONDS', '900'))
+
+        # load-adaptive quality, applied only within the lower bounds a request declares;
+        # pressure is the queue depth over DEGRADE_QUEUE_DEPTH or the ETA over the class's SLO
+        self.quality_adaptation: bool = os.getenv('QUALITY_ADAPTATION', 'true').lower() == 'true'
+        self.quality_slo_seconds: dict = _parse_weights(
+            os.getenv('QUALITY_SLO_SECONDS', 'interactive=60,normal=300,batch=1800'))
+        self.degrade_queue_depth: int = int(os.getenv('DEGRADE_QUEUE_DEPTH', '8'))
+
+        # batch submissions, items are fed to the scheduler while its queue is shorter than BATCH_FEED_DEPTH
+        self.batch_max_items: int = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+        self.batch_max_item_bytes: int = int(float(os.getenv('BATCH_MAX_ITEM_MB', '32')) * 1024 ** 2)
+        self.batch_feed_depth: int = int(os.getenv('BATCH_FEED_DEPTH', str(max(1, self.max_queue_size // 2))))
+        self.batch_poll_interval: float = float(os.getenv('BATCH_POLL_INTERVAL', '1'))
+
+        # threads decoding uploads and removing backgrounds
+        self.preprocess_workers: int = int(os.getenv('PREPROCESS_WORKERS', '2'))
+
+        # progress previews, requested per task: the predicted shape is decoded every PREVIEW_STEPS
+        # diffusion steps at a low octree resolution, and skipped while decoding previews has taken
+        # more than PREVIEW_BUDGET of the sampling time
+        self.preview_steps: int = int(os.getenv('PREVIEW_STEPS', '5'))
+        self.preview_octree_resolution: int = int(os.getenv('PREVIEW_OCTREE_RESOLUTION', '64'))
+        self.preview_budget: float = float(os.getenv('PREVIEW_BUDGET', '0.1'))
+
+        # bounded hand-off queues between the shape, postprocess and texture stages
+        self.stage_queue_size: int = int(os.getenv('STAGE_QUEUE_SIZE', '2'))
+
+        # task store
+        self.task_store_backend: str = os.getenv('TASK_STORE', 'sqlite')
+        self.task_ttl: float = float(os.getenv('TASK_TTL_SECONDS', '86400'))
+        self.task_store_max_entries: int = int(os.getenv('TASK_STORE_MAX_ENTRIES', '10000'))
+        self.task_eviction_interval: float = float(os.getenv('TASK_EVICTION_INTERVAL', '60'))
+
+        # result cache
+        self.result_cache_enabled: bool = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+        self.result_cache_max_bytes: int = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+        self.result_cache_max_age: float = float(os.getenv('RESULT_CACHE_MAX_AGE', str(7 * 86400)))
+
+        # stage outputs kept per task, so follow-up requests can start from any of them
+        self.stage_artifacts_enabled: bool = os.getenv('STAGE_ARTIFACTS_ENABLED', 'true').lower() == 'true'
+        self.stage_artifact_max_age: float = float(os.getenv('STAGE_ARTIFACT_MAX_AGE', str(self.task_ttl)))
+
+        # output store
+        self.output_max_bytes: int = int(os.getenv('OUTPUT_MAX_BYTES', str(20 * 1024 ** 3)))
+        self.output_max_age: float = float(os.getenv('OUTPUT_MAX_AGE', '86400'))
+        self.output_gc_interval: float = float(os.getenv('OUTPUT_GC_INTERVAL', '60'))
+        self.precompress_outputs: bool = os.getenv('PRECOMPRESS_OUTPUTS', 'true').lower() == 'true'
+        # internal nginx location serving the output directory, hands file delivery to nginx when set
+        self.accel_redirect_prefix: str = os.getenv('ACCEL_REDIRECT_PREFIX', '')
 
         # paths
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.save_dir = os.path.join(self.base_dir, 'outputs')
         self.log_dir = os.path.join(self.base_dir, 'logs')
+        self.data_dir = os.path.join(self.base_dir, 'data')
         self.template_dir = os.path.join(self.base_dir, 'templates')
         self.static_dir = os.path.join(self.base_dir, 'static')
 
+        self.task_db_path = os.getenv('TASK_DB_PATH', os.path.join(self.data_dir, 'tasks.db'))
+        self.output_db_path = os.getenv('OUTPUT_DB_PATH', os.path.join(self.data_dir, 'outputs.db'))
+        self.result_cache_dir = os.getenv('RESULT_CACHE_DIR', os.path.join(self.data_dir, 'result_cache'))
+        self.result_cache_db_path = os.getenv('RESULT_CACHE_DB_PATH', os.path.join(self.data_dir, 'result_cache.db'))
+        self.batch_db_path = os.getenv('BATCH_DB_PATH', os.path.join(self.data_dir, 'batches.db'))
+        self.job_db_path = os.getenv('JOB_DB_PATH', os.path.join(self.data_dir, 'jobs.db'))
+        self.spool_dir = os.getenv('SPOOL_DIR', os.path.join(self.data_dir, 'spool'))
+        self.batch_dir = os.getenv('BATCH_DIR', os.path.join(self.data_dir, 'batches'))
+        self.preview_dir = os.getenv('PREVIEW_DIR', os.path.join(self.data_dir, 'previews'))
+        self.stage_dir = os.getenv('STAGE_DIR', os.path.join(self.data_dir, 'stages'))
+
         # create dir
         os.makedirs(self.save_dir, exist_ok=True)
         os.makedirs(self.log_dir, exist_ok=True)
+        os.makedirs(self.data_dir, exist_ok=True)
         os.makedirs(self.template_dir, exist_ok=True)
         os.makedirs(self.static_dir, exist_ok=True)
 
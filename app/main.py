@@ -1,11 +1,14 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
 from app.api.endpoints import router as api_router
+from app.services.backend import generation_service
+from app.services.batches import batch_service
+from app.services.metrics import metrics
 from app.utils.logger import logger
 
 app = FastAPI(
@@ -36,9 +39,17 @@ async def read_root(request: Request):
     return templates.TemplateResponse('index.html', {'request': request})
 
 @app.get('/health', response_class=JSONResponse)
-async def health_check():
+def health_check():
     """Health check endpoint"""
-    return {'status': 'API is running'}
+    return {
+        'status': 'API is running',
+        'models': generation_service.models.residency(),
+    }
+
+@app.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
 
 @app.get('/favicon.ico', include_in_schema=False)
 async def favicon():
@@ -54,4 +65,6 @@ async def startup_event():
 @app.on_event('shutdown')
 async def shutdown_event():
     """Cleanup on shutdown"""
-    logger.info('DreamMesh API server shutting down...')
\ No newline at end of file
+    logger.info('DreamMesh API server shutting down...')
+    batch_service.shutdown()
+    generation_service.shutdown()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
 class TextTo3DRequest(BaseModel):
@@ -6,20 +6,78 @@ class TextTo3DRequest(BaseModel):
     seed: Optional[int] = 0
     octree_resolution: Optional[int] = 380
     num_inference_steps: Optional[int] = 50
+    guidance_scale: Optional[float] = 5.0
     num_chunks: Optional[int] = 20000
     output_type: Optional[str] = 'trimesh'
     enable_texture: Optional[bool] = True
+    render_size: Optional[int] = None
+    texture_size: Optional[int] = None
+    priority: Optional[str] = None
+    # bounds within which quality may be lowered under load, unset fields are never degraded
+    min_octree_resolution: Optional[int] = None
+    min_inference_steps: Optional[int] = None
+    min_texture_size: Optional[int] = None
+    allow_skip_texture: Optional[bool] = False
+    # stream low-resolution previews of the shape while it is denoised
+    preview: Optional[bool] = False
 
 class ImageTo3DRequest(BaseModel):
     seed: Optional[int] = 0
     octree_resolution: Optional[int] = 380
     num_inference_steps: Optional[int] = 50
+    guidance_scale: Optional[float] = 5.0
     num_chunks: Optional[int] = 20000
     output_type: Optional[str] = 'trimesh'
     enable_texture: Optional[bool] = True
+    render_size: Optional[int] = None
+    texture_size: Optional[int] = None
+    priority: Optional[str] = None
+    # bounds within which quality may be lowered under load, unset fields are never degraded
+    min_octree_resolution: Optional[int] = None
+    min_inference_steps: Optional[int] = None
+    min_texture_size: Optional[int] = None
+    allow_skip_texture: Optional[bool] = False
+    # stream low-resolution previews of the shape while it is denoised
+    preview: Optional[bool] = False
+
+class TextureFromTaskRequest(BaseModel):
+    # unset fields keep the values of the source task
+    render_size: Optional[int] = None
+    texture_size: Optional[int] = None
+    priority: Optional[str] = None
 
 class GenerationStatus(BaseModel):
     status: str
+    task_id: Optional[str] = None
     message: Optional[str] = None
     download_url: Optional[str] = None
     error: Optional[str] = None
+    queue_position: Optional[int] = None
+    stage: Optional[str] = None
+    priority: Optional[str] = None
+    cached: Optional[bool] = None
+    evicted: Optional[bool] = None
+    timings: Optional[Dict[str, float]] = None
+    estimate: Optional[Dict[str, float]] = None
+    eta: Optional[float] = None
+    quality_overrides: Optional[Dict[str, Any]] = None
+    preview_url: Optional[str] = None
+    preview_step: Optional[int] = None
+
+class BatchItemStatus(BaseModel):
+    index: int
+    name: str
+    task_id: str
+    status: str
+    message: Optional[str] = None
+    download_url: Optional[str] = None
+
+class BatchStatus(BaseModel):
+    batch_id: str
+    status: str
+    message: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+    total: int
+    counts: Dict[str, int]
+    download_url: Optional[str] = None
+    items: List[BatchItemStatus]
@@ -0,0 +1,264 @@
+import itertools
+import math
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app.services.scheduler import QueueFullError, priority_rank
+from app.utils.logger import logger
+
+# priors until the first observations come in, seconds
+PRIOR_STEP_SECONDS = 0.15
+PRIOR_POINT_SECONDS = 1e-6 / 1.5
+PRIOR_TEXTURE_SECONDS = 60.0
+PRIOR_TXT2IMG_SECONDS = 10.0
+# weight of a new observation in the moving averages
+EWMA_ALPHA = 0.2
+# surface band kept by hierarchical decoding at each refinement level, in points per N^2
+NARROW_BAND_FACTOR = 24
+
+
+class ResourceLimitExceeded(ValueError):
+    """Raised for a request whose estimated peak memory can never fit the worker"""
+
+
+class AdmissionRejected(QueueFullError):
+    """Raised when the service is too loaded to take a request now"""
+
+    def __init__(self, message: str, retry_after: int, eta: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.eta = eta
+
+
+class ResourceEstimate:
+    """Predicted peak memory and runtime of one generation request"""
+
+    def __init__(self, device_bytes: int, host_bytes: int, runtime: float):
+        self.device_bytes = device_bytes
+        self.host_bytes = host_bytes
+        self.runtime = runtime
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'device_bytes': self.device_bytes,
+            'host_bytes': self.host_bytes,
+            'runtime': round(self.runtime, 2),
+        }
+
+
+class ResourceEstimator:
+    """Estimate peak memory and runtime of a request from its params and the model configs.
+
+    Memory follows the allocations of the volume decoders and surface
+    extraction: the dense logits of the vanilla decoder, the sparse surface
+    band of the hierarchical ones, and the query generation, attention and
+    MLP activations of one decoding chunk. Runtime is a linear model over
+    diffusion steps and decoded query points whose rates are moving averages
+    of observed timings.
+    """
+
+    def __init__(self, volume_decoder: str = 'vanilla'):
+        self._lock = threading.Lock()
+        # geometry decoder profile, refreshed from the shape model once it is loaded
+        self.profile: Dict[str, Any] = {
+            'volume_decoder': volume_decoder,
+            'num_latents': 4096,
+            'width': 1024,
+            'heads': 16,
+            'mlp_expand_ratio': 4,
+            'dtype_bytes': 2,
+            'render_size': 2048,
+            'texture_size': 2048,
+        }
+        self.step_seconds = PRIOR_STEP_SECONDS
+        self.point_seconds = PRIOR_POINT_SECONDS
+        self.texture_seconds = PRIOR_TEXTURE_SECONDS
+        self.txt2img_seconds = PRIOR_TXT2IMG_SECONDS
+
+    def configure_shape(self, pipeline):
+        """Read the decoder geometry and precision of a loaded shape pipeline"""
+        vae = pipeline.vae
+        geo_decoder = vae.geo_decoder
+        decoder_name = type(vae.volume_decoder).__name__
+        with self._lock:
+            self.profile.update(
+                volume_decoder='vanilla' if decoder_name == 'VanillaVolumeDecoder' else 'hierarchical',
+                num_latents=vae.latent_shape[0],
+                width=geo_decoder.query_proj.out_features,
+                heads=geo_decoder.cross_attn_decoder.attn.heads,
+                dtype_bytes=pipeline.dtype.itemsize if hasattr(pipeline.dtype, 'itemsize') else 2,
+            )
+
+    def configure_texture(self, pipeline_tex):
+        """Read the render and texture sizes of a loaded texture pipeline"""
+        with self._lock:
+            self.profile.update(
+                render_size=pipeline_tex.config.render_size,
+                texture_size=pipeline_tex.config.texture_size,
+            )
+
+    def query_points(self, params) -> int:
+        """Number of points the volume decoder evaluates for a request"""
+        n = params.octree_resolution + 1
+        if self.profile['volume_decoder'] == 'vanilla':
+            return n ** 3
+        coarse, levels = self._levels(params.octree_resolution)
+        return (coarse + 1) ** 3 + sum(NARROW_BAND_FACTOR * (level + 1) ** 2 for level in levels)
+
+    @staticmethod
+    def _levels(octree_resolution: int):
+        resolutions = [octree_resolution]
+        while resolutions[-1] // 2 >= 63:
+            resolutions.append(resolutions[-1] // 2)
+        resolutions.reverse()
+        return resolutions[0], resolutions[1:]
+
+    def estimate(self, params, with_txt2img: bool = False) -> ResourceEstimate:
+        with self._lock:
+            profile = dict(self.profile)
+            step_seconds = self.step_seconds
+            point_seconds = self.point_seconds
+            texture_seconds = self.texture_seconds
+            txt2img_seconds = self.txt2img_seconds
+
+        d = profile['dtype_bytes']
+        n = params.octree_resolution + 1
+        chunk = min(params.num_chunks, n ** 3)
+
+        # one decoding chunk: grid indices, the float32 query embedding sum, queries,
+        # attention scores and the MLP; queries are generated per chunk, never as a grid
+        chunk_bytes = chunk * (4 * 8 + 4 * profile['width']) + chunk * d * (
+            profile['width'] * (3 + profile['mlp_expand_ratio'])
+            + profile['heads'] * profile['num_latents']
+        )
+        if profile['volume_decoder'] == 'vanilla':
+            # chunked logits, their concatenation and the float32 copy
+            volume_bytes = n ** 3 * (2 * d + 4)
+            # surface extraction copies the float32 volume to the host and marches over it
+            host_bytes = n ** 3 * 4 * 3
+        else:
+            # dense coarse level, then the sparse band of the finest level: flat indices and
+            # values, the dilation and sort temporaries and the brick assignment of extraction
+            coarse, _ = self._levels(params.octree_resolution)
+            band = NARROW_BAND_FACTOR * n ** 2
+            volume_bytes = (coarse + 1) ** 3 * (8 + 2 * d) + band * (8 * 8 + d)
+            # brick-local indices and values on the host, and the extracted mesh
+            host_bytes = band * (6 + 4) * 2
+        if getattr(params, 'enable_texture', True):
+            # baked texture, its mask and the float32 multiview renders
+            texture_size = getattr(params, 'texture_size', None) or profile['texture_size']
+            render_size = getattr(params, 'render_size', None) or profile['render_size']
+            host_bytes += texture_size ** 2 * 4 * 4 + 6 * render_size ** 2 * 4 * 4
+
+        runtime = params.num_inference_steps * step_seconds + self.query_points(params) * point_seconds
+        if getattr(params, 'enable_texture', True):
+            runtime += texture_seconds
+        if with_txt2img:
+            runtime += txt2img_seconds
+        return ResourceEstimate(int(volume_bytes + chunk_bytes), int(host_bytes), runtime)
+
+    def _update(self, name: str, value: float):
+        with self._lock:
+            setattr(self, name, (1 - EWMA_ALPHA) * getattr(self, name) + EWMA_ALPHA * value)
+
+    def observe_stage(self, stage: str, seconds: float):
+        """Timing hook for the hy3dgen pipelines"""
+        if stage == 'diffusion_step':
+            self._update('step_seconds', seconds)
+
+    def observe_decode(self, params, seconds: float):
+        """Calibrate the decoding rate from the volume decoding and surface extraction of a request"""
+        self._update('point_seconds', seconds / max(self.query_points(params), 1))
+
+    def observe_task(self, timings: Dict[str, float]):
+        """Calibrate the fixed-cost stages from the timings of a finished task"""
+        if 'texture_time' in timings:
+            self._update('texture_seconds', timings['texture_time'])
+        if 'txt2img_time' in timings:
+            self._update('txt2img_seconds', timings['txt2img_time'])
+
+
+class AdmissionController:
+    """Admit requests against memory budgets and a bound on queueing delay.
+
+    A request whose estimated peak device or host memory exceeds the budget
+    can never run and is refused outright. Otherwise it is admitted unless
+    the work admitted ahead of it, at its priority or above, would keep it
+    waiting past `max_queue_seconds`; rejected callers get a Retry-After
+    and the ETA they would have had. Budgets are callables so they can
+    follow the memory left over by the resident models; 0 disables a check.
+    """
+
+    def __init__(self, estimator: ResourceEstimator, device_budget: Callable[[], int],
+                 host_budget: Callable[[], int], max_queue_seconds: float = 0, parallelism: int = 1):
+        self.estimator = estimator
+        self.device_budget = device_budget
+        self.host_budget = host_budget
+        self.max_queue_seconds = max_queue_seconds
+        self.parallelism = max(1, parallelism)
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        # task id -> (rank, seq, estimate) of admitted, unfinished work
+        self._admitted: Dict[str, tuple] = {}
+
+    def _ahead(self, rank: int, seq: Optional[int] = None) -> float:
+        """Seconds of admitted work that runs before a job of `rank` admitted at `seq`"""
+        return sum(
+            estimate.runtime for other_rank, other_seq, estimate in self._admitted.values()
+            if other_rank <= rank and (seq is None or (other_rank, other_seq) < (rank, seq))
+        ) / self.parallelism
+
+    def backlog(self, priority: str) -> float:
+        """Seconds of admitted work a new job of `priority` would wait behind"""
+        with self._lock:
+            return self._ahead(priority_rank(priority))
+
+    def check(self, params, priority: str, with_txt2img: bool = False) -> ResourceEstimate:
+        """Estimate a request and refuse it if it cannot or should not run now"""
+        estimate = self.estimator.estimate(params, with_txt2img)
+        device_budget = self.device_budget()
+        host_budget = self.host_budget()
+        if device_budget > 0 and estimate.device_bytes > device_budget:
+            raise ResourceLimitExceeded(
+                f"Request needs about {estimate.device_bytes / 1024 ** 3:.1f} GiB of accelerator memory, "
+                f"the worker has {device_budget / 1024 ** 3:.1f} GiB; lower octree_resolution or num_chunks")
+        if host_budget > 0 and estimate.host_bytes > host_budget:
+            raise ResourceLimitExceeded(
+                f"Request needs about {estimate.host_bytes / 1024 ** 3:.1f} GiB of host memory, "
+                f"the worker has {host_budget / 1024 ** 3:.1f} GiB; lower octree_resolution")
+
+        with self._lock:
+            eta = self._ahead(priority_rank(priority)) + estimate.runtime
+        if self.max_queue_seconds > 0 and eta > self.max_queue_seconds:
+            raise AdmissionRejected(
+                f"Server is busy, estimated completion in {eta:.0f}s exceeds {self.max_queue_seconds:.0f}s",
+                retry_after=max(1, math.ceil(eta - self.max_queue_seconds)),
+                eta=eta,
+            )
+        return estimate
+
+    def admit(self, task_id: str, estimate: ResourceEstimate, priority: str):
+        with self._lock:
+            self._admitted[task_id] = (priority_rank(priority), next(self._seq), estimate)
+
+    def release(self, task_id: str):
+        with self._lock:
+            self._admitted.pop(task_id, None)
+
+    def eta(self, task_id: str) -> Optional[float]:
+        """Estimated seconds until an admitted task completes"""
+        with self._lock:
+            entry = self._admitted.get(task_id)
+            if entry is None:
+                return None
+            rank, seq, estimate = entry
+            return self._ahead(rank, seq) + estimate.runtime
+
+    def rejection(self, message: str, priority: str) -> AdmissionRejected:
+        """Back-pressure error for a request that found no room in the queue"""
+        with self._lock:
+            ahead = self._ahead(priority_rank(priority))
+            # a queue slot frees up after about one average job
+            average = ahead / max(len(self._admitted), 1) * self.parallelism
+        logger.info(f"Rejecting request: {message}")
+        return AdmissionRejected(message, retry_after=max(1, math.ceil(average)), eta=ahead)
@@ -0,0 +1,7 @@
+from app.config import settings
+
+# the API process talks to generation workers through the shared stores when the roles are split
+if settings.process_role == 'api':
+    from app.services.generation_client import generation_client as generation_service
+else:
+    from app.services.generation_service import generation_service
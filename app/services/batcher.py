@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional
+
+from app.utils.logger import logger
+
+
+class BatchRequest:
+    """One sample submitted to a `MicroBatcher`"""
+
+    def __init__(self, batch_key: Hashable, payload: Any):
+        self.batch_key = batch_key
+        self.payload = payload
+        self.arrived_at = time.monotonic()
+        self.future: Future = Future()
+
+
+class MicroBatcher:
+    """Coalesce compatible requests that arrive within a short window into one batch.
+
+    Requests sharing a `batch_key` can be executed together. The oldest pending
+    request opens a window of `window` seconds; when the window closes, or
+    `max_batch_size` compatible requests are pending, they are handed to
+    `run_batch` as a single list. `run_batch` must return one result per
+    request, in order; an exception fails every request of the batch, while an
+    exception returned in place of a result fails only its own request.
+
+    `workers` threads form and run batches, so a batch blocked on a busy
+    model does not hold back batches of other keys.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 4,
+                 window: float = 0.05, name: str = 'micro-batcher', workers: int = 1):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window)
+        self.name = name
+        self._pending: List[BatchRequest] = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._loop, name=f"{name}-{i}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, batch_key: Hashable, payload: Any) -> Future:
+        """Queue a sample; the returned future resolves to its result"""
+        request = BatchRequest(batch_key, payload)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError(f"{self.name} is stopped")
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _next_batch(self) -> Optional[List[BatchRequest]]:
+        with self._cond:
+            while True:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return None
+
+                head = self._pending[0]
+                batch = [r for r in self._pending if r.batch_key == head.batch_key][:self.max_batch_size]
+                remaining = head.arrived_at + self.window - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    for request in batch:
+                        self._pending.remove(request)
+                    return batch
+                self._cond.wait(remaining)
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            try:
+                results = self.run_batch([request.payload for request in batch])
+            except Exception as e:
+                logger.error(f"{self.name} failed on a batch of {len(batch)}: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
@@ -0,0 +1,284 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+from app.models.schemas import ImageTo3DRequest
+from app.services.backend import generation_service
+from app.services.scheduler import QueueFullError
+from app.services.task_store import create_task_store, TaskStore, TERMINAL_STATUSES
+from app.utils.archive_utils import ArchiveEntry
+from app.utils.logger import logger
+
+# priority of batch items that do not ask for one
+BATCH_PRIORITY = 'batch'
+
+
+class _ActiveBatch:
+    def __init__(self, batch_id: str, params, client: str, items: List[Dict[str, str]], unsubmitted: Iterable[int]):
+        self.batch_id = batch_id
+        self.params = params
+        self.client = client
+        self.items = items
+        # indices of items not yet handed to the generation service
+        self.unsubmitted = deque(unsubmitted)
+        self.retry_at = 0.0
+
+
+class BatchService:
+    """Accept many images under one parameter set and feed them to the generation service.
+
+    Uploads are spilled to disk and every item gets its task id and a
+    pending task record right away. A feeder thread submits the items while
+    the scheduler queue stays below `feed_depth`, so a large batch neither
+    overflows the queue nor starves other clients, and items sharing the
+    batch parameters reach the shape stage together and are micro-batched.
+    Items refused by admission control are retried after the advertised
+    Retry-After. A batch is completed once all its items are finished.
+
+    Feeding state lives in the stores and the batch directory: an item is
+    unsubmitted while its upload is spilled and its record is still the
+    placeholder. Of the processes sharing the directory, the one holding
+    its feeder lock feeds every processing batch, so batches accepted by
+    another API process or interrupted by a restart are picked up.
+    """
+
+    def __init__(self, generation, store: TaskStore, batch_dir: str,
+                 max_items: int = 500, max_item_bytes: int = 32 * 1024 ** 2,
+                 feed_depth: int = 16, poll_interval: float = 1.0):
+        self.generation = generation
+        self.store = store
+        self.store.start_eviction()
+        self.batch_dir = batch_dir
+        self.max_items = max_items
+        self.max_item_bytes = max_item_bytes
+        self.feed_depth = max(1, feed_depth)
+        self.poll_interval = poll_interval
+        self._active: Dict[str, _ActiveBatch] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._feeder_lock = None
+
+        os.makedirs(batch_dir, exist_ok=True)
+
+        self._feeder = threading.Thread(target=self._feed_loop, name='batch-feeder')
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _item_path(self, batch_id: str, index: int) -> str:
+        return os.path.join(self.batch_dir, batch_id, f"{index:05d}")
+
+    def _create_placeholder(self, batch: _ActiveBatch, task_id: str):
+        """Pending record of an item the generation service has not taken yet"""
+        self.generation.task_store.create(task_id, {
+            "status": "pending",
+            "message": "Waiting for batch submission...",
+            "params": batch.params.dict(),
+            "priority": batch.params.priority,
+            "client": batch.client,
+            "batch_id": batch.batch_id,
+            "awaiting_batch": True,
+            "timings": {}
+        })
+
+    def create_batch(self, sources: Iterable[Tuple[str, bytes]], params, client: str = 'anonymous') -> Dict[str, Any]:
+        """Spill (name, bytes) images to disk, register the batch and queue it for feeding"""
+        if not params.priority:
+            params = params.copy(update={'priority': BATCH_PRIORITY})
+
+        batch_id = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.batch_dir, batch_id))
+        items = []
+        try:
+            for name, data in sources:
+                if len(items) >= self.max_items:
+                    raise ValueError(f"Batch exceeds {self.max_items} images")
+                if len(data) > self.max_item_bytes:
+                    raise ValueError(f"Image {name} exceeds {self.max_item_bytes} bytes")
+                with open(self._item_path(batch_id, len(items)), 'wb') as f:
+                    f.write(data)
+                items.append({'name': os.path.basename(name) or f"item-{len(items)}", 'task_id': str(uuid.uuid4())})
+            if not items:
+                raise ValueError('Batch contains no images')
+        except Exception:
+            shutil.rmtree(os.path.join(self.batch_dir, batch_id), ignore_errors=True)
+            raise
+
+        batch = _ActiveBatch(batch_id, params, client, items, range(len(items)))
+        for item in items:
+            self._create_placeholder(batch, item['task_id'])
+        # the feeder, in whichever process holds its lock, picks the batch up from the store
+        self.store.create(batch_id, {
+            "status": "processing",
+            "params": params.dict(),
+            "client": client,
+            "items": items,
+        })
+        self._wake.set()
+        logger.info(f"Batch {batch_id} accepted with {len(items)} image(s)")
+        return self.get_batch(batch_id)
+
+    def _acquire_feeder_lock(self) -> bool:
+        """Become the process feeding batches; the OS releases the lock when its holder dies"""
+        if self._feeder_lock is not None:
+            return True
+        lock_file = open(os.path.join(self.batch_dir, '.feeder.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._feeder_lock = lock_file
+        logger.info(f"Process {os.getpid()} is feeding batches")
+        return True
+
+    def _load_batches(self):
+        """Track the processing batches of the store this process is not feeding yet"""
+        for batch_id in self.store.with_status('processing'):
+            if batch_id in self._active:
+                continue
+            record = self.store.get(batch_id)
+            if record is None:
+                continue
+            unsubmitted = [
+                index for index in range(len(record['items']))
+                if os.path.exists(self._item_path(batch_id, index))
+            ]
+            batch = _ActiveBatch(
+                batch_id, ImageTo3DRequest(**record['params']), record['client'], record['items'], unsubmitted)
+            with self._lock:
+                self._active[batch_id] = batch
+
+    def _feed_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._acquire_feeder_lock():
+                    self._load_batches()
+            except Exception as e:
+                logger.error(f"Error loading batches: {e}")
+            with self._lock:
+                batches = list(self._active.values())
+            for batch in batches:
+                try:
+                    self._feed(batch)
+                    self._check_finished(batch)
+                except Exception as e:
+                    logger.error(f"Error feeding batch {batch.batch_id}: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _feed(self, batch: _ActiveBatch):
+        """Submit items of a batch while the scheduler queue has room"""
+        while batch.unsubmitted and time.time() >= batch.retry_at and not self._stop.is_set():
+            if self.generation.queue_depth >= self.feed_depth:
+                return
+            index = batch.unsubmitted[0]
+            task_id = batch.items[index]['task_id']
+            path = self._item_path(batch.batch_id, index)
+
+            # an item submitted right before a restart already has its own record
+            record = self.generation.task_store.get(task_id)
+            if record is not None and record.get('awaiting_batch') and record['status'] not in TERMINAL_STATUSES:
+                try:
+                    with open(path, 'rb') as f:
+                        image = self.generation.process_image_bytes(f.read())
+                    self.generation.start_image_to_3d_generation(
+                        task_id, image, batch.params, batch.client, batch_id=batch.batch_id)
+                except QueueFullError as e:
+                    # the generation service dropped the record of the refused task
+                    self._create_placeholder(batch, task_id)
+                    batch.retry_at = time.time() + getattr(e, 'retry_after', self.poll_interval)
+                    logger.info(f"Batch {batch.batch_id} backing off: {e}")
+                    return
+                except Exception as e:
+                    logger.error(f"Error submitting item {index} of batch {batch.batch_id}: {e}")
+                    self.generation._update_task(task_id, status="error", message=str(e))
+
+            batch.unsubmitted.popleft()
+            os.remove(path)
+
+    def _check_finished(self, batch: _ActiveBatch):
+        if batch.unsubmitted:
+            return
+        for item in batch.items:
+            record = self.generation.task_store.get(item['task_id'])
+            if record is not None and record['status'] not in TERMINAL_STATUSES:
+                return
+
+        self.store.update(batch.batch_id, status="completed")
+        with self._lock:
+            self._active.pop(batch.batch_id, None)
+        shutil.rmtree(os.path.join(self.batch_dir, batch.batch_id), ignore_errors=True)
+        logger.info(f"Batch {batch.batch_id} finished")
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Batch manifest with the status of every item"""
+        record = self.store.get(batch_id)
+        if record is None:
+            return None
+
+        items = []
+        for index, item in enumerate(record['items']):
+            status = self.generation.task_store.get(item['task_id']) or {'status': 'not_found'}
+            items.append({
+                'index': index,
+                'name': item['name'],
+                'task_id': item['task_id'],
+                'status': status['status'],
+                'message': status.get('message'),
+                'download_url': status.get('download_url'),
+            })
+        return {
+            'batch_id': batch_id,
+            'status': record['status'],
+            'message': record.get('message'),
+            'params': record['params'],
+            'total': len(items),
+            'counts': dict(Counter(item['status'] for item in items)),
+            'download_url': f"/api/v1/batches/{batch_id}/download",
+            'items': items,
+        }
+
+    def archive_entries(self, manifest: Dict[str, Any]) -> Iterable[ArchiveEntry]:
+        """Outputs of the completed items of a batch manifest, followed by the manifest itself"""
+        for item in manifest['items']:
+            if item['status'] != 'completed':
+                continue
+            file_path = self.generation.get_file_path(item['task_id'])
+            if file_path:
+                stem = os.path.splitext(item['name'])[0]
+                yield f"{item['index']:05d}_{stem}.glb", file_path
+        yield 'manifest.json', json.dumps(manifest, indent=2).encode()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self._feeder_lock is not None:
+            self._feeder_lock.close()
+        self.store.close()
+
+
+batch_service = BatchService(
+    generation_service,
+    create_task_store(
+        settings.task_store_backend,
+        db_path=settings.batch_db_path,
+        ttl=settings.task_ttl,
+        max_entries=settings.task_store_max_entries,
+        eviction_interval=settings.task_eviction_interval,
+        # interrupted batches are resumed by the feeder
+        fail_interrupted=False,
+    ),
+    settings.batch_dir,
+    max_items=settings.batch_max_items,
+    max_item_bytes=settings.batch_max_item_bytes,
+    feed_depth=settings.batch_feed_depth,
+    poll_interval=settings.batch_poll_interval,
+)
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from app.config import settings
+from app.models.schemas import TextTo3DRequest, ImageTo3DRequest
+from app.services.job_queue import JobQueue
+from app.services.output_store import OutputStore
+from app.services.progress import progress_broker
+from app.services.scheduler import QueueFullError
+from app.services.stage_artifacts import StageArtifactStore, StageOutputsUnavailable, texture_request
+from app.services.task_store import create_task_store, TaskStore, TERMINAL_STATUSES
+from app.utils.logger import logger
+
+
+class RemoteModels:
+    """Models of the live generation workers, as reported by their heartbeats"""
+
+    def __init__(self, job_queue: JobQueue):
+        self.job_queue = job_queue
+
+    def _workers(self) -> Dict[str, Dict[str, Any]]:
+        return self.job_queue.workers(settings.worker_stale_after)
+
+    def __contains__(self, name: str) -> bool:
+        workers = self._workers()
+        if not workers:
+            # no worker has reported yet, assume the configured model set
+            return name != 'txt2img' or settings.enable_t23d
+        return any(name in info['residency']['models'] for info in workers.values())
+
+    def residency(self) -> Dict[str, Any]:
+        return {'workers': self._workers()}
+
+
+class GenerationClient:
+    """API-tier stand-in for the generation service when the API and the models run in separate processes.
+
+    Requests become jobs in the shared job queue, next to a pending record
+    in the shared task store. Uploads are only checked and spooled to disk;
+    decoding, background removal and generation happen on the workers.
+    Status, downloads and cancellation go through the shared stores, so
+    any API process can answer for any task, and progress events published
+    by the workers are relayed to this process's subscribers.
+    """
+
+    def __init__(self, task_store: TaskStore, job_queue: JobQueue, outputs: OutputStore,
+                 stage_artifacts: Optional[StageArtifactStore] = None):
+        self.task_store = task_store
+        self.job_queue = job_queue
+        self.outputs = outputs
+        self.stage_artifacts = stage_artifacts
+        self.models = RemoteModels(job_queue)
+        os.makedirs(settings.spool_dir, exist_ok=True)
+
+        self._stop = threading.Event()
+        self._relay = threading.Thread(target=self._relay_events, name='progress-relay')
+        self._relay.daemon = True
+        self._relay.start()
+
+    def _relay_events(self):
+        last_id = self.job_queue.last_event_id()
+        while not self._stop.wait(settings.job_poll_interval):
+            try:
+                for event_id, task_id, event, data in self.job_queue.events_since(last_id):
+                    last_id = event_id
+                    progress_broker.publish(task_id, event, **data)
+            except Exception as e:
+                logger.error(f"Error relaying progress events: {e}")
+
+    def process_image_bytes(self, image_data: bytes) -> bytes:
+        """Check that uploaded bytes are an image; they stay encoded until a worker picks them up"""
+        try:
+            with Image.open(BytesIO(image_data)) as image:
+                image.verify()
+        except Exception as e:
+            logger.error(f"Error processing image: {e}")
+            raise ValueError('Invalid image data')
+        return image_data
+
+    async def preprocess_upload(self, image_data: bytes) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.process_image_bytes, image_data)
+
+    def start_text_to_3d_generation(self, task_id: str, params: TextTo3DRequest, client: str = 'anonymous') -> int:
+        """Queue text-to-3D generation and return the queue position"""
+        return self._enqueue(task_id, 'text-to-3d', params, client)
+
+    def start_image_to_3d_generation(self, task_id: str, image: bytes, params: ImageTo3DRequest,
+                                     client: str = 'anonymous', batch_id: Optional[str] = None) -> int:
+        """Queue image-to-3D generation of encoded image bytes and return the queue position"""
+        return self._enqueue(task_id, 'image-to-3d', params, client, image,
+                             extra={'batch_id': batch_id} if batch_id is not None else None)
+
+    def start_texture_from_task(self, task_id: str, source_task_id: str,
+                                overrides: Optional[Dict[str, Any]] = None, client: str = 'anonymous') -> Optional[int]:
+        """Queue a textured version of an earlier task; None if the source task does not exist"""
+        source = self.task_store.get(source_task_id)
+        if source is None:
+            return None
+        if self.stage_artifacts is None or not self.stage_artifacts.resumable(source_task_id):
+            raise StageOutputsUnavailable(f"No stored stage outputs of task {source_task_id}")
+        params = texture_request(source['params'], overrides)
+        return self._enqueue(task_id, 'texture-from-task', params, client,
+                             extra={'source_task_id': source_task_id, 'overrides': overrides or {}})
+
+    def _spool_path(self, task_id: str) -> str:
+        return os.path.join(settings.spool_dir, task_id)
+
+    def _enqueue(self, task_id: str, kind: str, params, client: str, image: Optional[bytes] = None,
+                 extra: Optional[Dict[str, Any]] = None) -> int:
+        if self.job_queue.depth() >= settings.max_queue_size:
+            raise QueueFullError(f"Job queue is full ({settings.max_queue_size} pending)")
+
+        priority = getattr(params, 'priority', None) or settings.default_priority
+        record = {
+            "status": "pending",
+            "message": "Waiting in queue...",
+            "params": params.dict(),
+            "priority": priority,
+            "client": client,
+            "timings": {}
+        }
+        if extra and 'batch_id' in extra:
+            record['batch_id'] = extra['batch_id']
+        payload = dict(extra or {}, params=params.dict(), record=record)
+        if image is not None:
+            with open(self._spool_path(task_id), 'wb') as f:
+                f.write(image)
+            payload['image_path'] = self._spool_path(task_id)
+
+        self.task_store.create(task_id, record)
+        try:
+            self.job_queue.enqueue(task_id, kind, payload, priority=priority, client=client)
+        except Exception:
+            self.task_store.delete(task_id)
+            self._remove_spool(task_id)
+            raise
+        return self.job_queue.position(task_id) or 0
+
+    def _remove_spool(self, task_id: str):
+        try:
+            os.remove(self._spool_path(task_id))
+        except FileNotFoundError:
+            pass
+
+    def cancel_task(self, task_id: str) -> Optional[bool]:
+        """Cancel a task; None if it does not exist, False if it already finished.
+
+        A queued job is dropped here, a claimed one is stopped by its worker.
+        """
+        record = self.task_store.get(task_id)
+        if record is None:
+            return None
+        if record['status'] in TERMINAL_STATUSES:
+            return False
+
+        if self.job_queue.cancel(task_id) == 'dropped':
+            self._remove_spool(task_id)
+        self._update_task(task_id, status="cancelled", message="Cancelled by client")
+        logger.info(f"Task {task_id} cancelled")
+        return True
+
+    def _update_task(self, task_id: str, **fields):
+        """Persist task fields and publish status changes to the subscribers of every API process"""
+        self.task_store.update(task_id, **fields)
+        if 'status' in fields:
+            self.job_queue.publish_event(task_id, 'status', {
+                'status': fields['status'],
+                'message': fields.get('message'),
+                'download_url': fields.get('download_url'),
+            })
+
+    def get_task_status(self, task_id: str) -> Dict[str, Any]:
+        """Get status of a generation task"""
+        status = self.task_store.get(task_id)
+        if status is None:
+            return {"status": "not_found"}
+
+        status['task_id'] = task_id
+        if status['status'] == 'pending':
+            status['queue_position'] = self.job_queue.position(status.get('coalesced_with', task_id))
+        return status
+
+    def get_file_path(self, task_id: str) -> str:
+        """Get file path for completed task and mark it as recently used"""
+        status = self.task_store.get(task_id) or {}
+        file_path = status.get('file_path') or ''
+        if file_path:
+            self.outputs.touch(task_id)
+        return file_path
+
+    @property
+    def queue_depth(self) -> int:
+        return self.job_queue.depth()
+
+    def shutdown(self):
+        self._stop.set()
+        self.outputs.close()
+        self.task_store.close()
+        self.job_queue.close()
+
+
+def _create_client() -> GenerationClient:
+    if settings.task_store_backend != 'sqlite':
+        raise ValueError('Separate API and worker processes need the sqlite task store')
+    task_store = create_task_store(
+        settings.task_store_backend,
+        db_path=settings.task_db_path,
+        ttl=settings.task_ttl,
+        eviction_interval=settings.task_eviction_interval,
+        fail_interrupted=False,
+    )
+    # garbage collection and task eviction run on the workers
+    outputs = OutputStore(
+        settings.save_dir,
+        settings.output_db_path,
+        max_bytes=settings.output_max_bytes,
+        max_age=settings.output_max_age,
+    )
+    # expired stage outputs are removed by the workers
+    stage_artifacts = None
+    if settings.stage_artifacts_enabled:
+        stage_artifacts = StageArtifactStore(settings.stage_dir, max_age=settings.stage_artifact_max_age)
+    return GenerationClient(task_store, JobQueue(settings.job_db_path), outputs, stage_artifacts)
+
+
+generation_client = _create_client()
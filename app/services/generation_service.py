@@ -1,182 +1,807 @@
+import copy
+import os
 import time
-import threading
+import numpy as np
 import torch
 import trimesh
 import uuid
 import base64
 import gc
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from io import BytesIO
 
 from app.config import settings
 from app.utils.logger import logger
-from app.utils.file_utils import generate_file_path
+from app.utils.file_utils import (
+    finalize_artifact, generate_file_path, link_or_copy_artifact, preview_path, sidecar_paths
+)
+from app.utils.shm_utils import (
+    mesh_from_arrays, mesh_to_arrays, pack_arrays, segment_name, unlink_segment, unpack_arrays
+)
 from app.models.schemas import TextTo3DRequest, ImageTo3DRequest
+from app.services.scheduler import JobScheduler, QueueFullError, priority_rank
+from app.services.admission import AdmissionController, ResourceEstimate, ResourceEstimator, ResourceLimitExceeded
+from app.services.quality import QualityPolicy
+from app.services.task_store import create_task_store, TERMINAL_STATUSES
+from app.services.progress import progress_broker
+from app.services.output_store import OutputStore
+from app.services.result_cache import ResultCache, request_cache_key
+from app.services.batcher import MicroBatcher
+from app.services.model_registry import ModelRegistry
+from app.services.stage_pipeline import Stage, StageJob, StagePipeline
+from app.services.job_queue import JobQueue, TEXTURE_KIND
+from app.services.stage_artifacts import StageArtifactStore, StageOutputsUnavailable, texture_request
+from app.services.metrics import (
+    metrics, Gauge, observe_stage, preemptions_total, queue_wait_seconds, task_duration_seconds, tasks_total
+)
 
 from hy3dgen.rembg import BackgroundRemover
 from hy3dgen.shapegen import Hunyuan3DDiTFlowMatchingPipeline, FloaterRemover, DegenerateFaceRemover, FaceReducer
-from hy3dgen.texgen import Hunyuan3DPaintPipeline
+from hy3dgen.shapegen.pipelines import extract_preview_meshes
+from hy3dgen.shapegen.utils import (
+    add_timing_hook, check_cancelled, CancellationToken, CombinedCancellationToken, GenerationCancelled,
+    GenerationPreempted
+)
+from hy3dgen.texgen import Hunyuan3DPaintPipeline, TextureBaker
 from hy3dgen.text2image import HunyuanDiTPipeline
 
+# pipeline stages reported to clients under the texture.* namespace
+TEXTURE_STAGES = {stage: f"texture.{stage}" for stage in ('uv_wrap', 'multiview', 'bake', 'export')}
+
 class GenerationService:
     def __init__(self):
         self.worker_id = str(uuid.uuid4())[:6]
-        self.task_status: Dict[str, Dict[str, Any]] = {}
-        self._models_initialized = False
-        self._initialize_models_sequentially()
+        self.task_store = create_task_store(
+            settings.task_store_backend,
+            db_path=settings.task_db_path,
+            ttl=settings.task_ttl,
+            max_entries=settings.task_store_max_entries,
+            eviction_interval=settings.task_eviction_interval,
+            # with split processes, work of a dead worker is requeued by the job queue instead
+            fail_interrupted=settings.process_role == 'all',
+        )
+        self.task_store.start_eviction()
+
+        self.outputs = OutputStore(
+            settings.save_dir,
+            settings.output_db_path,
+            max_bytes=settings.output_max_bytes,
+            max_age=settings.output_max_age,
+            gc_interval=settings.output_gc_interval,
+            on_evict=self._mark_evicted,
+        )
+        # the processes saving models collect them, texture workers never add outputs
+        if settings.process_role != 'texture-worker':
+            self.outputs.start_gc()
 
-    def _initialize_models_sequentially(self):
-        """Initialize all models"""
-        logger.info(f"Initialize models on worker {self.worker_id}...")
+        self.result_cache = None
+        if settings.result_cache_enabled:
+            self.result_cache = ResultCache(
+                settings.result_cache_dir,
+                settings.result_cache_db_path,
+                max_bytes=settings.result_cache_max_bytes,
+                max_age=settings.result_cache_max_age,
+            )
+        self.stage_artifacts = None
+        if settings.stage_artifacts_enabled:
+            self.stage_artifacts = StageArtifactStore(
+                settings.stage_dir,
+                max_age=settings.stage_artifact_max_age,
+                gc_interval=settings.output_gc_interval,
+            )
+            self.stage_artifacts.start_gc()
 
-        if settings.device == "cuda":
-            torch.cuda.empty_cache()
+        # cache key -> leader task and the duplicate tasks waiting on its result
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._inflight_lock = threading.Lock()
+        # leader task -> token its generation job checks between steps and stages
+        self._cancel_tokens: Dict[str, CancellationToken] = {}
 
-        # text-to-image pipeline
-        self.txt2img = HunyuanDiTPipeline(
-            'Tencent-Hunyuan/HunyuanDiT-v1.1-Diffusers-Distilled',
-            device=settings.device
+        # the loaders refresh the estimator with the model configs
+        self.estimator = ResourceEstimator('hierarchical' if settings.enable_flashvdm else 'vanilla')
+
+        self.models = ModelRegistry(
+            settings.device,
+            max_device_models=settings.max_concurrent_models,
+            device_budget=settings.model_device_budget,
+            host_budget=settings.model_host_budget,
         )
-        logger.info('Text-to-image enabled')
+        self._register_models()
 
-        if settings.device == "cuda":
-            torch.cuda.empty_cache()
-            gc.collect()
+        self.admission = AdmissionController(
+            self.estimator,
+            device_budget=self._device_budget,
+            host_budget=self._host_budget,
+            max_queue_seconds=settings.max_queue_seconds,
+            parallelism=settings.model_slots['shape'],
+        )
+        self.quality = QualityPolicy()
 
-        # background remover
-        self.rembg = BackgroundRemover()
+        # uploads are decoded and background-removed off the event loop
+        self.preprocess_pool = ThreadPoolExecutor(
+            max_workers=settings.preprocess_workers,
+            thread_name_prefix='preprocess',
+        )
 
-        # shape pipeline
-        self.pipeline = Hunyuan3DDiTFlowMatchingPipeline.from_pretrained(
-            settings.model_path,
-            subfolder=settings.subfolder,
-            variant='fp16'
+        # previews are written off the denoising loop, at most one pending per task
+        os.makedirs(settings.preview_dir, exist_ok=True)
+        self.preview_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+        self._pending_previews = set()
+
+        self.scheduler = JobScheduler(
+            num_workers=settings.generation_workers,
+            max_queue_size=settings.max_queue_size,
+            model_slots=settings.model_slots,
+            client_weights=settings.client_weights,
+            reserved_workers=settings.interactive_workers,
         )
-        logger.info('Shape generation pipeline loaded')
+        self.scheduler.start()
 
-        if settings.enable_flashvdm:
-            self.pipeline.enable_flashvdm()
-            logger.info('FlashVDM enabled')
+        # one batcher thread per shape worker, a parked batch must not block the others
+        self.shape_batcher = MicroBatcher(
+            self._run_shape_batch,
+            max_batch_size=settings.shape_batch_size,
+            window=settings.shape_batch_window,
+            name='shape-batcher',
+            workers=self._shape_workers(),
+        )
 
-        if settings.device == "cuda":
-            torch.cuda.empty_cache()
-            gc.collect()
+        # a shape worker hands texturing to the texture workers through the job queue
+        self.job_queue = JobQueue(settings.job_db_path) if settings.process_role == 'shape-worker' else None
 
-        self.pipeline_tex = Hunyuan3DPaintPipeline.from_pretrained(settings.tex_model_path)
-        logger.info('Texture generation pipeline loaded')
-        
-        if settings.low_vram_mode:
-            self.pipeline_tex.enable_model_cpu_offload()
+        self.stages = self._build_stage_pipeline()
+        self.stages.start()
 
-        if settings.device == "cuda":
-            torch.cuda.empty_cache()
-            gc.collect()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Expose stage timings from the model pipelines and the service's load gauges"""
+        add_timing_hook(observe_stage)
+        add_timing_hook(self.estimator.observe_stage)
+
+        metrics.register(Gauge(
+            'dreammesh_queue_depth', 'Tasks waiting for a generation worker',
+            collect=lambda: [({}, self.scheduler.queue_depth)]
+        ))
+        metrics.register(Gauge(
+            'dreammesh_in_flight_tasks', 'Tasks currently being generated',
+            collect=lambda: [({}, self.scheduler.in_flight)]
+        ))
+        metrics.register(Gauge(
+            'dreammesh_stage_queue_depth', 'Jobs waiting in front of each generation stage', ('stage',),
+            collect=lambda: [({'stage': stage}, depth) for stage, depth in self.stages.queue_depths().items()]
+        ))
+
+        def model_residency():
+            models = self.models.residency()['models']
+            return [({'model': name, 'state': info['state']}, 1) for name, info in models.items()]
+
+        metrics.register(Gauge(
+            'dreammesh_model_residency', 'Where each model currently lives', ('model', 'state'),
+            collect=model_residency
+        ))
+        metrics.register(Gauge(
+            'dreammesh_model_bytes', 'Memory held by each model when resident', ('model',),
+            collect=lambda: [
+                ({'model': name}, info['bytes']) for name, info in self.models.residency()['models'].items()
+            ]
+        ))
+        metrics.register(Gauge(
+            'dreammesh_output_store_bytes', 'Bytes of generated artifacts on disk',
+            collect=lambda: [({}, self.outputs.total_bytes)]
+        ))
+        if self.result_cache is not None:
+            metrics.register(Gauge(
+                'dreammesh_result_cache_bytes', 'Bytes held by the result cache',
+                collect=lambda: [({}, self.result_cache.total_bytes)]
+            ))
+
+    def _register_models(self):
+        """Register the models; each one is loaded on first use"""
+        logger.info(f"Registering models on worker {self.worker_id}...")
+
+        role = settings.process_role
+        if role != 'texture-worker':
+            if settings.enable_t23d:
+                self.models.register(
+                    'txt2img', self._load_txt2img,
+                    to_device=lambda model, device: model.pipe.to(device)
+                )
+            # background remover runs on onnxruntime's CPU session
+            self.models.register('rembg', BackgroundRemover, uses_device=False)
+            self.models.register(
+                'shape', self._load_shape,
+                to_device=lambda model, device: model.to(device)
+            )
+        if role != 'shape-worker':
+            if settings.low_vram_mode:
+                # accelerate's offload hooks stream submodules to the device on demand
+                self.models.register('texture', self._load_texture, uses_device=False)
+            else:
+                self.models.register('texture', self._load_texture, to_device=self._move_texture)
 
         # mesh processors
         self.floater_remover = FloaterRemover()
         self.degenerate_face_remover = DegenerateFaceRemover()
         self.face_reducer = FaceReducer()
 
+        # stage workers share the configuration but preload only the models they run
+        preload = [name for name in settings.preload_models if name in self.models]
+        if preload:
+            self.models.preload(preload)
+
         logger.info('Generation service initialized successfully')
 
+    def _load_txt2img(self) -> HunyuanDiTPipeline:
+        """Load the text-to-image pipeline"""
+        self._clear_model_memory("pre-txt2img-loading")
+        return HunyuanDiTPipeline(
+            'Tencent-Hunyuan/HunyuanDiT-v1.1-Diffusers-Distilled',
+            device=settings.device
+        )
+
+    def _load_shape(self) -> Hunyuan3DDiTFlowMatchingPipeline:
+        """Load the shape generation pipeline"""
+        self._clear_model_memory("pre-shape-loading")
+        pipeline = Hunyuan3DDiTFlowMatchingPipeline.from_pretrained(
+            settings.model_path,
+            subfolder=settings.subfolder,
+            variant='fp16'
+        )
+        if settings.enable_flashvdm:
+            pipeline.enable_flashvdm()
+            logger.info('FlashVDM enabled')
+        self.estimator.configure_shape(pipeline)
+        return pipeline
+
+    def _load_texture(self) -> Hunyuan3DPaintPipeline:
+        """Load the texture generation pipeline"""
+        self._clear_model_memory("pre-texture-loading")
+        pipeline_tex = Hunyuan3DPaintPipeline.from_pretrained(settings.tex_model_path)
+        if settings.low_vram_mode:
+            pipeline_tex.enable_model_cpu_offload()
+        self.estimator.configure_texture(pipeline_tex)
+        return pipeline_tex
+
+    @staticmethod
+    def _move_texture(pipeline_tex: Hunyuan3DPaintPipeline, device: str):
+        """Move the delight and multiview diffusion pipelines between host and device"""
+        for model in pipeline_tex.models.values():
+            model.pipeline.to(device)
+
+    def _device_budget(self) -> int:
+        """Accelerator memory left for one request's activations next to the shape model"""
+        if settings.admission_device_budget:
+            return settings.admission_device_budget
+        if settings.device != 'cuda' or not torch.cuda.is_available():
+            return 0
+        total = torch.cuda.get_device_properties(0).total_memory
+        return total - self.models.residency()['models']['shape']['bytes']
+
+    def _host_budget(self) -> int:
+        """Host memory left for one request next to the host-resident models"""
+        if settings.admission_host_budget:
+            return settings.admission_host_budget
+        try:
+            total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            return 0
+        return total - self.models.residency()['host_bytes']
+
+    def _check_admission(self, params, priority: str) -> ResourceEstimate:
+        """Estimate a request, refusing it when admission control is on and it does not fit"""
+        with_txt2img = hasattr(params, 'prompt')
+        if not settings.admission_enabled:
+            return self.estimator.estimate(params, with_txt2img)
+        return self.admission.check(params, priority, with_txt2img)
+
+    def _adapt_quality(self, params):
+        """Lower a request's quality within its declared bounds when the service is loaded"""
+        if not settings.quality_adaptation:
+            return params, {}
+        priority = self._priority(params)
+        pressure = self.scheduler.queue_depth / max(settings.degrade_queue_depth, 1)
+        slo = settings.quality_slo_seconds.get(priority)
+        if slo:
+            runtime = self.estimator.estimate(params, hasattr(params, 'prompt')).runtime
+            pressure = max(pressure, (self.admission.backlog(priority) + runtime) / slo)
+        texture_defaults = {field: self.estimator.profile[field] for field in ('render_size', 'texture_size')}
+        return self.quality.apply(params, pressure, texture_defaults)
+
     def process_image_input(self, image_data: str) -> Image.Image:
         """Process base64 encoded image data"""
+        if image_data.startswith('data:image'):
+            image_data = image_data.split(',')[1]
+        try:
+            raw = base64.b64decode(image_data)
+        except Exception as e:
+            logger.error(f"Error processing image: {e}")
+            raise ValueError('Invalid image data')
+        return self.process_image_bytes(raw)
+
+    def process_image_bytes(self, image_data: bytes) -> Image.Image:
+        """Decode raw image bytes and remove the background"""
         try:
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-            image = Image.open(BytesIO(base64.b64decode(image_data)))
+            image = Image.open(BytesIO(image_data))
+            image.load()
             if image.mode == 'RGB':
-                image = self.rembg(image)
+                with self.models.use('rembg') as rembg:
+                    image = rembg(image)
             return image.convert('RGBA')
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             raise ValueError('Invalid image data')
-        
-    def start_text_to_3d_generation(self, task_id: str, params: TextTo3DRequest):
-        """Start text-to-3D generation in background thread"""
-        
-        # init task status
-        self.task_status[task_id] = {
-            "status": "pending",
-            "message": "Starting generation..."
-        }
-        
-        def generate_task():
-            try:
-                self.task_status[task_id].update({
-                    "status": "processing",
-                    "message": "Generating 3D from text..."
-                })
 
-                # generate image from text
-                image = self.txt2img(params.prompt)
+    async def preprocess_upload(self, image_data: bytes) -> Image.Image:
+        """Run upload decoding and background removal on the preprocessing pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.preprocess_pool, self.process_image_bytes, image_data)
 
-                # generate 3D model
-                mesh = self._generate_3d_model(image, params)
+    def start_text_to_3d_generation(self, task_id: str, params: TextTo3DRequest, client: str = 'anonymous') -> int:
+        """Queue text-to-3D generation and return the queue position"""
+        params, overrides = self._adapt_quality(params)
 
-                # save result
-                file_path = self._save_mesh(mesh, task_id)
+        def generate_task(timings, cancel_token):
+            # generate image from text
+            self._enter_stage(task_id, 'txt2img')
+            txt2img_start = time.time()
+            with self.scheduler.slot('txt2img', self._priority(params)), self.models.use('txt2img') as txt2img:
+                image = txt2img(params.prompt)
+            timings['txt2img_time'] = time.time() - txt2img_start
+            return self._generate_3d_model(image, params, timings, task_id=task_id, cancel_token=cancel_token)
 
-                self.task_status[task_id].update({
-                    "status": "completed",
-                    "message": "Generation completed successfully",
-                    "download_url": f"/api/v1/download/{task_id}",
-                    "file_path": file_path
-                })
+        cache_key = request_cache_key('text-to-3d', params) if self.result_cache else None
+        return self._submit_task(
+            task_id, generate_task, "Generating 3D from text...", params, cache_key, client, overrides)
+
+    def start_image_to_3d_generation(self, task_id: str, image: Image.Image, params: ImageTo3DRequest,
+                                     client: str = 'anonymous', batch_id: Optional[str] = None) -> int:
+        """Queue image-to-3D generation and return the queue position"""
+        params, overrides = self._adapt_quality(params)
+
+        def generate_task(timings, cancel_token):
+            return self._generate_3d_model(image, params, timings, task_id=task_id, cancel_token=cancel_token)
+
+        cache_key = request_cache_key('image-to-3d', params, image) if self.result_cache else None
+        return self._submit_task(
+            task_id, generate_task, "Generating 3D from image...", params, cache_key, client, overrides, batch_id)
+
+    def start_texture_from_task(self, task_id: str, source_task_id: str,
+                                overrides: Optional[Dict[str, Any]] = None, client: str = 'anonymous') -> Optional[int]:
+        """Queue a textured version of an earlier task, starting from its latest stored stage output.
+
+        Returns the queue position, or None if the source task does not exist.
+        Raises StageOutputsUnavailable when nothing of the source task was kept.
+        """
+        source = self.task_store.get(source_task_id)
+        if source is None:
+            return None
+        params = texture_request(source['params'], overrides)
+        resume, names = self._resume_state(source_task_id, source['params'], params)
+
+        def generate_task(timings, cancel_token):
+            return self._generate_3d_model(
+                resume['image'], params, timings, task_id=task_id, cancel_token=cancel_token, resume=resume)
+
+        # the follow-up keeps its own copy, so it can be followed up in turn. It is made before
+        # the job can start writing next to it, and dropped again if the task is refused
+        try:
+            self.stage_artifacts.fork(source_task_id, task_id, names)
+            return self._submit_task(
+                task_id, generate_task, f"Texturing the shape of task {source_task_id}...", params, client=client)
+        except Exception:
+            self.stage_artifacts.remove(task_id)
+            raise
+
+    def _resume_state(self, source_task_id: str, source_params: Dict[str, Any],
+                      params) -> Tuple[Dict[str, Any], List[str]]:
+        """Pipeline state restored from the latest usable stage outputs of a task, and their names"""
+        if self.stage_artifacts is None or not self.stage_artifacts.resumable(source_task_id):
+            raise StageOutputsUnavailable(f"No stored stage outputs of task {source_task_id}")
+        available = set(self.stage_artifacts.available(source_task_id))
+        # views and textures of another size have to be generated again
+        if any(source_params.get(field) != getattr(params, field) for field in ('render_size', 'texture_size')):
+            available -= {'multiviews', 'texture'}
+
+        if 'uv_mesh' in available:
+            names = ['uv_mesh'] + [name for name in ('texture', 'multiviews') if name in available][:1]
+        else:
+            names = [next(name for name in ('mesh', 'raw_mesh', 'latents') if name in available)]
+        state = {name: self.stage_artifacts.load(source_task_id, name) for name in ['image'] + names}
+        if 'latents' in state:
+            state['latents'] = torch.from_numpy(state['latents'])
+        for name in ('uv_mesh', 'raw_mesh'):
+            if name in state:
+                state['mesh'] = state.pop(name)
+        state['uv_wrapped'] = 'uv_mesh' in names
+        state['postprocessed'] = 'uv_mesh' in names or 'mesh' in names
+        logger.info(f"Resuming from {', '.join(names)} of task {source_task_id}")
+        return state, ['image'] + names
+
+    @staticmethod
+    def _priority(params) -> str:
+        """Priority class a request runs in"""
+        return getattr(params, 'priority', None) or settings.default_priority
+
+    def _submit_task(self, task_id: str, generate_fn, processing_message: str, params,
+                     cache_key: Optional[str] = None, client: str = 'anonymous',
+                     quality_overrides: Optional[Dict[str, Any]] = None, batch_id: Optional[str] = None) -> int:
+        """Register a task and hand its generation job to the scheduler"""
+        priority = self._priority(params)
 
-            except Exception as e:
-                logger.error(f"Generation error for task {task_id}: {e}")
-                self.task_status[task_id].update({
-                    "status": "error",
-                    "message": str(e)
-                })
-
-        # start generation thread
-        thread = threading.Thread(target=generate_task)
-        thread.daemon = True
-        thread.start()
-
-    def start_image_to_3d_generation(self, task_id: str, image: Image.Image, params: ImageTo3DRequest):
-        """Start image-to-3D generation in background thread"""
-        
         # init task status
-        self.task_status[task_id] = {
+        record = {
             "status": "pending",
-            "message": "Starting generation..."
+            "message": "Waiting in queue...",
+            "params": params.dict(),
+            "priority": priority,
+            "client": client,
+            "quality_overrides": quality_overrides or None,
+            "timings": {}
         }
+        if batch_id is not None:
+            record['batch_id'] = batch_id
+
+        if cache_key is not None:
+            with self._inflight_lock:
+                cached_path = self.result_cache.get(cache_key)
+                if cached_path is not None:
+                    self.task_store.create(task_id, record)
+                else:
+                    inflight = self._inflight.get(cache_key)
+                    if inflight is not None:
+                        # identical request already queued or running, share its result
+                        inflight['followers'].append(task_id)
+                        self.task_store.create(task_id, dict(
+                            record,
+                            message="Waiting for an identical request in progress...",
+                            coalesced_with=inflight['leader']
+                        ))
+                        logger.info(f"Task {task_id} coalesced with {inflight['leader']}")
+                        return self.scheduler.queue_position(inflight['leader']) or 0
+
+                    self._inflight[cache_key] = {'leader': task_id, 'followers': []}
 
-        def generate_task():
+            if cached_path is not None:
+                # linking, hashing and precompressing the result must not hold up other submissions
+                self._complete_from_file(task_id, cached_path, "Served from result cache")
+                tasks_total.inc(status='cached')
+                logger.info(f"Task {task_id} served from result cache")
+                return 0
+
+        try:
+            estimate = self._check_admission(params, priority)
+        except (QueueFullError, ResourceLimitExceeded) as e:
+            self._resolve_followers(cache_key, task_id, error=str(e))
+            raise
+        record['estimate'] = estimate.as_dict()
+
+        cancel_token = CancellationToken()
+        with self._inflight_lock:
+            self._cancel_tokens[task_id] = cancel_token
+        self.task_store.create(task_id, record)
+        self.admission.admit(task_id, estimate, priority)
+        queued_at = time.time()
+
+        def run_task():
+            timings = {'queue_wait': time.time() - queued_at}
+            queue_wait_seconds.observe(timings['queue_wait'])
+            started_at = time.time()
             try:
-                self.task_status[task_id].update({
-                    "status": "processing",
-                    "message": "Generating 3D from image..."
-                })
+                check_cancelled(cancel_token)
+                self._update_task(
+                    task_id,
+                    status="processing",
+                    message=processing_message,
+                    timings=timings
+                )
 
                 # generate 3D model
-                mesh = self._generate_3d_model(image, params)
+                mesh = generate_fn(timings, cancel_token)
+                check_cancelled(cancel_token)
 
                 # save result
-                file_path = self._save_mesh(mesh, task_id)
+                self._enter_stage(task_id, 'save')
+                file_path, etag = self._save_mesh(mesh, task_id)
+                if cache_key is not None:
+                    self.result_cache.put(cache_key, file_path)
+
+                self._update_task(
+                    task_id,
+                    status="completed",
+                    message="Generation completed successfully",
+                    download_url=f"/api/v1/download/{task_id}",
+                    file_path=file_path,
+                    etag=etag,
+                    timings=timings
+                )
+                self._resolve_followers(cache_key, task_id, file_path=file_path)
+                self.estimator.observe_task(timings)
+                task_duration_seconds.observe(time.time() - started_at, status='completed')
+                tasks_total.inc(status='completed')
 
-                self.task_status[task_id].update({
-                    "status": "completed",
-                    "message": "Generation completed successfully",
-                    "download_url": f"/api/v1/download/{task_id}",
-                    "file_path": file_path
-                })
+            except GenerationCancelled:
+                # the task record was already marked by cancel_task
+                logger.info(f"Generation of task {task_id} stopped after cancellation")
+                self._resolve_followers(cache_key, task_id, error="Cancelled")
+                task_duration_seconds.observe(time.time() - started_at, status='cancelled')
 
             except Exception as e:
                 logger.error(f"Generation error for task {task_id}: {e}")
-                self.task_status[task_id].update({
-                    "status": "error",
-                    "message": str(e)
-                })
+                self._update_task(
+                    task_id,
+                    status="error",
+                    message=str(e),
+                    timings=timings
+                )
+                self._resolve_followers(cache_key, task_id, error=str(e))
+                task_duration_seconds.observe(time.time() - started_at, status='error')
+                tasks_total.inc(status='error')
+
+            finally:
+                with self._inflight_lock:
+                    self._cancel_tokens.pop(task_id, None)
+                self.admission.release(task_id)
+                if getattr(params, 'preview', False):
+                    self.preview_pool.submit(self._remove_preview, task_id)
+
+        try:
+            return self.scheduler.submit(task_id, run_task, priority=priority, client=client)
+        except QueueFullError as e:
+            with self._inflight_lock:
+                self._cancel_tokens.pop(task_id, None)
+            self.admission.release(task_id)
+            self.task_store.delete(task_id)
+            self._resolve_followers(cache_key, task_id, error=str(e))
+            raise self.admission.rejection(str(e), priority) from e
+
+    def cancel_task(self, task_id: str) -> Optional[bool]:
+        """Cancel a task; None if it does not exist, False if it already finished.
+
+        A task coalesced onto another one is just detached from it. A leader
+        whose result other tasks are waiting for keeps computing for them;
+        otherwise its job is dropped from the queue or stopped at the next
+        diffusion step, decoding chunk or stage boundary.
+        """
+        record = self.task_store.get(task_id)
+        if record is None:
+            return None
+        if record['status'] in TERMINAL_STATUSES:
+            return False
+
+        self.stop_task(task_id)
+        self._update_task(task_id, status="cancelled", message="Cancelled by client")
+        tasks_total.inc(status='cancelled')
+        logger.info(f"Task {task_id} cancelled")
+        return True
+
+    def stop_task(self, task_id: str):
+        """Detach a task from shared work and stop its job; the caller records the cancellation"""
+        with self._inflight_lock:
+            shared = False
+            for cache_key, inflight in list(self._inflight.items()):
+                if task_id in inflight['followers']:
+                    inflight['followers'].remove(task_id)
+                    shared = True
+                elif inflight['leader'] == task_id:
+                    if inflight['followers']:
+                        shared = True
+                    else:
+                        del self._inflight[cache_key]
+            cancel_token = None if shared else self._cancel_tokens.get(task_id)
+
+        if cancel_token is not None:
+            cancel_token.cancel()
+            if self.scheduler.cancel(task_id):
+                with self._inflight_lock:
+                    self._cancel_tokens.pop(task_id, None)
+                self.admission.release(task_id)
+
+    def _complete_from_file(self, task_id: str, source_path: str, message: str):
+        """Complete a task with a copy of an already generated result"""
+        file_path = generate_file_path('glb')
+        link_or_copy_artifact(source_path, file_path)
+        # results cached before precompression was added get their variants now
+        etag = finalize_artifact(file_path, compress=settings.precompress_outputs and not sidecar_paths(file_path))
+        self.outputs.add(task_id, file_path)
+        self._update_task(
+            task_id,
+            status="completed",
+            message=message,
+            download_url=f"/api/v1/download/{task_id}",
+            file_path=file_path,
+            etag=etag,
+            cached=True
+        )
+
+    def _resolve_followers(self, cache_key: Optional[str], leader: str, file_path: Optional[str] = None,
+                           error: Optional[str] = None):
+        """Finish the tasks that were coalesced onto an in-flight computation"""
+        if cache_key is None:
+            return
+        with self._inflight_lock:
+            inflight = self._inflight.get(cache_key)
+            # a cancelled leader may already have been replaced by a newer request
+            if inflight is None or inflight['leader'] != leader:
+                return
+            del self._inflight[cache_key]
+
+        for follower_id in inflight['followers']:
+            try:
+                if error is None:
+                    self._complete_from_file(follower_id, file_path, "Generation completed successfully")
+                else:
+                    self._update_task(follower_id, status="error", message=error)
+            except Exception as e:
+                logger.error(f"Error resolving coalesced task {follower_id}: {e}")
+                self._update_task(follower_id, status="error", message=str(e))
+
+    def _update_task(self, task_id: str, **fields):
+        """Persist task fields and push status changes to progress subscribers"""
+        if fields.get('status') not in (None, 'cancelled'):
+            current = self.task_store.get(task_id)
+            if current is not None and current['status'] == 'cancelled':
+                # a cancelled task keeps its status even if its job still finishes
+                return
+        self.task_store.update(task_id, **fields)
+        if 'status' in fields:
+            progress_broker.publish(
+                task_id, 'status',
+                status=fields['status'],
+                message=fields.get('message'),
+                download_url=fields.get('download_url'),
+            )
+
+    def _on_stage(self, job: StageJob, stage: str):
+        """Stop cancelled jobs at stage boundaries and report the stage reached"""
+        check_cancelled(job.state.get('cancel_token'))
+        self._enter_stage(job.task_id, TEXTURE_STAGES.get(stage, stage))
+
+    def _enter_stage(self, task_id: Optional[str], stage: str):
+        """Record the pipeline stage a task has reached"""
+        if task_id is None:
+            return
+        self.task_store.update(task_id, stage=stage)
+        progress_broker.publish(task_id, 'stage', stage=stage)
+
+    def _shape_callbacks(self, task_id: Optional[str], num_inference_steps: int) -> Dict[str, Any]:
+        """Pipeline callbacks that stream diffusion and volume decoding progress"""
+        if task_id is None:
+            return {}
+
+        def on_step(step_idx, t, outputs):
+            progress_broker.publish(task_id, 'step', stage='shape', step=step_idx + 1, total=num_inference_steps)
+
+        last_percent = {}
+
+        def on_volume_decode(resolution, done, total):
+            # decoding runs thousands of chunks, only forward whole-percent changes
+            percent = int(done * 100 / max(total, 1))
+            if last_percent.get(resolution) == percent:
+                return
+            last_percent[resolution] = percent
+            progress_broker.publish(
+                task_id, 'decode', stage='volume_decoding', resolution=resolution, percent=percent)
+
+        return {
+            'callback': on_step,
+            'callback_steps': 1,
+            'volume_decode_callback': on_volume_decode,
+        }
+
+    def _preview_callback(self, task_id: Optional[str]):
+        """Hand preview volumes of a task to the preview writer, dropping them while it is behind"""
+        if task_id is None:
+            return None
+
+        def on_preview(step_idx, grid_logits):
+            with self._inflight_lock:
+                if task_id in self._pending_previews:
+                    return
+                self._pending_previews.add(task_id)
+            self.preview_pool.submit(self._write_preview, task_id, step_idx + 1, grid_logits)
+
+        return on_preview
+
+    def _write_preview(self, task_id: str, step: int, grid_logits: torch.Tensor):
+        """Mesh a preview volume of a task, replace its preview file and announce it"""
+        try:
+            mesh, = extract_preview_meshes(grid_logits[None], octree_resolution=settings.preview_octree_resolution)
+            if mesh is None:
+                return
+            file_path = preview_path(task_id)
+            tmp_path = f"{file_path}.tmp"
+            mesh.export(tmp_path, file_type='glb')
+            os.replace(tmp_path, file_path)
+            preview_url = f"/api/v1/preview/{task_id}?step={step}"
+            self.task_store.update(task_id, preview_url=preview_url, preview_step=step)
+            progress_broker.publish(task_id, 'preview', stage='shape', step=step, preview_url=preview_url)
+        except Exception as e:
+            logger.warning(f"Error writing preview of task {task_id}: {e}")
+        finally:
+            with self._inflight_lock:
+                self._pending_previews.discard(task_id)
+
+    def _remove_preview(self, task_id: str):
+        """Drop the preview of a finished task"""
+        try:
+            os.remove(preview_path(task_id))
+        except FileNotFoundError:
+            return
+        self.task_store.update(task_id, preview_url=None, preview_step=None)
+
+    def _run_shape_batch(self, samples: List[Dict[str, Any]]) -> List[Any]:
+        """Run one denoising loop over a batch of samples and split the latents per sample"""
+        results: List[Any] = [None] * len(samples)
+        active = []
+        for index, sample in enumerate(samples):
+            if sample['cancel_token'] is not None and sample['cancel_token'].cancelled:
+                results[index] = GenerationCancelled()
+            else:
+                active.append(index)
+        if not active:
+            return results
+        samples = [samples[index] for index in active]
+
+        def on_step(step_idx, t, outputs):
+            for sample in samples:
+                if sample['callback'] is not None:
+                    sample['callback'](step_idx, t, outputs)
+
+        # only the samples that asked for previews are decoded, they are meshed on the preview thread
+        preview_indices = [index for index, sample in enumerate(samples) if sample['preview'] is not None]
 
-        # start generation thread
-        thread = threading.Thread(target=generate_task)
-        thread.daemon = True
-        thread.start()
+        def on_preview(step_idx, grid_logits):
+            for index, sample_logits in zip(preview_indices, grid_logits):
+                samples[index]['preview'](step_idx, sample_logits)
+
+        wants_preview = settings.preview_steps > 0 and bool(preview_indices)
+
+        if len(samples) > 1:
+            logger.info(f"Running shape diffusion as a batch of {len(samples)}")
+
+        # samples of a batch share one priority class, it is part of the batch key
+        priority = samples[0]['priority']
+        preempt = None
+        if settings.enable_preemption:
+            preempt = lambda: self.scheduler.preempt_requested('shape', priority)
+
+        checkpoint = None
+        while True:
+            try:
+                with self.scheduler.slot('shape', priority), self.models.use('shape') as pipeline:
+                    latents = pipeline(
+                        image=[sample['image'] for sample in samples],
+                        num_inference_steps=samples[0]['num_inference_steps'],
+                        guidance_scale=samples[0]['guidance_scale'],
+                        generator=[torch.Generator(settings.device).manual_seed(sample['seed']) for sample in samples],
+                        output_type='latent',
+                        callback=on_step,
+                        callback_steps=1,
+                        # the shared loop only stops once every sample in it is cancelled
+                        cancel_token=CombinedCancellationToken([sample['cancel_token'] for sample in samples]),
+                        preempt=preempt,
+                        resume_from=checkpoint,
+                        preview_callback=on_preview if wants_preview else None,
+                        preview_steps=settings.preview_steps,
+                        preview_octree_resolution=settings.preview_octree_resolution,
+                        preview_indices=preview_indices,
+                        preview_budget=settings.preview_budget,
+                    )
+                break
+            except GenerationPreempted as e:
+                # latents and scheduler state are parked on the host until the slot frees up again
+                checkpoint = e.checkpoint
+                preemptions_total.inc(priority=priority)
+                logger.info(f"Shape diffusion of {len(samples)} {priority} sample(s) "
+                            f"preempted at step {checkpoint['step']}")
+        for index, sample_latents in zip(active, latents.split(1)):
+            results[index] = sample_latents
+        return results
 
     def _clear_model_memory(self, model_name: str):
         """Clear memory for specific model if not in use"""
@@ -185,63 +810,312 @@ class GenerationService:
             torch.cuda.empty_cache()
             gc.collect()
 
-    def _generate_3d_model(self, image: Image.Image, params) -> trimesh.Trimesh:
-        """Internal method to generate 3D model"""
-        start_time = time.time()
+    @staticmethod
+    def _shape_workers() -> int:
+        # several shape workers let the micro-batcher see concurrent requests, the extra
+        # ones keep urgent jobs from queueing behind parked long jobs
+        return settings.shape_batch_size + settings.interactive_workers
 
-        # generation shape
-        generator = torch.Generator(settings.device).manual_seed(params.seed)
-        shape_params = {
-            'image': image,
-            'num_inference_steps': params.num_inference_steps,
-            'octree_resolution': params.octree_resolution,
-            'num_chunks': params.num_chunks,
-            'generator': generator,
-            'output_type': params.output_type
-        }
+    def _build_stage_pipeline(self) -> StagePipeline:
+        """Chain the generation stages so consecutive jobs overlap on accelerator and CPU"""
+        wants_texture = lambda job: getattr(job.state['params'], 'enable_texture', True)
+        # stages whose output a follow-up request already brings along are skipped
+        shape_stages = [
+            Stage('shape', self._shape_stage, workers=self._shape_workers(),
+                  when=lambda job: 'mesh' not in job.state),
+            Stage('postprocess', self._postprocess_stage, when=lambda job: not job.state.get('postprocessed')),
+        ]
+        texture_stages = [
+            Stage('uv_wrap', self._uv_wrap_stage, when=wants_texture),
+            Stage('multiview', self._multiview_stage,
+                  when=lambda job: wants_texture(job) and self._needs_multiview(job)),
+            Stage('bake', self._bake_stage, when=lambda job: wants_texture(job) and 'texture' not in job.state),
+            Stage('export', self._export_stage, when=wants_texture),
+        ]
+        if settings.process_role == 'shape-worker':
+            # one waiting thread per job out on a texture worker
+            stages = shape_stages + [
+                Stage('texture_handoff', self._texture_handoff_stage, workers=settings.generation_workers,
+                      when=wants_texture),
+            ]
+        elif settings.process_role == 'texture-worker':
+            stages = texture_stages
+        else:
+            stages = shape_stages + texture_stages
+        return StagePipeline(
+            stages,
+            queue_size=settings.stage_queue_size,
+            on_stage=self._on_stage,
+            name='generation-stages',
+        )
+
+    def _shape_stage(self, job: StageJob):
+        """Denoise the shape latents and decode them into a mesh"""
+        params = job.state['params']
+        callbacks = self._shape_callbacks(job.task_id, params.num_inference_steps)
+        cancel_token = job.state.get('cancel_token')
 
         self._clear_model_memory("pre-shape-generation")
 
-        mesh = self.pipeline(**shape_params)[0]
-        shape_time = time.time() - start_time
-        logger.info(f"Shape generation completed in {shape_time:.2f}s")
+        latents = job.state.pop('latents', None)
+        if latents is None:
+            sample = {
+                'image': job.state['image'],
+                'seed': params.seed,
+                'num_inference_steps': params.num_inference_steps,
+                'guidance_scale': params.guidance_scale,
+                'callback': callbacks.get('callback'),
+                'cancel_token': cancel_token,
+                'priority': job.state['priority'],
+                'preview': self._preview_callback(job.task_id) if getattr(params, 'preview', False) else None,
+            }
+            # diffusion is micro-batched with compatible requests, decoding runs per task
+            latents = self.shape_batcher.submit(
+                (params.num_inference_steps, params.guidance_scale, sample['priority']), sample
+            ).result()
+            self._keep(job, 'latents', latents)
+        check_cancelled(cancel_token)
+        with self.scheduler.slot('shape', job.state['priority']), self.models.use('shape') as pipeline:
+            decode_start = time.time()
+            job.state['mesh'] = pipeline._export(
+                latents.to(pipeline.device, pipeline.dtype),
+                output_type=params.output_type,
+                num_chunks=params.num_chunks,
+                octree_resolution=params.octree_resolution,
+                mc_algo=None,
+                volume_decode_callback=callbacks.get('volume_decode_callback'),
+                cancel_token=cancel_token,
+            )[0]
+            self.estimator.observe_decode(params, time.time() - decode_start)
+        self._keep(job, 'raw_mesh', job.state['mesh'])
 
         self._clear_model_memory("shape-generation")
 
-        # apply mesh processing
+    def _postprocess_stage(self, job: StageJob):
+        """Clean up the raw mesh"""
+        mesh = job.state['mesh']
         mesh = self.floater_remover(mesh)
         mesh = self.degenerate_face_remover(mesh)
-        mesh = self.face_reducer(mesh)
+        job.state['mesh'] = self.face_reducer(mesh)
+        job.state['postprocessed'] = True
+        self._keep(job, 'mesh', job.state['mesh'])
+
+    def _uv_wrap_stage(self, job: StageJob):
+        """UV-unwrap the mesh and render the multiview conditioning maps"""
+        # taking the model here also gets it loaded before the multiview stage needs it
+        params = job.state['params']
+        needs_multiview = self._needs_multiview(job)
+        with self.models.use('texture') as pipeline_tex:
+            if needs_multiview:
+                job.state['images_prompt'] = pipeline_tex.prepare_images(job.state['image'])
+            config = pipeline_tex.config
+            if getattr(params, 'render_size', None) or getattr(params, 'texture_size', None):
+                config = copy.copy(config)
+                config.render_size = params.render_size or config.render_size
+                config.texture_size = params.texture_size or config.texture_size
+            baker = TextureBaker(config)
+        if job.state.get('uv_wrapped'):
+            baker.load_mesh(job.state['mesh'])
+        else:
+            job.state['mesh'] = baker.uv_unwrap(job.state['mesh'])
+            self._keep(job, 'uv_mesh', job.state['mesh'])
+        if needs_multiview:
+            job.state['control_maps'] = baker.render_maps()
+        job.state['baker'] = baker
 
-        # apply texture
-        if getattr(params, 'enable_texture', True):
-            self._clear_model_memory("pre-texture-generation")
+    @staticmethod
+    def _needs_multiview(job: StageJob) -> bool:
+        # follow-ups of a task may start with its multiviews or baked texture
+        return 'multiviews' not in job.state and 'texture' not in job.state
 
-            texture_start = time.time()
-            mesh = self.pipeline_tex(mesh, image)
-            texture_time = time.time() - texture_start
-            logger.info(f"Texture generation completed in {texture_time:.2f}s")
+    def _multiview_stage(self, job: StageJob):
+        """Delight the prompt image and generate the multiview images"""
+        self._clear_model_memory("pre-texture-generation")
+        with self.scheduler.slot('texture', job.state['priority']), self.models.use('texture') as pipeline_tex:
+            images_prompt = pipeline_tex.delight(job.state.pop('images_prompt'))
+            job.state['multiviews'] = pipeline_tex.multiview(
+                images_prompt, job.state.pop('control_maps'), cancel_token=job.state.get('cancel_token'),
+                render_size=job.state['baker'].config.render_size)
+        self._keep(job, 'multiviews', job.state['multiviews'])
+        self._clear_model_memory("texture-generation")
 
-            self._clear_model_memory("texture-generation")
+    def _bake_stage(self, job: StageJob):
+        """Bake the multiview images into the UV texture and inpaint the holes"""
+        baker = job.state['baker']
+        texture, mask_np = baker.bake(job.state.pop('multiviews'))
+        job.state['texture'] = baker.texture_inpaint(texture, mask_np)
+        self._keep(job, 'texture', job.state['texture'])
+
+    def _export_stage(self, job: StageJob):
+        """Attach the texture to the mesh"""
+        job.state['mesh'] = job.state.pop('baker').export(job.state.pop('texture'))
+
+    def _keep(self, job: StageJob, name: str, value: Any):
+        """Store a stage output of the job's task for follow-up requests"""
+        if self.stage_artifacts is None or job.task_id is None:
+            return
+        try:
+            self.stage_artifacts.save(job.task_id, name, value)
+        except Exception as e:
+            logger.warning(f"Error storing {name} of task {job.task_id}: {e}")
+
+    def _texture_handoff_stage(self, job: StageJob):
+        """Texture the mesh on a texture worker, passing the mesh and image through shared memory"""
+        task_id = job.task_id or uuid.uuid4().hex
+        job_id = f"{task_id}:{TEXTURE_KIND}"
+        inputs, outputs = segment_name(task_id, 'in'), segment_name(task_id, 'out')
+        # leftovers of an earlier run of this task on a worker that died
+        self.job_queue.finish(job_id)
+        unlink_segment(inputs)
+        unlink_segment(outputs)
+
+        arrays = mesh_to_arrays(job.state['mesh'])
+        arrays['image'] = np.asarray(job.state['image'])
+        payload = {
+            'task_id': job.task_id,
+            'request': 'text-to-3d' if isinstance(job.state['params'], TextTo3DRequest) else 'image-to-3d',
+            'params': job.state['params'].dict(),
+            'priority': job.state['priority'],
+            'inputs': pack_arrays(inputs, arrays),
+            'outputs': outputs,
+            # outputs of a follow-up's source task, the texture worker reads them from the stage store
+            'restore': [name for name in ('multiviews', 'texture') if name in job.state],
+            'uv_wrapped': job.state.get('uv_wrapped', False),
+        }
+        try:
+            self.job_queue.enqueue(job_id, TEXTURE_KIND, payload, priority=job.state['priority'])
+            result = self._await_texture(job_id, outputs, job.state.get('cancel_token'))
+        finally:
+            unlink_segment(inputs)
+
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        try:
+            job.state['mesh'] = mesh_from_arrays(unpack_arrays(result['mesh']))
+        finally:
+            unlink_segment(outputs)
+        job.timings.update(result['timings'])
+
+    def _await_texture(self, job_id: str, outputs: str,
+                       cancel_token: Optional[CancellationToken]) -> Dict[str, Any]:
+        """Wait for the result of a texture job, cancelling it with the task"""
+        while True:
+            try:
+                check_cancelled(cancel_token)
+            except GenerationCancelled:
+                self.job_queue.cancel(job_id)
+                # a result that came in before the flag is ours to clean up, later ones the worker's
+                if self.job_queue.result(job_id)[0] == 'done':
+                    self.job_queue.finish(job_id)
+                    unlink_segment(outputs)
+                raise
+
+            state, result = self.job_queue.result(job_id)
+            if state is None:
+                raise RuntimeError('Texture job was lost')
+            if state == 'done':
+                self.job_queue.finish(job_id)
+                return result
+            time.sleep(settings.job_poll_interval)
+
+    def texture_mesh(self, task_id: Optional[str], mesh: trimesh.Trimesh, image: Image.Image, params,
+                     timings: Dict[str, float], cancel_token: Optional[CancellationToken] = None,
+                     resume: Optional[Dict[str, Any]] = None) -> trimesh.Trimesh:
+        """Run the texture stages on a mesh generated by a shape worker"""
+        priority = self._priority(params)
+        state = dict(resume or {}, image=image, params=params, cancel_token=cancel_token, priority=priority, mesh=mesh)
+        state = self.stages.run(task_id, state, timings, priority=priority_rank(priority))
+        return state['mesh']
+
+    def _generate_3d_model(self, image: Image.Image, params,
+                           timings: Optional[Dict[str, float]] = None,
+                           task_id: Optional[str] = None,
+                           cancel_token: Optional[CancellationToken] = None,
+                           resume: Optional[Dict[str, Any]] = None) -> trimesh.Trimesh:
+        """Internal method to generate 3D model, from scratch or from the restored `resume` state"""
+        timings = {} if timings is None else timings
+        start_time = time.time()
+
+        priority = self._priority(params)
+        if resume is None and task_id is not None and self.stage_artifacts is not None:
+            try:
+                self.stage_artifacts.save(task_id, 'image', image)
+            except Exception as e:
+                logger.warning(f"Error storing image of task {task_id}: {e}")
+        state = dict(resume or {}, image=image, params=params, cancel_token=cancel_token, priority=priority)
+        state = self.stages.run(task_id, state, timings, priority=priority_rank(priority))
+
+        if 'shape_time' in timings:
+            logger.info(f"Shape generation completed in {timings['shape_time']:.2f}s")
+        texture_times = [timings[f"{stage}_time"] for stage in TEXTURE_STAGES if f"{stage}_time" in timings]
+        if texture_times:
+            timings['texture_time'] = sum(texture_times)
+            logger.info(f"Texture generation completed in {timings['texture_time']:.2f}s")
 
         total_time = time.time() - start_time
+        timings['total_time'] = total_time
         logger.info(f"Total generation time: {total_time:.2f}s")
 
-        return mesh
-    
-    def _save_mesh(self, mesh: trimesh.Trimesh, task_id: str, file_type: str = 'glb') -> str:
-        """Save mesh to file"""
+        return state['mesh']
+
+    def _save_mesh(self, mesh: trimesh.Trimesh, task_id: str, file_type: str = 'glb') -> Tuple[str, str]:
+        """Save mesh to file with its precompressed variants, return the path and content hash"""
         file_path = generate_file_path(file_type)
         mesh.export(file_path)
-        return file_path
+        etag = finalize_artifact(file_path, compress=settings.precompress_outputs)
+        self.outputs.add(task_id, file_path)
+        return file_path, etag
     
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """Get status of a generation task"""
-        return self.task_status.get(task_id, {"status": "not_found"})
+        status = self.task_store.get(task_id)
+        if status is None:
+            return {"status": "not_found"}
+
+        status['task_id'] = task_id
+        queued_id = status.get('coalesced_with', task_id)
+        if status['status'] == 'pending':
+            status['queue_position'] = self.scheduler.queue_position(queued_id)
+        if status['status'] in ('pending', 'processing'):
+            status['eta'] = self.admission.eta(queued_id)
+        return status
     
     def get_file_path(self, task_id: str) -> str:
-        """Get file path for completed task"""
-        status = self.task_status.get(task_id, {})
-        return status.get('file_path', '')
+        """Get file path for completed task and mark it as recently used"""
+        status = self.task_store.get(task_id) or {}
+        file_path = status.get('file_path') or ''
+        if file_path:
+            self.outputs.touch(task_id)
+        return file_path
+
+    @property
+    def queue_depth(self) -> int:
+        return self.scheduler.queue_depth
+
+    def shutdown(self):
+        """Stop the job threads and close the stores"""
+        self.scheduler.shutdown()
+        self.stages.shutdown()
+        self.shape_batcher.shutdown()
+        self.preprocess_pool.shutdown(wait=False)
+        self.preview_pool.shutdown(wait=False)
+        if self.stage_artifacts is not None:
+            self.stage_artifacts.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.outputs.close()
+        self.task_store.close()
+        if self.job_queue is not None:
+            self.job_queue.close()
+
+    def _mark_evicted(self, task_id: str):
+        """Record on the task that its artifact was garbage collected"""
+        self.task_store.update(
+            task_id,
+            evicted=True,
+            file_path=None,
+            download_url=None,
+            message="Result was evicted from storage"
+        )
     
 generation_service = GenerationService()
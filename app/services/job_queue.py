@@ -0,0 +1,246 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.services.scheduler import DEFAULT_PRIORITY, priority_rank
+from app.utils.logger import logger
+
+# jobs submitted through the API, and the texture half of a task handed on by a shape worker
+GENERATION_KINDS = ('text-to-3d', 'image-to-3d', 'texture-from-task')
+TEXTURE_KIND = 'texture'
+
+
+class JobQueue:
+    """Job queue, progress event log and worker registry shared between processes through SQLite.
+
+    API processes enqueue jobs and read progress events; generation workers
+    claim jobs, publish events and heartbeat. A claimed job stays in the
+    queue until its task finishes, so the jobs of a worker that stops
+    heartbeating can be handed to another one. Cancelling a claimed job
+    flags it for its worker to stop. Workers only claim the job kinds they
+    run; a job whose requester waits for its outcome is completed with a
+    result instead of being deleted, and the requester finishes it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'task_id TEXT UNIQUE NOT NULL, '
+            'kind TEXT NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'rank INTEGER NOT NULL, '
+            'client TEXT NOT NULL, '
+            'state TEXT NOT NULL, '
+            'not_before REAL NOT NULL, '
+            'worker_id TEXT, '
+            'cancel_requested INTEGER NOT NULL DEFAULT 0, '
+            'result TEXT, '
+            'created_at REAL NOT NULL)'
+        )
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+        if 'result' not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN result TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, rank, id)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'task_id TEXT NOT NULL, '
+            'event TEXT NOT NULL, '
+            'data TEXT NOT NULL, '
+            'created_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS workers ('
+            'worker_id TEXT PRIMARY KEY, '
+            'info TEXT NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+
+    def enqueue(self, task_id: str, kind: str, payload: Dict[str, Any],
+                priority: str = DEFAULT_PRIORITY, client: str = 'anonymous'):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (task_id, kind, payload, rank, client, state, not_before, created_at) '
+                "VALUES (?, ?, ?, ?, ?, 'queued', 0, ?)",
+                (task_id, kind, json.dumps(payload), priority_rank(priority), client, time.time())
+            )
+
+    def claim(self, worker_id: str, limit: int, kinds: Iterable[str]) -> List[Dict[str, Any]]:
+        """Take up to `limit` due jobs of the given kinds, most urgent first"""
+        kinds = list(kinds)
+        if limit <= 0 or not kinds:
+            return []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    f"SELECT id, task_id, kind, payload, client FROM jobs "
+                    f"WHERE state = 'queued' AND not_before <= ? AND kind IN ({', '.join('?' * len(kinds))}) "
+                    f"ORDER BY rank, id LIMIT ?",
+                    (time.time(), *kinds, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET state = 'claimed', worker_id = ? WHERE id = ?",
+                    [(worker_id, row[0]) for row in rows]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [
+            {'task_id': task_id, 'kind': kind, 'payload': json.loads(payload), 'client': client}
+            for _, task_id, kind, payload, client in rows
+        ]
+
+    def retry(self, task_id: str, delay: float):
+        """Put a claimed job back in the queue, due after `delay` seconds"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_id = NULL, not_before = ? WHERE task_id = ?",
+                (time.time() + delay, task_id)
+            )
+
+    def complete(self, task_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Hand a claimed job's result to its requester; False if it was cancelled or is no longer ours"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = 'done', result = ? "
+                "WHERE task_id = ? AND worker_id = ? AND state = 'claimed' AND cancel_requested = 0",
+                (json.dumps(result), task_id, worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def result(self, task_id: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """State of a job and its result once done; (None, None) without a job"""
+        with self._lock:
+            row = self._conn.execute('SELECT state, result FROM jobs WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def finish(self, task_id: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE task_id = ?', (task_id,))
+
+    def cancel(self, task_id: str) -> Optional[str]:
+        """Drop a queued job or flag a claimed one for its worker: 'dropped', 'flagged' or None without a job"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE task_id = ? AND state = 'queued'", (task_id,))
+            if cursor.rowcount:
+                return 'dropped'
+            cursor = self._conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE task_id = ?', (task_id,))
+            return 'flagged' if cursor.rowcount else None
+
+    def cancel_requests(self, worker_id: str) -> List[str]:
+        """Claimed jobs of a worker whose cancellation was requested since the last call"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT task_id FROM jobs WHERE worker_id = ? AND cancel_requested = 1', (worker_id,)
+            ).fetchall()
+            self._conn.executemany(
+                'UPDATE jobs SET cancel_requested = 2 WHERE task_id = ?', rows
+            )
+        return [row[0] for row in rows]
+
+    def claimed(self, worker_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id FROM jobs WHERE worker_id = ? AND state = 'claimed'", (worker_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def position(self, task_id: str, kinds: Iterable[str] = GENERATION_KINDS) -> Optional[int]:
+        """1-based position of a queued job among the queued jobs of `kinds`, or None if it is not waiting"""
+        kinds = list(kinds)
+        placeholders = ', '.join('?' * len(kinds))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rank, id FROM jobs WHERE task_id = ? AND state = 'queued'", (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND kind IN ({placeholders}) "
+                f"AND (rank < ? OR (rank = ? AND id < ?))",
+                (*kinds, row[0], row[0], row[1])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def depth(self, kinds: Iterable[str] = GENERATION_KINDS) -> int:
+        kinds = list(kinds)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND kind IN ({', '.join('?' * len(kinds))})",
+                kinds
+            ).fetchone()[0]
+
+    def heartbeat(self, worker_id: str, info: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO workers (worker_id, info, updated_at) VALUES (?, ?, ?)',
+                (worker_id, json.dumps(info), time.time())
+            )
+
+    def workers(self, max_age: float) -> Dict[str, Dict[str, Any]]:
+        """Info of the workers that heartbeat within `max_age` seconds"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT worker_id, info FROM workers WHERE updated_at >= ?', (time.time() - max_age,)
+            ).fetchall()
+        return {worker_id: json.loads(info) for worker_id, info in rows}
+
+    def reclaim_stale(self, max_age: float) -> int:
+        """Requeue the jobs of workers that stopped heartbeating and forget those workers"""
+        deadline = time.time() - max_age
+        live = "SELECT worker_id FROM workers WHERE updated_at >= ?"
+        with self._lock:
+            # cancelled jobs are not worth running again
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE state = 'claimed' AND cancel_requested > 0 AND worker_id NOT IN ({live})",
+                (deadline,)
+            )
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET state = 'queued', worker_id = NULL "
+                f"WHERE state = 'claimed' AND worker_id NOT IN ({live})",
+                (deadline,)
+            )
+            self._conn.execute('DELETE FROM workers WHERE updated_at < ?', (deadline,))
+        if cursor.rowcount:
+            logger.info(f"Requeued {cursor.rowcount} job(s) of unresponsive workers")
+        return cursor.rowcount
+
+    def publish_event(self, task_id: str, event: str, data: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO events (task_id, event, data, created_at) VALUES (?, ?, ?, ?)',
+                (task_id, event, json.dumps(data), time.time())
+            )
+
+    def last_event_id(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def events_since(self, last_id: int, limit: int = 1000) -> List[tuple]:
+        """(id, task_id, event, data) of the events published after `last_id`"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, task_id, event, data FROM events WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit)
+            ).fetchall()
+        return [(event_id, task_id, event, json.loads(data)) for event_id, task_id, event, data in rows]
+
+    def prune_events(self, max_age: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM events WHERE created_at < ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
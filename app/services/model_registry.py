@@ -0,0 +1,258 @@
+import gc
+import itertools
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+from app.utils.logger import logger
+
+UNLOADED = 'unloaded'
+LOADING = 'loading'
+HOST = 'host'
+DEVICE = 'device'
+
+
+def _collect_modules(obj, modules: List[torch.nn.Module], visited: set, depth: int):
+    if depth > 5 or id(obj) in visited or isinstance(obj, (types.ModuleType, type)):
+        return
+    visited.add(id(obj))
+    if isinstance(obj, torch.nn.Module):
+        modules.append(obj)
+        return
+    if isinstance(obj, dict):
+        values = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    elif hasattr(obj, '__dict__'):
+        values = vars(obj).values()
+    else:
+        return
+    for value in list(values):
+        _collect_modules(value, modules, visited, depth + 1)
+
+
+def model_bytes(model: Any) -> int:
+    """Bytes held by the parameters and buffers of the torch modules reachable from `model`"""
+    modules: List[torch.nn.Module] = []
+    _collect_modules(model, modules, set(), 0)
+    tensors = {}
+    for module in modules:
+        for tensor in itertools.chain(module.parameters(), module.buffers()):
+            tensors[id(tensor)] = tensor.numel() * tensor.element_size()
+    return sum(tensors.values())
+
+
+class ModelEntry:
+    """Registration and residency state of one model"""
+
+    def __init__(self, name: str, load: Callable[[], Any],
+                 to_device: Optional[Callable[[Any, str], None]] = None, uses_device: bool = True):
+        self.name = name
+        self.load = load
+        # moves a loaded model between host and device; None means it can only be unloaded
+        self.to_device = to_device
+        # host-only models never occupy the device budget
+        self.uses_device = uses_device
+        self.model = None
+        self.state = UNLOADED
+        self.size = 0
+        self.pins = 0
+        self.last_used = 0.0
+        self.load_time: Optional[float] = None
+
+
+class ModelRegistry:
+    """Load models on first use and keep the resident ones within a memory budget.
+
+    A model is unloaded, on the host, or on the device. `use(name)` pins a
+    model on the device (loading it if needed) for the duration of the block.
+    Making room evicts the least recently used unpinned models: to host
+    memory when they can be moved there and the host budget allows,
+    otherwise out of memory entirely. When every resident model is pinned,
+    callers wait until one is released.
+
+    `max_device_models` caps the number of device-resident models; the byte
+    budgets use sizes measured at load time. A budget of 0 means unlimited.
+    """
+
+    def __init__(self, device: str, max_device_models: int = 0, device_budget: int = 0, host_budget: int = 0):
+        self.device = device
+        self.max_device_models = max_device_models
+        self.device_budget = device_budget
+        self.host_budget = host_budget
+        self._entries: Dict[str, ModelEntry] = {}
+        self._cond = threading.Condition()
+
+    def register(self, name: str, load: Callable[[], Any],
+                 to_device: Optional[Callable[[Any, str], None]] = None, uses_device: bool = True):
+        with self._cond:
+            self._entries[name] = ModelEntry(name, load, to_device, uses_device)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    @contextmanager
+    def use(self, name: str):
+        """Pin a model where it runs for the duration of the block"""
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def acquire(self, name: str) -> Any:
+        entry = self._entries[name]
+        with self._cond:
+            while not self._reserve(entry):
+                self._cond.wait()
+            entry.pins += 1
+            entry.last_used = time.time()
+            needs_load = entry.state == UNLOADED
+            if needs_load:
+                entry.state = LOADING
+            elif entry.state == HOST and entry.uses_device:
+                self._place(entry, DEVICE)
+
+        if needs_load:
+            self._load(entry)
+        return entry.model
+
+    def release(self, name: str):
+        entry = self._entries[name]
+        with self._cond:
+            entry.pins -= 1
+            entry.last_used = time.time()
+            self._cond.notify_all()
+
+    def preload(self, names: List[str]):
+        """Warm the given models in the background"""
+
+        def preload_loop():
+            for name in names:
+                if name not in self._entries:
+                    logger.warning(f"Cannot preload unknown model {name}")
+                    continue
+                try:
+                    with self.use(name):
+                        pass
+                except Exception as e:
+                    logger.error(f"Error preloading model {name}: {e}")
+
+        thread = threading.Thread(target=preload_loop, name='model-preload')
+        thread.daemon = True
+        thread.start()
+
+    def residency(self) -> Dict[str, Any]:
+        """Snapshot of where each model lives and the memory it takes"""
+        with self._cond:
+            models = {
+                name: {
+                    'state': entry.state,
+                    'bytes': entry.size,
+                    'in_use': entry.pins,
+                    'last_used': entry.last_used or None,
+                    'load_time': entry.load_time,
+                }
+                for name, entry in self._entries.items()
+            }
+            return {
+                'models': models,
+                'device_bytes': sum(e.size for e in self._device_resident()),
+                'host_bytes': sum(e.size for e in self._host_resident()),
+                'max_device_models': self.max_device_models,
+                'device_budget': self.device_budget,
+                'host_budget': self.host_budget,
+            }
+
+    def _load(self, entry: ModelEntry):
+        logger.info(f"Loading model {entry.name}...")
+        start = time.time()
+        try:
+            model = entry.load()
+            size = model_bytes(model)
+        except Exception:
+            with self._cond:
+                entry.state = UNLOADED
+                entry.pins -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            entry.model = model
+            entry.size = size
+            entry.load_time = time.time() - start
+            entry.state = DEVICE if entry.uses_device else HOST
+            self._enforce_host_budget()
+            self._cond.notify_all()
+        logger.info(f"Model {entry.name} loaded in {entry.load_time:.2f}s ({size / 1024 ** 2:.0f} MiB)")
+
+    def _device_resident(self) -> List[ModelEntry]:
+        # loading models count with the size measured on their previous load
+        return [e for e in self._entries.values() if e.uses_device and e.state in (DEVICE, LOADING)]
+
+    def _host_resident(self) -> List[ModelEntry]:
+        return [e for e in self._entries.values() if e.state == HOST]
+
+    def _fits(self, entry: ModelEntry, resident: List[ModelEntry]) -> bool:
+        if not resident:
+            # a model alone on the device is always allowed, even over budget
+            return True
+        if self.max_device_models > 0 and len(resident) + 1 > self.max_device_models:
+            return False
+        if self.device_budget > 0 and sum(e.size for e in resident) + entry.size > self.device_budget:
+            return False
+        return True
+
+    def _reserve(self, entry: ModelEntry) -> bool:
+        """Make room for `entry` where it runs; False if the caller has to wait"""
+        if entry.state == LOADING:
+            return False
+        if not entry.uses_device or entry.state == DEVICE:
+            return True
+
+        while True:
+            resident = [e for e in self._device_resident() if e is not entry]
+            if self._fits(entry, resident):
+                return True
+            victims = sorted((e for e in resident if e.state == DEVICE and e.pins == 0), key=lambda e: e.last_used)
+            if not victims:
+                return False
+            self._evict(victims[0])
+
+    def _evict(self, entry: ModelEntry):
+        fits_host = self.host_budget <= 0 or \
+            sum(e.size for e in self._host_resident()) + entry.size <= self.host_budget
+        if entry.to_device is not None and fits_host:
+            self._place(entry, HOST)
+            self._enforce_host_budget()
+        else:
+            self._unload(entry)
+
+    def _enforce_host_budget(self):
+        if self.host_budget <= 0:
+            return
+        for victim in sorted(self._host_resident(), key=lambda e: e.last_used):
+            if sum(e.size for e in self._host_resident()) <= self.host_budget:
+                return
+            if victim.pins == 0:
+                self._unload(victim)
+
+    def _place(self, entry: ModelEntry, state: str):
+        start = time.time()
+        entry.to_device(entry.model, self.device if state == DEVICE else 'cpu')
+        entry.state = state
+        if state == HOST and self.device == 'cuda':
+            torch.cuda.empty_cache()
+        logger.info(f"Moved model {entry.name} to {state} in {time.time() - start:.2f}s")
+
+    def _unload(self, entry: ModelEntry):
+        entry.model = None
+        entry.state = UNLOADED
+        gc.collect()
+        if self.device == 'cuda':
+            torch.cuda.empty_cache()
+        logger.info(f"Unloaded model {entry.name}")
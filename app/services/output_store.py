@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+from app.utils.file_utils import artifact_size, remove_artifact, SIDECAR_SUFFIXES
+from app.utils.logger import logger
+
+
+class OutputStore:
+    """Index of generated artifacts under a byte quota and a maximum age.
+
+    Every artifact is recorded with its task id, size and last access time
+    in a SQLite index, so garbage collection never lists the output
+    directory. A background thread evicts expired artifacts, then the least
+    recently accessed ones until the total size fits the quota, at most
+    `batch_size` per round. The index is shared by every process, so the
+    total is summed and the victims are claimed in one transaction.
+    `on_evict(task_id)` is called for every evicted artifact so the owning
+    task can be marked accordingly.
+    """
+
+    def __init__(self, output_dir: str, db_path: str, max_bytes: int, max_age: float,
+                 gc_interval: float = 60, batch_size: int = 100,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        self.batch_size = batch_size
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._collector = None
+
+        new_index = not os.path.exists(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS artifacts ('
+            'path TEXT PRIMARY KEY, '
+            'task_id TEXT, '
+            'size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_task_id ON artifacts (task_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_last_access ON artifacts (last_access)')
+        if new_index:
+            self._adopt_existing_files()
+
+    def _adopt_existing_files(self):
+        # outputs written before the index existed are tracked without a task
+        rows = []
+        for entry in os.scandir(self.output_dir):
+            if entry.is_file() and not entry.name.endswith(tuple(SIDECAR_SUFFIXES.values())):
+                stat = entry.stat()
+                rows.append((entry.path, None, artifact_size(entry.path), stat.st_mtime, stat.st_mtime))
+        with self._lock:
+            self._conn.executemany('INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?, ?)', rows)
+        if rows:
+            logger.info(f"Output store adopted {len(rows)} existing file(s)")
+
+    def add(self, task_id: str, file_path: str):
+        """Record a freshly written artifact of a task, its precompressed variants count towards its size"""
+        size = artifact_size(file_path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)',
+                (file_path, task_id, size, now, now)
+            )
+
+    def touch(self, task_id: str):
+        """Mark the artifacts of a task as just accessed"""
+        with self._lock:
+            self._conn.execute('UPDATE artifacts SET last_access = ? WHERE task_id = ?', (time.time(), task_id))
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM artifacts WHERE task_id = ? LIMIT 1', (task_id,)).fetchone()
+        return row is not None
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+
+    def collect(self) -> int:
+        """Run one eviction round and return the number of evicted artifacts"""
+        deadline = time.time() - self.max_age
+        with self._lock:
+            # other processes add and evict against the same index, claim the victims atomically
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+                victims = self._conn.execute(
+                    'SELECT * FROM artifacts WHERE last_access < ? ORDER BY last_access LIMIT ?',
+                    (deadline, self.batch_size)
+                ).fetchall()
+                if len(victims) < self.batch_size and total_bytes > self.max_bytes:
+                    excess = total_bytes - self.max_bytes - sum(row[2] for row in victims)
+                    expired = {row[0] for row in victims}
+                    for row in self._conn.execute(
+                        'SELECT * FROM artifacts ORDER BY last_access LIMIT ?',
+                        (self.batch_size,)
+                    ):
+                        if excess <= 0 or len(victims) >= self.batch_size:
+                            break
+                        if row[0] in expired:
+                            continue
+                        victims.append(row)
+                        excess -= row[2]
+                self._conn.executemany('DELETE FROM artifacts WHERE path = ?', [(row[0],) for row in victims])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self._evict(victims)
+
+    def _evict(self, victims: List[tuple]) -> int:
+        evicted = 0
+        for row in victims:
+            path, task_id = row[0], row[1]
+            try:
+                remove_artifact(path)
+            except OSError as e:
+                logger.error(f"Error evicting output {path}: {e}")
+                # back into the index so a later round retries it
+                with self._lock:
+                    self._conn.execute('INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?, ?)', row)
+                continue
+            evicted += 1
+            if task_id is not None and self.on_evict is not None:
+                try:
+                    self.on_evict(task_id)
+                except Exception as e:
+                    logger.error(f"Error marking task {task_id} as evicted: {e}")
+        return evicted
+
+    def start_gc(self):
+        """Evict artifacts incrementally in a background thread"""
+        if self._collector is not None:
+            return
+
+        def gc_loop():
+            while not self._stop.wait(self.gc_interval):
+                try:
+                    # keep going while rounds come back full, otherwise wait for the next tick
+                    evicted = self.collect()
+                    total = evicted
+                    while evicted >= self.batch_size and not self._stop.is_set():
+                        evicted = self.collect()
+                        total += evicted
+                    if total:
+                        logger.info(f"Evicted {total} output artifact(s)")
+                except Exception as e:
+                    logger.error(f"Error collecting outputs: {e}")
+
+        self._collector = threading.Thread(target=gc_loop, name='output-store-gc')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
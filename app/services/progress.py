@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.utils.logger import logger
+
+
+class ProgressBroker:
+    """Fan out progress events from generation threads to asyncio subscribers.
+
+    Publishers run on worker threads; each subscriber owns an asyncio queue
+    bound to its event loop, so events are handed over with
+    `call_soon_threadsafe` and never block the publishing thread. Sinks
+    receive every event, subscribed or not, to forward them to other
+    processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(list)
+        self._sinks: List[Callable[[str, str, Dict[str, Any]], None]] = []
+
+    def add_sink(self, sink: Callable[[str, str, Dict[str, Any]], None]):
+        """Call `sink(task_id, event, data)` for every published event"""
+        self._sinks.append(sink)
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Register a queue that receives every future event of the task"""
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[task_id].append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(task_id, [])
+            subscribers[:] = [(loop, q) for loop, q in subscribers if q is not queue]
+            if not subscribers:
+                self._subscribers.pop(task_id, None)
+
+    def publish(self, task_id: str, event: str, **data: Any):
+        """Send an event to all current subscribers of the task"""
+        for sink in self._sinks:
+            try:
+                sink(task_id, event, data)
+            except Exception as e:
+                logger.error(f"Error forwarding progress event of {task_id}: {e}")
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(task_id, ()))
+        if not subscribers:
+            return
+
+        message = dict(data, event=event, task_id=task_id, timestamp=time.time())
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # subscriber's event loop is already closed
+                logger.debug(f"Dropping progress event for closed subscriber of {task_id}")
+
+    def has_subscribers(self, task_id: str) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(task_id))
+
+
+progress_broker = ProgressBroker()
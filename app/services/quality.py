@@ -0,0 +1,84 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.logger import logger
+
+
+class QualityLevel:
+    """Parameter scaling applied at one level of load"""
+
+    def __init__(self, name: str, octree_scale: float = 1.0, steps_scale: float = 1.0,
+                 texture_scale: float = 1.0, skip_texture: bool = False):
+        self.name = name
+        self.octree_scale = octree_scale
+        self.steps_scale = steps_scale
+        self.texture_scale = texture_scale
+        self.skip_texture = skip_texture
+
+
+# (minimum pressure, level), ascending
+DEFAULT_LEVELS: List[Tuple[float, QualityLevel]] = [
+    (0.5, QualityLevel('reduced', octree_scale=0.75, steps_scale=0.75)),
+    (1.0, QualityLevel('low', octree_scale=0.5, steps_scale=0.5, texture_scale=0.5)),
+    (2.0, QualityLevel('minimal', octree_scale=0.5, steps_scale=0.5, texture_scale=0.5, skip_texture=True)),
+]
+
+# texture and render sizes stay multiples of this
+TEXTURE_SIZE_STEP = 256
+
+
+class QualityPolicy:
+    """Map load pressure to per-request parameter overrides.
+
+    Pressure is a unitless load figure where 1.0 means the service is at its
+    latency objective. The highest level whose threshold is reached scales
+    the request's parameters down, but never below the bounds the request
+    declares: `min_octree_resolution`, `min_inference_steps`,
+    `min_texture_size` and `allow_skip_texture`. A parameter without a
+    declared bound is never degraded.
+    """
+
+    def __init__(self, levels: Optional[List[Tuple[float, QualityLevel]]] = None):
+        self.levels = sorted(levels or DEFAULT_LEVELS, key=lambda item: item[0])
+
+    def level(self, pressure: float) -> Optional[QualityLevel]:
+        chosen = None
+        for threshold, level in self.levels:
+            if pressure >= threshold:
+                chosen = level
+        return chosen
+
+    def apply(self, params, pressure: float, texture_defaults: Dict[str, int]) -> Tuple[Any, Dict[str, Any]]:
+        """Return the degraded params and the overrides applied as {field: {'requested', 'applied'}}"""
+        level = self.level(pressure)
+        if level is None:
+            return params, {}
+
+        changes = {}
+        if params.min_octree_resolution is not None:
+            changes['octree_resolution'] = max(
+                params.min_octree_resolution, int(params.octree_resolution * level.octree_scale))
+        if params.min_inference_steps is not None:
+            changes['num_inference_steps'] = max(
+                params.min_inference_steps, int(params.num_inference_steps * level.steps_scale))
+        if params.enable_texture and params.min_texture_size is not None:
+            for field in ('texture_size', 'render_size'):
+                requested = getattr(params, field) or texture_defaults[field]
+                scaled = int(requested * level.texture_scale) // TEXTURE_SIZE_STEP * TEXTURE_SIZE_STEP
+                changes[field] = max(params.min_texture_size, scaled)
+        if params.enable_texture and level.skip_texture and params.allow_skip_texture:
+            changes = {field: value for field, value in changes.items() if field not in texture_defaults}
+            changes['enable_texture'] = False
+
+        overrides = {}
+        for field, value in changes.items():
+            requested = getattr(params, field)
+            if field in texture_defaults and requested is None:
+                requested = texture_defaults[field]
+            if value != requested and (field == 'enable_texture' or value < requested):
+                overrides[field] = {'requested': requested, 'applied': value}
+        if not overrides:
+            return params, {}
+
+        applied = ', '.join(f"{field}={override['applied']}" for field, override in overrides.items())
+        logger.info(f"Degrading request to quality level {level.name} at pressure {pressure:.2f}: {applied}")
+        return params.copy(update={field: override['applied'] for field, override in overrides.items()}), overrides
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from PIL import Image
+
+from app.utils.file_utils import artifact_size, link_or_copy_artifact, remove_artifact
+from app.utils.logger import logger
+
+
+def image_fingerprint(image: Image.Image) -> str:
+    """Hash of the decoded pixels, independent of the container format they came in"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+# request fields that decide when a task runs, not what it produces
+SCHEDULING_FIELDS = {
+    'priority', 'min_octree_resolution', 'min_inference_steps', 'min_texture_size', 'allow_skip_texture', 'preview'
+}
+
+
+def request_cache_key(kind: str, params, image: Optional[Image.Image] = None) -> str:
+    """Content address of a generation request: its kind, output-affecting params and input pixels"""
+    payload = {
+        'kind': kind,
+        'params': params.dict(exclude=SCHEDULING_FIELDS),
+        'image': image_fingerprint(image) if image is not None else None,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed store of generated GLBs under a disk quota.
+
+    Entries are indexed in SQLite with their size and last access time, so
+    every process sharing the cache directory sees the same entries.
+    Inserting past `max_bytes` evicts the least recently used entries and
+    entries older than `max_age` seconds are dropped on access. A new index
+    adopts the files already in the cache directory, using their mtimes as
+    last-access times.
+    """
+
+    def __init__(self, cache_dir: str, db_path: str, max_bytes: int, max_age: float, file_type: str = 'glb'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file_type = file_type
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        new_index = not os.path.exists(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, '
+            'size INTEGER NOT NULL, '
+            'last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)')
+        if new_index:
+            self._adopt_existing_files()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{self.file_type}")
+
+    def _adopt_existing_files(self):
+        rows = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(f".{self.file_type}"):
+                rows.append((entry.name[:-len(self.file_type) - 1], artifact_size(entry.path), entry.stat().st_mtime))
+        with self._lock:
+            self._conn.executemany('INSERT OR IGNORE INTO entries VALUES (?, ?, ?)', rows)
+        if rows:
+            logger.info(f"Result cache adopted {len(rows)} existing entries")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached result, refreshing its recency, or None on a miss"""
+        now = time.time()
+        path = self._path(key)
+        with self._lock:
+            row = self._conn.execute('SELECT last_access FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.max_age or not os.path.exists(path):
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                stale = True
+            else:
+                self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+                stale = False
+        if stale:
+            self._remove_files([key])
+            return None
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, file_path: str) -> Optional[str]:
+        """Store a generated file under `key` and enforce the quota"""
+        path = self._path(key)
+        try:
+            link_or_copy_artifact(file_path, path)
+            size = artifact_size(path)
+        except OSError as e:
+            logger.error(f"Error caching result {key}: {e}")
+            return None
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, size, time.time()))
+        self._evict()
+        return path
+
+    def _evict(self):
+        deadline = time.time() - self.max_age
+        with self._lock:
+            # other processes insert and evict against the same index, claim the victims atomically
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                victims = [key for key, in self._conn.execute(
+                    'SELECT key FROM entries WHERE last_access < ?', (deadline,))]
+                self._conn.execute('DELETE FROM entries WHERE last_access < ?', (deadline,))
+                excess = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY last_access'):
+                        if excess <= 0:
+                            break
+                        victims.append(key)
+                        excess -= size
+                    self._conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in victims])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._remove_files(victims)
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                remove_artifact(self._path(key))
+            except OSError as e:
+                logger.error(f"Error evicting cached result {key}: {e}")
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
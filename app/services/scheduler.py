@@ -0,0 +1,234 @@
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set
+
+from app.utils.logger import logger
+
+# priority classes, most urgent first
+PRIORITIES = ('interactive', 'normal', 'batch')
+DEFAULT_PRIORITY = 'normal'
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    """Rank of a priority class, lower runs first; unknown classes rank as the default"""
+    if priority not in PRIORITIES:
+        priority = DEFAULT_PRIORITY
+    return PRIORITIES.index(priority)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class PrioritySlot:
+    """Counting semaphore that hands free slots to the most urgent waiter first.
+
+    Waiters are served by priority rank, then in arrival order. Holders can
+    poll `contended(rank)` to learn that a more urgent job is waiting and
+    give their slot up at a convenient point.
+    """
+
+    def __init__(self, count: int = 1):
+        self.count = max(1, count)
+        self._held = 0
+        self._waiting: List[tuple] = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, rank: int):
+        with self._cond:
+            waiter = (rank, next(self._tickets))
+            self._waiting.append(waiter)
+            try:
+                while self._held >= self.count or min(self._waiting) != waiter:
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(waiter)
+            self._held += 1
+            # the next waiter may fit as well when several slots are free
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._held -= 1
+            self._cond.notify_all()
+
+    def contended(self, rank: int) -> bool:
+        """Whether a job more urgent than `rank` is waiting for a slot"""
+        with self._cond:
+            return any(waiting_rank < rank for waiting_rank, _ in self._waiting)
+
+
+class _PendingJob:
+    def __init__(self, task_id: str, fn: Callable[[], None], rank: int, client: str, start_tag: float, seq: int):
+        self.task_id = task_id
+        self.fn = fn
+        self.rank = rank
+        self.client = client
+        self.start_tag = start_tag
+        self.seq = seq
+
+    @property
+    def order(self) -> tuple:
+        return self.rank, self.start_tag, self.seq
+
+
+class JobScheduler:
+    """Bounded job queue drained by a fixed pool of worker threads.
+
+    Jobs are dispatched by priority class first. Within a class, clients
+    share the workers by weighted fair queuing (start-time fair queuing):
+    each job is tagged with a virtual start time that advances by
+    `cost / weight` per job of the same client, so a client flooding the
+    queue cannot starve the others.
+
+    `reserved_workers` extra workers only run jobs of the most urgent class,
+    so those never wait behind a pool fully taken by long jobs.
+
+    Each worker runs one job at a time. Jobs that touch a shared model wrap
+    the call in `slot(name, priority)`, which bounds how many jobs may
+    execute that model concurrently regardless of the number of workers,
+    and hands freed slots to the most urgent waiter.
+    """
+
+    def __init__(self, num_workers: int = 1, max_queue_size: int = 32,
+                 model_slots: Optional[Dict[str, int]] = None,
+                 client_weights: Optional[Dict[str, float]] = None, reserved_workers: int = 0):
+        self.num_workers = max(1, num_workers)
+        self.reserved_workers = max(0, reserved_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.client_weights = client_weights or {}
+        self._pending: List[_PendingJob] = []
+        self._running: Set[str] = set()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        # virtual time per priority class and the finish tag of each client's last job
+        self._virtual_time: Dict[int, float] = {}
+        self._client_finish: Dict[tuple, float] = {}
+        self._slots = {
+            name: PrioritySlot(count)
+            for name, count in (model_slots or {}).items()
+        }
+        self._workers = []
+        self._stopped = False
+
+    def start(self):
+        """Spawn the worker threads"""
+        least_urgent = len(PRIORITIES) - 1
+        for i in range(self.num_workers + self.reserved_workers):
+            max_rank = least_urgent if i < self.num_workers else 0
+            worker = threading.Thread(target=self._worker_loop, args=(max_rank,), name=f"generation-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Job scheduler started with {self.num_workers} worker(s) "
+                    f"+ {self.reserved_workers} reserved for {PRIORITIES[0]} jobs, "
+                    f"queue size {self.max_queue_size}")
+
+    def shutdown(self):
+        """Stop accepting work and wake idle workers so they exit"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def submit(self, task_id: str, fn: Callable[[], None], priority: str = DEFAULT_PRIORITY,
+               client: str = 'anonymous', cost: float = 1.0) -> int:
+        """Enqueue a job and return its 1-based queue position"""
+        rank = priority_rank(priority)
+        with self._cond:
+            if self._stopped:
+                raise QueueFullError('Scheduler is shutting down')
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(f"Job queue is full ({self.max_queue_size} pending)")
+
+            weight = max(self.client_weights.get(client, 1.0), 1e-6)
+            start_tag = max(self._virtual_time.get(rank, 0.0), self._client_finish.get((rank, client), 0.0))
+            self._client_finish[(rank, client)] = start_tag + cost / weight
+            job = _PendingJob(task_id, fn, rank, client, start_tag, next(self._seq))
+            self._pending.append(job)
+            # a single notify could wake a reserved worker that may not take this job
+            self._cond.notify_all()
+            return self._position(job)
+
+    def cancel(self, task_id: str) -> bool:
+        """Drop a pending job; False if it is not queued (already running or done)"""
+        with self._cond:
+            for job in self._pending:
+                if job.task_id == task_id:
+                    self._pending.remove(job)
+                    return True
+        return False
+
+    def queue_position(self, task_id: str) -> Optional[int]:
+        """1-based position of a pending job in dispatch order, or None if it is not queued"""
+        with self._cond:
+            for job in self._pending:
+                if job.task_id == task_id:
+                    return self._position(job)
+        return None
+
+    def _position(self, job: _PendingJob) -> int:
+        return 1 + sum(1 for other in self._pending if other.order < job.order)
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return len(self._running)
+
+    @contextmanager
+    def slot(self, name: str, priority: str = DEFAULT_PRIORITY):
+        """Hold one execution slot of the named model for the duration of the block"""
+        slot = self._slots.get(name)
+        if slot is None:
+            yield
+            return
+        slot.acquire(priority_rank(priority))
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def preempt_requested(self, name: str, priority: str = DEFAULT_PRIORITY) -> bool:
+        """Whether a more urgent job is waiting for a slot of the named model"""
+        slot = self._slots.get(name)
+        return slot is not None and slot.contended(priority_rank(priority))
+
+    def _next_job(self, max_rank: int) -> Optional[_PendingJob]:
+        eligible = [pending for pending in self._pending if pending.rank <= max_rank]
+        if not eligible:
+            return None
+        job = min(eligible, key=lambda pending: pending.order)
+        self._pending.remove(job)
+        self._virtual_time[job.rank] = job.start_tag
+        # clients whose last job started in the past carry no backlog any more
+        for key in [key for key, finish in self._client_finish.items()
+                    if key[0] == job.rank and finish <= job.start_tag]:
+            del self._client_finish[key]
+        return job
+
+    def _worker_loop(self, max_rank: int):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped:
+                    job = self._next_job(max_rank)
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._running.add(job.task_id)
+
+            try:
+                job.fn()
+            except Exception as e:
+                logger.error(f"Unhandled error in job {job.task_id}: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job.task_id)
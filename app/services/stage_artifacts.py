@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.models.schemas import ImageTo3DRequest, TextTo3DRequest
+from app.utils.file_utils import link_or_copy
+from app.utils.logger import logger
+from app.utils.shm_utils import mesh_from_arrays, mesh_to_arrays
+
+# stage outputs in pipeline order, with the file each one is stored in
+STAGE_FILES = {
+    'image': 'image.png',
+    'latents': 'latents.npy',
+    'raw_mesh': 'raw_mesh.npz',
+    'mesh': 'mesh.npz',
+    'uv_mesh': 'uv_mesh.npz',
+    'multiviews': 'multiviews',
+    'texture': 'texture.png',
+}
+# outputs a textured follow-up can start from, the conditioning image is needed as well
+SHAPE_OUTPUTS = ('latents', 'raw_mesh', 'mesh', 'uv_mesh')
+
+
+class StageOutputsUnavailable(Exception):
+    """Raised when a task has no stored stage outputs to start a follow-up from"""
+
+
+def texture_request(params: Dict[str, Any], overrides: Optional[Dict[str, Any]] = None):
+    """Request of a textured follow-up of a task generated with `params`"""
+    params = dict(params, enable_texture=True, preview=False)
+    params.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return TextTo3DRequest(**params) if 'prompt' in params else ImageTo3DRequest(**params)
+
+
+class StageArtifactStore:
+    """Outputs of the generation stages of every task, kept so a later request can start from any of them.
+
+    Each task gets a directory under `root` with one entry per stored stage
+    output: PNGs for images and textures, numpy files for latents and mesh
+    arrays. Entries are written under a temporary name and renamed, so an
+    entry that exists is complete. Task directories untouched for `max_age`
+    seconds are removed by a background thread.
+    """
+
+    def __init__(self, root: str, max_age: float, gc_interval: float = 60):
+        self.root = root
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        self._stop = threading.Event()
+        self._collector = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, task_id: str, name: str) -> str:
+        return os.path.join(self.root, task_id, STAGE_FILES[name])
+
+    def save(self, task_id: str, name: str, value: Any):
+        """Store the output of a stage, replacing an earlier one"""
+        path = self._path(task_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if name == 'image':
+                value.save(tmp_path, format='PNG')
+            elif name == 'latents':
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, value.detach().cpu().numpy())
+            elif name == 'multiviews':
+                os.makedirs(tmp_path)
+                for index, view in enumerate(value):
+                    view.save(os.path.join(tmp_path, f"{index}.png"), format='PNG')
+            elif name == 'texture':
+                if hasattr(value, 'detach'):
+                    value = value.detach().cpu().numpy()
+                Image.fromarray(np.round(value * 255).astype(np.uint8)).save(tmp_path, format='PNG')
+            else:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, **mesh_to_arrays(value))
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self, task_id: str, name: str) -> Any:
+        """Read back a stored stage output"""
+        path = self._path(task_id, name)
+        if name == 'image':
+            with Image.open(path) as image:
+                return image.copy()
+        if name == 'latents':
+            return np.load(path)
+        if name == 'multiviews':
+            views = []
+            for index in range(len(os.listdir(path))):
+                with Image.open(os.path.join(path, f"{index}.png")) as view:
+                    views.append(view.copy())
+            return views
+        if name == 'texture':
+            with Image.open(path) as texture:
+                return np.asarray(texture.convert('RGB'), dtype=np.float32) / 255
+        with np.load(path) as arrays:
+            return mesh_from_arrays(dict(arrays))
+
+    def available(self, task_id: str) -> List[str]:
+        """Names of the stored stage outputs of a task, in pipeline order"""
+        return [name for name in STAGE_FILES if os.path.exists(self._path(task_id, name))]
+
+    def resumable(self, task_id: str) -> bool:
+        """Whether a textured follow-up can start from the stored outputs of a task"""
+        available = self.available(task_id)
+        return 'image' in available and any(name in available for name in SHAPE_OUTPUTS)
+
+    def fork(self, source_id: str, task_id: str, names: List[str]):
+        """Give a follow-up task the stored outputs it starts from, as hard links where possible"""
+        for name in names:
+            source, target = self._path(source_id, name), self._path(task_id, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.isdir(source):
+                shutil.copytree(source, target, copy_function=link_or_copy, dirs_exist_ok=True)
+            else:
+                link_or_copy(source, target)
+
+    def remove(self, task_id: str):
+        shutil.rmtree(os.path.join(self.root, task_id), ignore_errors=True)
+
+    def collect(self) -> int:
+        """Remove the outputs of tasks whose directory was not written for `max_age` seconds"""
+        deadline = time.time() - self.max_age
+        removed = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < deadline:
+                    shutil.rmtree(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.error(f"Error removing stage outputs {entry.path}: {e}")
+        return removed
+
+    def start_gc(self):
+        """Remove expired stage outputs in a background thread"""
+        if self._collector is not None:
+            return
+
+        def gc_loop():
+            while not self._stop.wait(self.gc_interval):
+                try:
+                    removed = self.collect()
+                    if removed:
+                        logger.info(f"Removed stage outputs of {removed} task(s)")
+                except Exception as e:
+                    logger.error(f"Error collecting stage outputs: {e}")
+
+        self._collector = threading.Thread(target=gc_loop, name='stage-artifacts-gc')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def close(self):
+        self._stop.set()
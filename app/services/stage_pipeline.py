@@ -0,0 +1,134 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.logger import logger
+
+
+class StageJob:
+    """A job travelling through a `StagePipeline` and the state its stages share.
+
+    Jobs with a lower `priority` rank are taken first from every stage queue.
+    """
+
+    def __init__(self, task_id: Optional[str], state: Dict[str, Any], timings: Dict[str, float],
+                 priority: int = 0):
+        self.task_id = task_id
+        self.state = state
+        self.timings = timings
+        self.priority = priority
+        self.future: Future = Future()
+
+
+class Stage:
+    """One step of a `StagePipeline`.
+
+    `run(job)` updates `job.state` in place. `when(job)`, if given, decides
+    whether the stage applies to a job; skipped jobs are passed straight on.
+    """
+
+    def __init__(self, name: str, run: Callable[[StageJob], None], workers: int = 1,
+                 when: Optional[Callable[[StageJob], bool]] = None):
+        self.name = name
+        self.run = run
+        self.workers = max(1, workers)
+        self.when = when
+
+
+class StagePipeline:
+    """Run jobs through a chain of stages, each with its own workers.
+
+    Stages are connected by bounded queues: a stage that gets ahead blocks on
+    the queue of the next one instead of piling up intermediate results. Jobs
+    at different stages run concurrently, so accelerator-bound stages of one
+    job overlap with CPU-bound stages of another.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 2,
+                 on_stage: Optional[Callable[[StageJob, str], None]] = None, name: str = 'stage-pipeline'):
+        self.stages = stages
+        self.name = name
+        self.on_stage = on_stage
+        self._queues = [queue.PriorityQueue(maxsize=max(1, queue_size)) for _ in stages]
+        self._seq = itertools.count()
+        self._workers = []
+        self._stopped = threading.Event()
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                worker = threading.Thread(
+                    target=self._worker_loop, args=(index,), name=f"{self.name}-{stage.name}-{i}")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"{self.name} started with stages: {', '.join(stage.name for stage in self.stages)}")
+
+    def shutdown(self):
+        self._stopped.set()
+        for stage_queue in self._queues:
+            try:
+                stage_queue.put_nowait(self._stop_entry())
+            except queue.Full:
+                pass
+
+    def _stop_entry(self) -> tuple:
+        # ranks behind every job, so queued jobs drain first
+        return float('inf'), next(self._seq), None
+
+    def _put(self, index: int, job: StageJob):
+        self._queues[index].put((job.priority, next(self._seq), job))
+
+    def submit(self, job: StageJob) -> Future:
+        """Feed a job to the first stage, blocking while its queue is full"""
+        if self._stopped.is_set():
+            raise RuntimeError(f"{self.name} is stopped")
+        self._put(0, job)
+        return job.future
+
+    def run(self, task_id: Optional[str], state: Dict[str, Any], timings: Dict[str, float],
+            priority: int = 0) -> Dict[str, Any]:
+        """Run a job through all stages and return its final state"""
+        self.submit(StageJob(task_id, state, timings, priority)).result()
+        return state
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {stage.name: stage_queue.qsize() for stage, stage_queue in zip(self.stages, self._queues)}
+
+    def _forward(self, index: int, job: StageJob):
+        if index + 1 < len(self.stages):
+            self._put(index + 1, job)
+        else:
+            job.future.set_result(job.state)
+
+    def _worker_loop(self, index: int):
+        stage = self.stages[index]
+        stage_queue = self._queues[index]
+        while not self._stopped.is_set():
+            _, _, job = stage_queue.get()
+            if job is None:
+                # wake the next sibling worker so every worker of the stage exits
+                try:
+                    stage_queue.put_nowait(self._stop_entry())
+                except queue.Full:
+                    pass
+                return
+
+            if stage.when is not None and not stage.when(job):
+                self._forward(index, job)
+                continue
+
+            start = time.time()
+            try:
+                if self.on_stage is not None:
+                    self.on_stage(job, stage.name)
+                stage.run(job)
+            except Exception as e:
+                logger.error(f"Stage {stage.name} failed for task {job.task_id}: {e}")
+                job.future.set_exception(e)
+                continue
+            job.timings[f"{stage.name}_time"] = time.time() - start
+            self._forward(index, job)
@@ -0,0 +1,266 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.utils.logger import logger
+
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+_TERMINAL_PLACEHOLDERS = ', '.join('?' * len(TERMINAL_STATUSES))
+
+
+class TaskStore:
+    """Interface of a task record store.
+
+    A record is a JSON-serialisable dict holding the task status, artifact
+    paths, timings and request parameters. Records in a terminal status are
+    evicted once they have not been updated for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 86400, eviction_interval: float = 60):
+        self.ttl = ttl
+        self.eviction_interval = eviction_interval
+        self._stop = threading.Event()
+        self._evictor = None
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update(self, task_id: str, **fields):
+        raise NotImplementedError
+
+    def delete(self, task_id: str):
+        raise NotImplementedError
+
+    def with_status(self, status: str) -> List[str]:
+        """Ids of the records currently in `status`"""
+        raise NotImplementedError
+
+    def evict_expired(self) -> int:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def start_eviction(self):
+        """Evict expired records periodically in a background thread"""
+        if self._evictor is not None:
+            return
+
+        def evict_loop():
+            while not self._stop.wait(self.eviction_interval):
+                try:
+                    evicted = self.evict_expired()
+                    if evicted:
+                        logger.info(f"Evicted {evicted} expired task(s)")
+                except Exception as e:
+                    logger.error(f"Error evicting expired tasks: {e}")
+
+        self._evictor = threading.Thread(target=evict_loop, name='task-store-evictor')
+        self._evictor.daemon = True
+        self._evictor.start()
+
+    def close(self):
+        self._stop.set()
+
+
+class MemoryTaskStore(TaskStore):
+    """In-process store with TTL expiry and an LRU cap on the number of records"""
+
+    def __init__(self, max_entries: int = 10000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._records[task_id] = dict(record, created_at=now, updated_at=now)
+            self._records.move_to_end(task_id)
+            self._enforce_capacity()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return None
+            self._records.move_to_end(task_id)
+            return dict(record)
+
+    def update(self, task_id: str, **fields):
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return
+            record.update(fields, updated_at=time.time())
+            self._records.move_to_end(task_id)
+
+    def delete(self, task_id: str):
+        with self._lock:
+            self._records.pop(task_id, None)
+
+    def with_status(self, status: str) -> List[str]:
+        with self._lock:
+            return [task_id for task_id, record in self._records.items() if record.get('status') == status]
+
+    def evict_expired(self) -> int:
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                task_id for task_id, record in self._records.items()
+                if record.get('status') in TERMINAL_STATUSES and record['updated_at'] < deadline
+            ]
+            for task_id in expired:
+                del self._records[task_id]
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def _enforce_capacity(self):
+        # drop least recently used finished tasks; in-flight tasks are never dropped
+        overflow = len(self._records) - self.max_entries
+        if overflow <= 0:
+            return
+        for task_id in [
+            task_id for task_id, record in self._records.items()
+            if record.get('status') in TERMINAL_STATUSES
+        ][:overflow]:
+            del self._records[task_id]
+
+
+class SQLiteTaskStore(TaskStore):
+    """Durable store backed by a SQLite database in WAL mode.
+
+    Tasks that were pending or processing when the previous process died are
+    marked as failed on startup, so clients get an answer instead of a 404.
+    Batch items not yet handed to the generation service (`awaiting_batch`)
+    are left pending for the batch feeder to resume.
+    Processes sharing the database with live peers pass
+    `fail_interrupted=False` and leave recovery to the job queue.
+    """
+
+    def __init__(self, db_path: str, fail_interrupted: bool = True, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'task_id TEXT PRIMARY KEY, '
+            'status TEXT NOT NULL, '
+            'data TEXT NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updated_at)')
+        if fail_interrupted:
+            self._fail_interrupted_tasks()
+
+    def _fail_interrupted_tasks(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id, data FROM tasks WHERE status NOT IN ({_TERMINAL_PLACEHOLDERS})", TERMINAL_STATUSES
+            ).fetchall()
+            now = time.time()
+            failed = 0
+            for task_id, data in rows:
+                record = json.loads(data)
+                if record.get('awaiting_batch'):
+                    continue
+                record.update(status='error', message='Task interrupted by server restart', updated_at=now)
+                self._write(task_id, record)
+                failed += 1
+        if failed:
+            logger.info(f"Marked {failed} interrupted task(s) as failed")
+
+    def _write(self, task_id: str, record: Dict[str, Any]):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO tasks (task_id, status, data, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (task_id, record.get('status', ''), json.dumps(record),
+             record['created_at'], record['updated_at'])
+        )
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._write(task_id, dict(record, created_at=now, updated_at=now))
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id: str, **fields):
+        with self._lock:
+            # the read-modify-write must not interleave with other processes sharing the database
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+                if row is not None:
+                    record = json.loads(row[0])
+                    record.update(fields, updated_at=time.time())
+                    self._write(task_id, record)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, task_id: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    def with_status(self, status: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT task_id FROM tasks WHERE status = ?', (status,))]
+
+    def evict_expired(self) -> int:
+        deadline = time.time() - self.ttl
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM tasks WHERE updated_at < ? AND status IN ({_TERMINAL_PLACEHOLDERS})",
+                (deadline, *TERMINAL_STATUSES)
+            )
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+
+def create_task_store(backend: str, **kwargs) -> TaskStore:
+    """Build the task store selected by `backend` ('memory' or 'sqlite')"""
+    ttl = kwargs.get('ttl', 86400)
+    eviction_interval = kwargs.get('eviction_interval', 60)
+    if backend == 'memory':
+        return MemoryTaskStore(
+            max_entries=kwargs.get('max_entries', 10000),
+            ttl=ttl,
+            eviction_interval=eviction_interval,
+        )
+    if backend == 'sqlite':
+        return SQLiteTaskStore(
+            kwargs['db_path'],
+            fail_interrupted=kwargs.get('fail_interrupted', True),
+            ttl=ttl,
+            eviction_interval=eviction_interval,
+        )
+    raise ValueError(f"Unknown task store backend: {backend}")
@@ -0,0 +1,231 @@
+import os
+import signal
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable
+
+from PIL import Image
+
+from app.config import settings
+from app.models.schemas import TextTo3DRequest, ImageTo3DRequest
+from app.services.job_queue import GENERATION_KINDS, JobQueue, TEXTURE_KIND
+from app.services.progress import progress_broker
+from app.services.scheduler import QueueFullError
+from app.services.task_store import TERMINAL_STATUSES
+from app.utils.logger import logger
+from app.utils.shm_utils import mesh_from_arrays, mesh_to_arrays, pack_arrays, unlink_segment, unpack_arrays
+
+from hy3dgen.shapegen.utils import CancellationToken, GenerationCancelled
+
+REQUEST_TYPES = {'text-to-3d': TextTo3DRequest, 'image-to-3d': ImageTo3DRequest}
+
+
+class GenerationWorker:
+    """Run jobs of the shared job queue on this process's generation service.
+
+    Jobs are claimed while the local scheduler has fewer queued jobs than
+    generation workers, so the backlog stays in the shared queue where any
+    worker can take it. A job refused by admission control goes back to the
+    queue until its Retry-After; a claimed job is released once its task
+    reaches a terminal status. Progress events of the local service are
+    published to the queue for the API processes. Only jobs of `kinds`
+    are claimed.
+    """
+
+    def __init__(self, service, job_queue: JobQueue, kinds: Iterable[str] = GENERATION_KINDS):
+        self.service = service
+        self.job_queue = job_queue
+        self.kinds = tuple(kinds)
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._last_heartbeat = 0.0
+        progress_broker.add_sink(self.job_queue.publish_event)
+
+    def run(self):
+        """Process jobs until `stop` is called"""
+        logger.info(f"Generation worker {self.worker_id} started")
+        while not self._stop.is_set():
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error(f"Error in generation worker loop: {e}")
+            self._stop.wait(settings.job_poll_interval)
+        logger.info(f"Generation worker {self.worker_id} stopped")
+
+    def stop(self):
+        self._stop.set()
+
+    def _tick(self):
+        now = time.time()
+        if now - self._last_heartbeat >= settings.worker_heartbeat_interval:
+            self._last_heartbeat = now
+            self.job_queue.heartbeat(self.worker_id, {
+                'pid': os.getpid(),
+                'role': settings.process_role,
+                'queue_depth': self.service.queue_depth,
+                'in_flight': self.service.scheduler.in_flight,
+                'residency': self.service.models.residency(),
+            })
+            self.job_queue.reclaim_stale(settings.worker_stale_after)
+            self.job_queue.prune_events(settings.worker_stale_after * 10)
+
+        for task_id in self.job_queue.cancel_requests(self.worker_id):
+            self._stop_task(task_id)
+
+        self._release_finished()
+
+        room = settings.generation_workers - self.service.queue_depth
+        for job in self.job_queue.claim(self.worker_id, room, self.kinds):
+            self._dispatch(job)
+
+    def _release_finished(self):
+        for task_id in self.job_queue.claimed(self.worker_id):
+            record = self.service.task_store.get(task_id)
+            if record is None or record['status'] in TERMINAL_STATUSES:
+                self._finish(task_id)
+
+    def _stop_task(self, task_id: str):
+        """Stop a task the API has marked cancelled"""
+        record = self.service.task_store.get(task_id)
+        if record is not None and record['status'] in TERMINAL_STATUSES and record['status'] != 'cancelled':
+            return
+        self.service.stop_task(task_id)
+        # the job may have been submitted after the API marked the task, which reset its status
+        self.service._update_task(task_id, status="cancelled", message="Cancelled by client")
+        logger.info(f"Task {task_id} cancelled")
+
+    def _finish(self, task_id: str):
+        self.job_queue.finish(task_id)
+        try:
+            os.remove(os.path.join(settings.spool_dir, task_id))
+        except FileNotFoundError:
+            pass
+
+    def _dispatch(self, job: Dict[str, Any]):
+        task_id = job['task_id']
+        payload = job['payload']
+        record = self.service.task_store.get(task_id)
+        if record is not None and record['status'] in TERMINAL_STATUSES:
+            # finished or cancelled before a previous worker could release it
+            self._finish(task_id)
+            return
+
+        try:
+            if job['kind'] == 'text-to-3d':
+                params = TextTo3DRequest(**payload['params'])
+                self.service.start_text_to_3d_generation(task_id, params, client=job['client'])
+            elif job['kind'] == 'texture-from-task':
+                source_task_id = payload['source_task_id']
+                if self.service.start_texture_from_task(
+                        task_id, source_task_id, payload['overrides'], client=job['client']) is None:
+                    raise LookupError(f"Task {source_task_id} not found")
+            else:
+                params = ImageTo3DRequest(**payload['params'])
+                with open(payload['image_path'], 'rb') as f:
+                    image = self.service.process_image_bytes(f.read())
+                self.service.start_image_to_3d_generation(
+                    task_id, image, params, client=job['client'], batch_id=payload.get('batch_id'))
+        except QueueFullError as e:
+            # the service dropped the record of the refused task, put the queued one back
+            self.service.task_store.create(task_id, payload['record'])
+            self.job_queue.retry(task_id, getattr(e, 'retry_after', settings.job_poll_interval))
+            logger.info(f"Task {task_id} returned to the job queue: {e}")
+        except Exception as e:
+            logger.error(f"Error starting task {task_id}: {e}")
+            self.service._update_task(task_id, status="error", message=str(e))
+            self._finish(task_id)
+
+
+class TextureWorker(GenerationWorker):
+    """Run the texture jobs shape workers hand on, on this process's texture stages.
+
+    The mesh and the conditioning image arrive in a shared memory segment
+    owned by the shape worker; the textured mesh goes back in a segment the
+    shape worker unlinks once it has read it. A job's result is left in the
+    queue for the shape worker, which keeps the task and saves the model.
+    A cancelled job is finished here and its output discarded.
+    """
+
+    def __init__(self, service, job_queue: JobQueue):
+        super().__init__(service, job_queue, kinds=(TEXTURE_KIND,))
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._tokens_lock = threading.Lock()
+
+    def _release_finished(self):
+        # texture jobs are finished by the shape worker waiting on them
+        pass
+
+    def _stop_task(self, job_id: str):
+        with self._tokens_lock:
+            cancel_token = self._tokens.get(job_id)
+        if cancel_token is not None:
+            cancel_token.cancel()
+        if self.service.scheduler.cancel(job_id):
+            self._discard(job_id)
+
+    def _discard(self, job_id: str):
+        with self._tokens_lock:
+            self._tokens.pop(job_id, None)
+        self.job_queue.finish(job_id)
+
+    def _dispatch(self, job: Dict[str, Any]):
+        job_id = job['task_id']
+        cancel_token = CancellationToken()
+        with self._tokens_lock:
+            self._tokens[job_id] = cancel_token
+
+        def run_job():
+            payload = job['payload']
+            try:
+                arrays = unpack_arrays(payload['inputs'])
+                image = Image.fromarray(arrays.pop('image'))
+                params = REQUEST_TYPES[payload['request']](**payload['params'])
+                resume = {name: self.service.stage_artifacts.load(payload['task_id'], name)
+                          for name in payload.get('restore', [])}
+                resume['uv_wrapped'] = payload.get('uv_wrapped', False)
+                timings = {}
+                mesh = self.service.texture_mesh(
+                    payload['task_id'], mesh_from_arrays(arrays), image, params, timings, cancel_token, resume)
+                result = {'mesh': pack_arrays(payload['outputs'], mesh_to_arrays(mesh)), 'timings': timings}
+            except GenerationCancelled:
+                self._discard(job_id)
+                return
+            except Exception as e:
+                logger.error(f"Texture job {job_id} failed: {e}")
+                result = {'error': str(e)}
+
+            if not self.job_queue.complete(job_id, self.worker_id, result):
+                # cancelled while finishing, or requeued after a missed heartbeat
+                if 'mesh' in result:
+                    unlink_segment(payload['outputs'])
+                if job_id in self.job_queue.claimed(self.worker_id):
+                    self.job_queue.finish(job_id)
+            with self._tokens_lock:
+                self._tokens.pop(job_id, None)
+
+        try:
+            self.service.scheduler.submit(
+                job_id, run_job, priority=job['payload']['priority'], client=job['client'])
+        except QueueFullError as e:
+            self.job_queue.retry(job_id, getattr(e, 'retry_after', settings.job_poll_interval))
+            with self._tokens_lock:
+                self._tokens.pop(job_id, None)
+
+
+def run_worker():
+    """Entry point of a generation worker process"""
+    from app.services.generation_service import generation_service
+
+    job_queue = JobQueue(settings.job_db_path)
+    if settings.process_role == 'texture-worker':
+        worker = TextureWorker(generation_service, job_queue)
+    else:
+        worker = GenerationWorker(generation_service, job_queue)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generation_service.shutdown()
@@ -0,0 +1,113 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+from typing import BinaryIO, Iterable, Iterator, Tuple, Union
+
+# read and yield size of streamed archive members
+CHUNK_SIZE = 1024 * 1024
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# (name in the archive, file path or in-memory content)
+ArchiveEntry = Tuple[str, Union[str, bytes]]
+
+
+def iter_archive_images(fileobj: BinaryIO, max_member_bytes: int) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, bytes) of the images in a zip archive, one member in memory at a time"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive: {e}")
+
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or base.startswith('.') or name.startswith('__MACOSX/'):
+                continue
+            if not base.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if info.file_size > max_member_bytes:
+                raise ValueError(f"Archive member {name} exceeds {max_member_bytes} bytes")
+            # the declared size can lie, never inflate past the limit
+            with archive.open(info) as member:
+                data = member.read(max_member_bytes + 1)
+            if len(data) > max_member_bytes:
+                raise ValueError(f"Archive member {name} exceeds {max_member_bytes} bytes")
+            yield name, data
+
+
+def _open_entry(content: Union[str, bytes]) -> Tuple[BinaryIO, int, float]:
+    if isinstance(content, bytes):
+        return io.BytesIO(content), len(content), time.time()
+    f = open(content, 'rb')
+    stat = os.fstat(f.fileno())
+    return f, stat.st_size, stat.st_mtime
+
+
+def _iter_entries(entries: Iterable[ArchiveEntry]) -> Iterator[Tuple[str, BinaryIO, int, float]]:
+    """Open entries lazily, skipping files removed since they were listed"""
+    for arcname, content in entries:
+        try:
+            f, size, mtime = _open_entry(content)
+        except FileNotFoundError:
+            continue
+        with f:
+            yield arcname, f, size, mtime
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file object collecting what zipfile writes until it is drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    """Yield a zip archive of the entries without seeking or holding more than a chunk.
+
+    Members are stored uncompressed, GLB payloads barely deflate, and sizes
+    and CRCs follow each member in data descriptors.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for arcname, f, size, mtime in _iter_entries(entries):
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, mode='w', force_zip64=size >= zipfile.ZIP64_LIMIT) as member:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    # central directory
+    yield sink.drain()
+
+
+def stream_tar(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    """Yield an uncompressed tar archive of the entries, one chunk at a time"""
+    for arcname, f, size, mtime in _iter_entries(entries):
+        info = tarfile.TarInfo(arcname)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+    # end of archive marker
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
@@ -1,10 +1,26 @@
 import base64
+import gzip
+import hashlib
 import os
+import shutil
 import uuid
 from io import BytesIO
+from typing import List
 from PIL import Image
 from app.config import settings
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# precompressed variants stored next to an artifact, by content coding in order of preference
+SIDECAR_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# variants that save less than this fraction of the artifact are not kept
+MIN_COMPRESSION_SAVING = 0.1
+BROTLI_QUALITY = 9
+CHUNK_SIZE = 1024 * 1024
+
 def save_image_from_base64(image_data: str) -> Image.Image:
     """Convert base64 image data to PIL Image"""
     try:
@@ -20,14 +36,94 @@ def generate_file_path(file_type: str = 'glb') -> str:
     filename = f"{uuid.uuid4()}.{file_type}"
     return os.path.join(settings.save_dir, filename)
 
-def cleanup_old_files(max_files: int = 100):
-    """Clean up old files to prevent disk space issues"""
+def preview_path(task_id: str) -> str:
+    """Path of the latest progress preview of a task"""
+    return os.path.join(settings.preview_dir, f"{task_id}.glb")
+
+def link_or_copy(src: str, dst: str):
+    """Hard-link src to dst, falling back to a copy across filesystems"""
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.tmp"
     try:
-        files = [os.path.join(settings.save_dir, f) for f in os.listdir(settings.save_dir)]
-        files.sort(key=os.path.getctime)
-        
-        if len(files) > max_files:
-            for file_to_remove in files[:-max_files]:
-                os.remove(file_to_remove)
-    except Exception as e:
-        print(f"Error cleaning up files: {e}")
\ No newline at end of file
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def sidecar_paths(path: str) -> List[str]:
+    """Existing precompressed variants of an artifact"""
+    return [path + suffix for suffix in SIDECAR_SUFFIXES.values() if os.path.exists(path + suffix)]
+
+def artifact_size(path: str) -> int:
+    """Bytes taken by an artifact and its precompressed variants"""
+    return os.path.getsize(path) + sum(os.path.getsize(sidecar) for sidecar in sidecar_paths(path))
+
+def link_or_copy_artifact(src: str, dst: str):
+    """link_or_copy an artifact together with its precompressed variants"""
+    link_or_copy(src, dst)
+    for suffix in SIDECAR_SUFFIXES.values():
+        if os.path.exists(src + suffix):
+            link_or_copy(src + suffix, dst + suffix)
+
+def remove_artifact(path: str):
+    """Remove an artifact and its precompressed variants; a missing artifact is not an error"""
+    for file_path in [path] + [path + suffix for suffix in SIDECAR_SUFFIXES.values()]:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+class _SidecarWriter:
+    """Stream-compress an artifact into a temporary variant file"""
+
+    def __init__(self, path: str, encoding: str):
+        self.tmp_path = f"{path}{SIDECAR_SUFFIXES[encoding]}.tmp"
+        self.encoding = encoding
+        self._file = open(self.tmp_path, 'wb')
+        if encoding == 'gzip':
+            self._compressor = gzip.GzipFile(filename='', mode='wb', fileobj=self._file, mtime=0)
+        else:
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def write(self, data: bytes):
+        if self.encoding == 'gzip':
+            self._compressor.write(data)
+        else:
+            self._file.write(self._compressor.process(data))
+
+    def close(self):
+        if self.encoding == 'gzip':
+            self._compressor.close()
+        else:
+            self._file.write(self._compressor.finish())
+        self._file.close()
+
+def finalize_artifact(path: str, compress: bool = True) -> str:
+    """Hash an artifact, write its precompressed variants in the same pass and return the hex digest"""
+    digest = hashlib.sha256()
+    writers = []
+    if compress:
+        writers.append(_SidecarWriter(path, 'gzip'))
+        if brotli is not None:
+            writers.append(_SidecarWriter(path, 'br'))
+
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                for writer in writers:
+                    writer.write(chunk)
+        for writer in writers:
+            writer.close()
+    except Exception:
+        for writer in writers:
+            writer._file.close()
+            os.remove(writer.tmp_path)
+        raise
+
+    size = os.path.getsize(path)
+    for writer in writers:
+        if os.path.getsize(writer.tmp_path) <= size * (1 - MIN_COMPRESSION_SAVING):
+            os.replace(writer.tmp_path, path + SIDECAR_SUFFIXES[writer.encoding])
+        else:
+            os.remove(writer.tmp_path)
+    return digest.hexdigest()
@@ -0,0 +1,141 @@
+import os
+import re
+from typing import Iterator, Optional, Set, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.config import settings
+from app.utils.file_utils import CHUNK_SIZE, SIDECAR_SUFFIXES
+
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised for a byte range that lies past the end of the file"""
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an entity tag, compared weakly as conditional GET requires"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in header.split(','):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    return False
+
+
+def accepted_encodings(header: Optional[str]) -> Set[str]:
+    """Content codings an Accept-Encoding header allows"""
+    encodings = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.lower())
+    return encodings
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single byte range, None when the whole file should be sent.
+
+    Malformed and multi-range headers are ignored, which RFC 9110 allows.
+    """
+    match = _BYTE_RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise RangeNotSatisfiable()
+        return start, min(int(last), size - 1) if last else size - 1
+    if last:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - suffix), size - 1
+    return None
+
+
+def _file_chunks(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_artifact(request: Request, path: str, digest: str, media_type: str,
+                   disposition: str = 'attachment', filename: Optional[str] = None) -> Response:
+    """Serve an immutable artifact with a strong ETag, conditional GET, byte ranges and precompressed variants.
+
+    With ACCEL_REDIRECT_PREFIX set, the representation and its ETag are still
+    picked here and revalidation is answered here; only the byte delivery,
+    ranges included, is handed to nginx, which passes the ETag through.
+    """
+    headers = {'Cache-Control': f"public, max-age={int(settings.output_max_age)}"}
+    if filename is not None:
+        headers['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+
+    # each coding is its own representation with its own tag; ranges always address the identity bytes
+    range_header = request.headers.get('range')
+    encoding = None
+    if range_header is None:
+        accepted = accepted_encodings(request.headers.get('accept-encoding'))
+        for candidate, suffix in SIDECAR_SUFFIXES.items():
+            if candidate in accepted and os.path.exists(path + suffix):
+                encoding = candidate
+                break
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers.update({'ETag': etag, 'Vary': 'Accept-Encoding', 'Accept-Ranges': 'bytes'})
+
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        path = path + SIDECAR_SUFFIXES[encoding]
+        headers['Content-Encoding'] = encoding
+
+    if_range = request.headers.get('if-range')
+    stale_range = range_header is not None and if_range is not None and if_range.strip() != etag
+    # nginx cannot check If-Range against a tag it did not generate, a stale one is answered here in full
+    if settings.accel_redirect_prefix and not stale_range:
+        relative_path = os.path.relpath(path, settings.save_dir)
+        headers['X-Accel-Redirect'] = settings.accel_redirect_prefix.rstrip('/') + '/' + quote(relative_path)
+        return Response(headers=headers, media_type=media_type)
+
+    size = os.path.getsize(path)
+
+    byte_range = None
+    if range_header is not None and not stale_range:
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers=dict(headers, **{'Content-Range': f"bytes */{size}"}))
+
+    if byte_range is None:
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(_file_chunks(path, 0, size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        _file_chunks(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
@@ -0,0 +1,105 @@
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict
+
+import numpy as np
+import trimesh
+from PIL import Image
+
+# array offsets inside a segment, keeps every array aligned for any dtype
+ALIGNMENT = 64
+
+# {'name': segment, 'arrays': {key: {'dtype', 'shape', 'offset'}}}
+Manifest = Dict[str, Any]
+
+
+def segment_name(task_id: str, suffix: str) -> str:
+    """Deterministic segment name, so a rerun of a task can clear what a dead process left behind"""
+    return f"dreammesh-{task_id}-{suffix}"
+
+
+def _open(name: str, size: int = 0) -> shared_memory.SharedMemory:
+    create = size > 0
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # segments outlive the process that creates or attaches them, the consumer unlinks them
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def _unlink(segment: shared_memory.SharedMemory):
+    if sys.version_info < (3, 13):
+        # unlink() unregisters the segment again
+        resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+
+
+def pack_arrays(name: str, arrays: Dict[str, np.ndarray]) -> Manifest:
+    """Copy arrays into one new shared memory segment and return its manifest"""
+    layout = {}
+    offset = 0
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    segment = _open(name, max(offset, 1))
+    try:
+        for key, array in arrays.items():
+            info = layout[key]
+            view = np.ndarray(info['shape'], dtype=info['dtype'], buffer=segment.buf, offset=info['offset'])
+            view[...] = array
+            del view
+    except BaseException:
+        segment.close()
+        _unlink(segment)
+        raise
+    segment.close()
+    return {'name': name, 'arrays': layout}
+
+
+def unpack_arrays(manifest: Manifest) -> Dict[str, np.ndarray]:
+    """Copy the arrays of a segment out into process memory; the segment stays"""
+    segment = _open(manifest['name'])
+    try:
+        arrays = {}
+        for key, info in manifest['arrays'].items():
+            view = np.ndarray(info['shape'], dtype=info['dtype'], buffer=segment.buf, offset=info['offset'])
+            arrays[key] = view.copy()
+            del view
+        return arrays
+    finally:
+        segment.close()
+
+
+def unlink_segment(name: str):
+    """Remove a segment if it exists"""
+    try:
+        segment = _open(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    _unlink(segment)
+
+
+def mesh_to_arrays(mesh: trimesh.Trimesh) -> Dict[str, np.ndarray]:
+    """Vertices and faces of a mesh, plus UVs and the texture image of a textured one"""
+    arrays = {'vertices': np.asarray(mesh.vertices), 'faces': np.asarray(mesh.faces)}
+    uv = getattr(mesh.visual, 'uv', None)
+    if uv is not None:
+        arrays['uv'] = np.asarray(uv)
+        image = getattr(mesh.visual.material, 'image', None)
+        if image is not None:
+            arrays['texture'] = np.asarray(image)
+    return arrays
+
+
+def mesh_from_arrays(arrays: Dict[str, np.ndarray]) -> trimesh.Trimesh:
+    """Rebuild a mesh from `mesh_to_arrays` output"""
+    mesh = trimesh.Trimesh(vertices=arrays['vertices'], faces=arrays['faces'], process=False)
+    if 'uv' in arrays:
+        image = Image.fromarray(arrays['texture']) if 'texture' in arrays else None
+        material = trimesh.visual.texture.SimpleMaterial(image=image, diffuse=(255, 255, 255))
+        mesh.visual = trimesh.visual.TextureVisuals(uv=arrays['uv'], image=image, material=material)
+    return mesh
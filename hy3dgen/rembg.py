@@ -15,11 +15,14 @@
 from PIL import Image
 from rembg import remove, new_session
 
+from .shapegen.utils import synchronize_timer
+
 
 class BackgroundRemover():
     def __init__(self):
         self.session = new_session()
 
+    @synchronize_timer('Background removal', stage='background_removal')
     def __call__(self, image: Image.Image):
         output = remove(image, session=self.session, bgcolor=[255, 255, 255, 0])
         return output
@@ -17,4 +17,4 @@ from .attention_processors import FlashVDMCrossAttentionProcessor, CrossAttentio
     FlashVDMTopMCrossAttentionProcessor
 from .model import ShapeVAE, VectsetVAE
 from .surface_extractors import SurfaceExtractors, MCSurfaceExtractor, DMCSurfaceExtractor, Latent2MeshOutput
-from .volume_decoders import HierarchicalVolumeDecoding, FlashVDMVolumeDecoding, VanillaVolumeDecoder
+from .volume_decoders import HierarchicalVolumeDecoding, FlashVDMVolumeDecoding, VanillaVolumeDecoder, SparseVolume
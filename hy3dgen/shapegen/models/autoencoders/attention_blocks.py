@@ -247,9 +247,11 @@ class MultiheadCrossAttention(nn.Module):
         self.kv_cache = kv_cache
         self.data = None
 
-    def forward(self, x, data):
+    def forward(self, x, data, kv=None):
         x = self.c_q(x)
-        if self.kv_cache:
+        if kv is not None:
+            data = kv
+        elif self.kv_cache:
             if self.data is None:
                 self.data = self.c_kv(data)
                 logger.info('Save kv cache,this should be called only once for one mesh')
@@ -293,8 +295,15 @@ class ResidualCrossAttentionBlock(nn.Module):
         self.ln_3 = norm_layer(width, elementwise_affine=True, eps=1e-6)
         self.mlp = MLP(width=width, expand_ratio=mlp_expand_ratio)
 
-    def forward(self, x: torch.Tensor, data: torch.Tensor):
-        x = x + self.attn(self.ln_1(x), self.ln_2(data))
+    def project_data(self, data: torch.Tensor):
+        """ Keys and values the cross attention derives from `data`, see `forward`. """
+        return self.attn.c_kv(self.ln_2(data))
+
+    def forward(self, x: torch.Tensor, data: Optional[torch.Tensor] = None, kv: Optional[torch.Tensor] = None):
+        if kv is None:
+            x = x + self.attn(self.ln_1(x), self.ln_2(data))
+        else:
+            x = x + self.attn(self.ln_1(x), None, kv=kv)
         x = x + self.mlp(self.ln_3(x))
         return x
 
@@ -481,13 +490,50 @@ class CrossAttentionDecoder(nn.Module):
     def set_default_cross_attention_processor(self):
         self.cross_attn_decoder.attn.attention.attn_processor = CrossAttentionProcessor
 
-    def forward(self, queries=None, query_embeddings=None, latents=None):
-        if query_embeddings is None:
-            query_embeddings = self.query_proj(self.fourier_embedder(queries).to(latents.dtype))
-        self.count += query_embeddings.shape[1]
+    def project_latents(self, latents):
+        """
+        Keys and values of the cross attention for `latents`. They depend on the latents
+        only, so volume decoders project them once per decode and pass them to every
+        chunk of queries as `kv` instead of the latents.
+        """
         if self.downsample_ratio != 1:
             latents = self.latents_proj(latents)
-        x = self.cross_attn_decoder(query_embeddings, latents)
+        return self.cross_attn_decoder.project_data(latents)
+
+    def grid_query_tables(self, axes: List[torch.Tensor]) -> List[torch.Tensor]:
+        """
+        Per-axis tables of the projected query embeddings of a regular grid. Every fourier
+        feature of a point depends on one of its coordinates and `query_proj` is linear, so
+        the embedding of grid point (i, j, k) is tables[0][i] + tables[1][j] + tables[2][k];
+        the bias and the features of the other axes' zero coordinates are folded into the
+        first table. Tables are float32 and small, [len(axes[d]), width].
+
+        Args:
+            axes: the grid coordinates along x, y and z, three 1D tensors.
+        """
+        weight = self.query_proj.weight.float()
+        bias = self.query_proj.bias.float() if self.query_proj.bias is not None else None
+        origin = self.fourier_embedder(axes[0].new_zeros(1, 3, dtype=torch.float32))
+        tables = []
+        for dim, coords in enumerate(axes):
+            points = coords.new_zeros(coords.shape[0], 3, dtype=torch.float32)
+            points[:, dim] = coords
+            tables.append(nn.functional.linear(self.fourier_embedder(points) - origin, weight))
+        tables[0] = tables[0] + nn.functional.linear(origin, weight, bias)
+        return tables
+
+    def embed_grid_queries(self, tables: List[torch.Tensor], index: torch.Tensor, dtype: torch.dtype):
+        """ Query embeddings of grid points from `grid_query_tables`, `index` holds their [..., 3] grid indices. """
+        embeddings = tables[0][index[..., 0]] + tables[1][index[..., 1]] + tables[2][index[..., 2]]
+        return embeddings.to(dtype)
+
+    def forward(self, queries=None, query_embeddings=None, latents=None, kv=None):
+        if kv is None:
+            kv = self.project_latents(latents)
+        if query_embeddings is None:
+            query_embeddings = self.query_proj(self.fourier_embedder(queries).to(kv.dtype))
+        self.count += query_embeddings.shape[1]
+        x = self.cross_attn_decoder(query_embeddings, kv=kv)
         if self.enable_ln_post:
             x = self.ln_post(x)
         occ = self.output_proj(x)
@@ -12,12 +12,15 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+import itertools
 from typing import Union, Tuple, List
 
 import numpy as np
 import torch
 from skimage import measure
 
+from .volume_decoders import SparseVolume
+
 
 class Latent2MeshOutput:
 
@@ -49,7 +52,8 @@ class SurfaceExtractor:
 
     def __call__(self, grid_logits, **kwargs):
         outputs = []
-        for i in range(grid_logits.shape[0]):
+        # a batched dense volume, or a list with one SparseVolume per batch entry
+        for i in range(len(grid_logits)):
             try:
                 vertices, faces = self.run(grid_logits[i], **kwargs)
                 vertices = vertices.astype(np.float32)
@@ -65,19 +69,90 @@ class SurfaceExtractor:
 
 
 class MCSurfaceExtractor(SurfaceExtractor):
+    def __init__(self, brick_size: int = 64):
+        self.brick_size = brick_size
+
     def run(self, grid_logit, *, mc_level, bounds, octree_resolution, **kwargs):
-        vertices, faces, normals, _ = measure.marching_cubes(
-            grid_logit.cpu().numpy(),
-            mc_level,
-            method="lewiner"
-        )
+        if isinstance(grid_logit, SparseVolume):
+            vertices, faces = self.run_sparse(grid_logit, mc_level)
+        else:
+            vertices, faces, normals, _ = measure.marching_cubes(
+                grid_logit.cpu().numpy(),
+                mc_level,
+                method="lewiner"
+            )
         grid_size, bbox_min, bbox_size = self._compute_box_stat(bounds, octree_resolution)
         vertices = vertices / grid_size * bbox_size + bbox_min
         return vertices, faces
 
+    def run_sparse(self, volume: SparseVolume, mc_level: float):
+        """
+        Marching cubes over the bricks of `brick_size` cells that hold points of a sparse volume,
+        densified one at a time. Every cell lies in exactly one brick and neighbouring bricks share
+        their boundary points, so the triangles are those of a dense run; the vertices that come out
+        of both sides of a brick boundary are identical and merged. Triangles of cells with a corner
+        outside the band, which a dense run interpolates against NaN, are dropped.
+        """
+        size = self.brick_size
+        num_bricks = max(-(-volume.octree_resolution // size), 1)
+        coords = volume.coords()
+        upper = (coords // size).clamp(max=num_bricks - 1)
+        lower = ((coords - 1).clamp(min=0) // size).clamp(max=num_bricks - 1)
+
+        # a point on a brick boundary also belongs to the bricks before it
+        members, bricks = [], []
+        for corner in itertools.product((False, True), repeat=3):
+            corner = torch.tensor(corner, device=coords.device)
+            points = torch.nonzero(((lower != upper) | ~corner).all(dim=-1)).squeeze(-1)
+            members.append(points)
+            bricks.append(torch.where(corner, lower[points], upper[points]))
+        members, bricks = torch.cat(members), torch.cat(bricks)
+        brick_keys = (bricks[:, 0] * num_bricks + bricks[:, 1]) * num_bricks + bricks[:, 2]
+        order = torch.argsort(brick_keys)
+        brick_ids, counts = torch.unique_consecutive(brick_keys[order], return_counts=True)
+        local = (coords[members[order]] - bricks[order] * size).to(torch.int16).cpu().numpy()
+        values = volume.values[members[order]].to(torch.float32).cpu().numpy()
+        del coords, upper, lower, members, bricks, brick_keys, order
+
+        vertices, faces = [], []
+        num_vertices = 0
+        end = 0
+        for brick_id, count in zip(brick_ids.tolist(), counts.tolist()):
+            start, end = end, end + count
+            brick_values = values[start:end]
+            if not np.nanmin(brick_values) <= mc_level <= np.nanmax(brick_values):
+                continue
+            origin = np.array([brick_id // num_bricks ** 2, brick_id // num_bricks % num_bricks,
+                               brick_id % num_bricks]) * size
+            shape = np.minimum(origin + size + 1, volume.grid_size) - origin
+            block = np.full(shape, np.nan, dtype=np.float32)
+            block[tuple(local[start:end].T)] = brick_values
+            try:
+                brick_vertices, brick_faces, _, _ = measure.marching_cubes(block, mc_level, method="lewiner")
+            except RuntimeError:
+                # no surface in this brick
+                continue
+            # cells with a corner the band does not hold are interpolated against NaN, drop them
+            finite = np.isfinite(brick_vertices).all(axis=1)
+            brick_faces = (np.cumsum(finite) - 1)[brick_faces[finite[brick_faces].all(axis=1)]]
+            brick_vertices = brick_vertices[finite]
+            if len(brick_faces) == 0:
+                continue
+            vertices.append(brick_vertices.astype(np.float64) + origin)
+            faces.append(brick_faces + num_vertices)
+            num_vertices += len(brick_vertices)
+
+        if not faces:
+            raise ValueError("No surface found in the sparse volume")
+        vertices, inverse = np.unique(np.concatenate(vertices), axis=0, return_inverse=True)
+        faces = inverse.reshape(-1)[np.concatenate(faces)]
+        return vertices, faces
+
 
 class DMCSurfaceExtractor(SurfaceExtractor):
     def run(self, grid_logit, *, octree_resolution, **kwargs):
+        if isinstance(grid_logit, SparseVolume):
+            grid_logit = grid_logit.to_dense()
         device = grid_logit.device
         if not hasattr(self, 'dmc'):
             try:
@@ -16,14 +16,13 @@ from typing import Union, Tuple, List, Callable
 
 import numpy as np
 import torch
-import torch.nn as nn
 import torch.nn.functional as F
 from einops import repeat
 from tqdm import tqdm
 
 from .attention_blocks import CrossAttentionDecoder
 from .attention_processors import FlashVDMCrossAttentionProcessor, FlashVDMTopMCrossAttentionProcessor
-from ...utils import logger
+from ...utils import logger, check_cancelled
 
 
 def extract_near_surface_volume_fn(input_tensor: torch.Tensor, alpha: float):
@@ -138,6 +137,157 @@ def generate_dense_grid_points(
     return xyz, grid_size, length
 
 
+def grid_axes(
+    bbox_min: np.ndarray,
+    bbox_max: np.ndarray,
+    octree_resolution: int,
+    device: torch.device,
+):
+    """ Coordinates along x, y and z of the grid of `generate_dense_grid_points`, for `grid_query_tables`. """
+    return [
+        torch.linspace(float(bbox_min[i]), float(bbox_max[i]), int(octree_resolution) + 1,
+                       dtype=torch.float32, device=device)
+        for i in range(3)
+    ]
+
+
+def _axis_strides(grid_size: List[int]):
+    return int(grid_size[1]) * int(grid_size[2]), int(grid_size[2]), 1
+
+
+def unflatten_indices(flat: torch.Tensor, grid_size: List[int]):
+    """ [..., 3] grid indices of the points with flat "ij" order indices `flat`. """
+    plane, depth, _ = _axis_strides(grid_size)
+    return torch.stack((flat // plane, flat % plane // depth, flat % depth), dim=-1)
+
+
+def flatten_indices(index: torch.Tensor, grid_size: List[int]):
+    """ Flat "ij" order indices of the points with [..., 3] grid indices `index`. """
+    plane, depth, _ = _axis_strides(grid_size)
+    return index[..., 0] * plane + index[..., 1] * depth + index[..., 2]
+
+
+def grid_chunk_indices(start: int, end: int, grid_size: List[int], device: torch.device):
+    """ [end - start, 3] grid indices of the points start..end of a grid flattened in "ij" order. """
+    return unflatten_indices(torch.arange(start, end, device=device), grid_size)
+
+
+class SparseVolume:
+    """
+    Logits known at a subset of the points of a cubic grid, the narrow band around the surface
+    that hierarchical decoding evaluates. Points are kept as their flat "ij" order indices,
+    sorted and unique, so memory scales with the band instead of the grid. Grid points without
+    a value stand for the NaN padding of a dense volume.
+
+    Args:
+        keys: [N] int64 flat indices of the points.
+        values: [N] logits of the points.
+        octree_resolution: the grid has octree_resolution + 1 points per axis.
+    """
+
+    def __init__(self, keys: torch.Tensor, values: torch.Tensor, octree_resolution: int):
+        self.keys = keys
+        self.values = values
+        self.octree_resolution = int(octree_resolution)
+        self.grid_size = [self.octree_resolution + 1] * 3
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def coords(self):
+        """ [N, 3] grid indices of the points. """
+        return unflatten_indices(self.keys, self.grid_size)
+
+    def lookup(self, keys: torch.Tensor):
+        """ Values at the flat indices `keys`, NaN where the volume has none. """
+        missing = torch.full(keys.shape, float('nan'), dtype=self.values.dtype, device=self.values.device)
+        if len(self) == 0:
+            return missing
+        position = torch.searchsorted(self.keys, keys).clamp(max=len(self) - 1)
+        return torch.where(self.keys[position] == keys, self.values[position], missing)
+
+    def to_dense(self):
+        """ The dense volume, NaN where the volume has no value. """
+        dense = torch.full((int(np.prod(self.grid_size)),), float('nan'),
+                           dtype=self.values.dtype, device=self.values.device)
+        dense[self.keys] = self.values
+        return dense.view(self.grid_size)
+
+
+def _shift_keys(keys: torch.Tensor, axis: int, shift: int, grid_size: List[int]):
+    """ Flat indices of the points `shift` steps along `axis` from `keys`, and which of them lie in the grid. """
+    stride = _axis_strides(grid_size)[axis]
+    coord = keys // stride % int(grid_size[axis])
+    inside = (coord + shift >= 0) & (coord + shift < int(grid_size[axis]))
+    return keys + shift * stride, inside
+
+
+def dilate_keys(keys: torch.Tensor, grid_size: List[int], steps: int = 1):
+    """
+    Sparse counterpart of a 3x3x3 box dilation of the points `keys`, `steps` times. The box is
+    separable, so each step dilates along one axis at a time and holds at most three times the
+    points instead of 27.
+    """
+    for _ in range(steps):
+        for axis in range(3):
+            dilated = [keys]
+            for shift in (-1, 1):
+                neighbours, inside = _shift_keys(keys, axis, shift, grid_size)
+                dilated.append(neighbours[inside])
+            keys = torch.unique(torch.cat(dilated))
+    return keys
+
+
+def near_surface_keys(volume: SparseVolume, mc_level: float):
+    """
+    Sparse counterpart of `extract_near_surface_volume_fn` plus the |logit| < 0.95 band: the points
+    whose sign differs from one of their 6 neighbours', where a neighbour without a value takes the
+    point's own, and the points close to zero.
+    """
+    val = volume.values + mc_level
+    sign = torch.sign(val.to(torch.float32))
+    near = volume.values.abs() < 0.95
+    for axis in range(3):
+        for shift in (-1, 1):
+            neighbours, inside = _shift_keys(volume.keys, axis, shift, volume.grid_size)
+            neighbour = volume.lookup(neighbours) + mc_level
+            neighbour = torch.where(inside & ~torch.isnan(neighbour), neighbour, val)
+            near |= torch.sign(neighbour.to(torch.float32)) != sign
+    return volume.keys[near]
+
+
+def refine_keys(volume: SparseVolume, mc_level: float, octree_resolution: int, expand_num: int):
+    """
+    Points of the next, twice as fine level to decode: the near-surface points of `volume` dilated
+    `expand_num` times, their coincident points on the fine grid, dilated 2 - `expand_num` times.
+    """
+    keys = dilate_keys(near_surface_keys(volume, mc_level), volume.grid_size, expand_num)
+    grid_size = [int(octree_resolution) + 1] * 3
+    # the order of the grid indices is kept, so the fine indices stay sorted and unique
+    keys = flatten_indices(unflatten_indices(keys, volume.grid_size) * 2, grid_size)
+    return dilate_keys(keys, grid_size, 2 - expand_num)
+
+
+def coincident_values(volume: SparseVolume, keys: torch.Tensor, octree_resolution: int):
+    """
+    Values of `volume` at the points `keys` of the next, twice as fine grid that coincide with its
+    own points (even indices on every axis), NaN for the other points and where `volume` has none.
+    """
+    values = torch.full(keys.shape, float('nan'), dtype=volume.values.dtype, device=volume.values.device)
+    if int(octree_resolution) != 2 * volume.octree_resolution:
+        # the grids only share points when the fine spacing is exactly half the coarse one
+        return values
+    grid_size = [int(octree_resolution) + 1] * 3
+    even = torch.ones_like(keys, dtype=torch.bool)
+    coarse_keys = torch.zeros_like(keys)
+    for axis, (stride, coarse_stride) in enumerate(zip(_axis_strides(grid_size), _axis_strides(volume.grid_size))):
+        coord = keys // stride % grid_size[axis]
+        even &= coord % 2 == 0
+        coarse_keys += coord // 2 * coarse_stride
+    values[even] = volume.lookup(coarse_keys[even])
+    return values
+
+
 class VanillaVolumeDecoder:
     @torch.no_grad()
     def __call__(
@@ -148,6 +298,8 @@ class VanillaVolumeDecoder:
         num_chunks: int = 10000,
         octree_resolution: int = None,
         enable_pbar: bool = True,
+        progress_callback: Callable = None,
+        cancel_token=None,
         **kwargs,
     ):
         device = latents.device
@@ -158,23 +310,26 @@ class VanillaVolumeDecoder:
         if isinstance(bounds, float):
             bounds = [-bounds, -bounds, -bounds, bounds, bounds, bounds]
 
+        # queries are generated per chunk on the device, from their grid indices
         bbox_min, bbox_max = np.array(bounds[0:3]), np.array(bounds[3:6])
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=octree_resolution,
-            indexing="ij"
-        )
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype).contiguous().reshape(-1, 3)
+        grid_size = [int(octree_resolution) + 1] * 3
+        num_points = int(np.prod(grid_size))
+        tables = geo_decoder.grid_query_tables(grid_axes(bbox_min, bbox_max, octree_resolution, device))
 
         # 2. latents to 3d volume
+        kv = geo_decoder.project_latents(latents)
         batch_logits = []
-        for start in tqdm(range(0, xyz_samples.shape[0], num_chunks), desc=f"Volume Decoding",
+        for start in tqdm(range(0, num_points, num_chunks), desc=f"Volume Decoding",
                           disable=not enable_pbar):
-            chunk_queries = xyz_samples[start: start + num_chunks, :]
+            check_cancelled(cancel_token)
+            end = min(start + num_chunks, num_points)
+            chunk_queries = geo_decoder.embed_grid_queries(
+                tables, grid_chunk_indices(start, end, grid_size, device), dtype)
             chunk_queries = repeat(chunk_queries, "p c -> b p c", b=batch_size)
-            logits = geo_decoder(queries=chunk_queries, latents=latents)
+            logits = geo_decoder(query_embeddings=chunk_queries, kv=kv)
             batch_logits.append(logits)
+            if progress_callback is not None:
+                progress_callback(octree_resolution, end, num_points)
 
         grid_logits = torch.cat(batch_logits, dim=1)
         grid_logits = grid_logits.view((batch_size, *grid_size)).float()
@@ -194,6 +349,8 @@ class HierarchicalVolumeDecoding:
         octree_resolution: int = None,
         min_resolution: int = 63,
         enable_pbar: bool = True,
+        progress_callback: Callable = None,
+        cancel_token=None,
         **kwargs,
     ):
         device = latents.device
@@ -212,69 +369,60 @@ class HierarchicalVolumeDecoding:
             bounds = [-bounds, -bounds, -bounds, bounds, bounds, bounds]
         bbox_min = np.array(bounds[0:3])
         bbox_max = np.array(bounds[3:6])
-        bbox_size = bbox_max - bbox_min
 
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=resolutions[0],
-            indexing="ij"
-        )
-
-        dilate = nn.Conv3d(1, 1, 3, padding=1, bias=False, device=device, dtype=dtype)
-        dilate.weight = torch.nn.Parameter(torch.ones(dilate.weight.shape, dtype=dtype, device=device))
-
-        grid_size = np.array(grid_size)
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype).contiguous().reshape(-1, 3)
+        grid_size = np.array([resolutions[0] + 1] * 3)
+        num_points = int(np.prod(grid_size))
+        tables = geo_decoder.grid_query_tables(grid_axes(bbox_min, bbox_max, resolutions[0], device))
 
         # 2. latents to 3d volume
+        kv = geo_decoder.project_latents(latents)
         batch_logits = []
         batch_size = latents.shape[0]
-        for start in tqdm(range(0, xyz_samples.shape[0], num_chunks),
+        for start in tqdm(range(0, num_points, num_chunks),
                           desc=f"Hierarchical Volume Decoding [r{resolutions[0] + 1}]"):
-            queries = xyz_samples[start: start + num_chunks, :]
+            check_cancelled(cancel_token)
+            end = min(start + num_chunks, num_points)
+            queries = geo_decoder.embed_grid_queries(tables, grid_chunk_indices(start, end, grid_size, device), dtype)
             batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
-            logits = geo_decoder(queries=batch_queries, latents=latents)
+            logits = geo_decoder(query_embeddings=batch_queries, kv=kv)
             batch_logits.append(logits)
-
-        grid_logits = torch.cat(batch_logits, dim=1).view((batch_size, grid_size[0], grid_size[1], grid_size[2]))
-
-        for octree_depth_now in resolutions[1:]:
-            grid_size = np.array([octree_depth_now + 1] * 3)
-            resolution = bbox_size / octree_depth_now
-            next_index = torch.zeros(tuple(grid_size), dtype=dtype, device=device)
-            next_logits = torch.full(next_index.shape, -10000., dtype=dtype, device=device)
-            curr_points = extract_near_surface_volume_fn(grid_logits.squeeze(0), mc_level)
-            curr_points += grid_logits.squeeze(0).abs() < 0.95
-
-            if octree_depth_now == resolutions[-1]:
-                expand_num = 0
-            else:
-                expand_num = 1
-            for i in range(expand_num):
-                curr_points = dilate(curr_points.unsqueeze(0).to(dtype)).squeeze(0)
-            (cidx_x, cidx_y, cidx_z) = torch.where(curr_points > 0)
-            next_index[cidx_x * 2, cidx_y * 2, cidx_z * 2] = 1
-            for i in range(2 - expand_num):
-                next_index = dilate(next_index.unsqueeze(0)).squeeze(0)
-            nidx = torch.where(next_index > 0)
-
-            next_points = torch.stack(nidx, dim=1)
-            next_points = (next_points * torch.tensor(resolution, dtype=next_points.dtype, device=device) +
-                           torch.tensor(bbox_min, dtype=next_points.dtype, device=device))
-            batch_logits = []
-            for start in tqdm(range(0, next_points.shape[0], num_chunks),
-                              desc=f"Hierarchical Volume Decoding [r{octree_depth_now + 1}]"):
-                queries = next_points[start: start + num_chunks, :]
-                batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
-                logits = geo_decoder(queries=batch_queries.to(latents.dtype), latents=latents)
-                batch_logits.append(logits)
-            grid_logits = torch.cat(batch_logits, dim=1)
-            next_logits[nidx] = grid_logits[0, ..., 0]
-            grid_logits = next_logits.unsqueeze(0)
-        grid_logits[grid_logits == -10000.] = float('nan')
-
-        return grid_logits
+            if progress_callback is not None:
+                progress_callback(resolutions[0], end, num_points)
+
+        coarse_logits = torch.cat(batch_logits, dim=1)
+
+        # the coarse level is dense, the refinement levels only hold the band around the surface
+        # of each batch entry, so entries are refined one at a time
+        volumes = []
+        for i in range(batch_size):
+            volume = SparseVolume(torch.arange(num_points, device=device), coarse_logits[i, :, 0], resolutions[0])
+            for octree_depth_now in resolutions[1:]:
+                expand_num = 0 if octree_depth_now == resolutions[-1] else 1
+                next_keys = refine_keys(volume, mc_level, octree_depth_now, expand_num)
+                grid_size = [octree_depth_now + 1] * 3
+
+                # points the coarser level already decoded are copied, only the new ones are queried
+                next_logits = coincident_values(volume, next_keys, octree_depth_now)
+                unknown = torch.isnan(next_logits)
+                query_keys = next_keys[unknown]
+
+                tables = geo_decoder.grid_query_tables(grid_axes(bbox_min, bbox_max, octree_depth_now, device))
+                batch_logits = [latents.new_empty(1, 0, 1)]
+                for start in tqdm(range(0, query_keys.shape[0], num_chunks),
+                                  desc=f"Hierarchical Volume Decoding [r{octree_depth_now + 1}]"):
+                    check_cancelled(cancel_token)
+                    queries = geo_decoder.embed_grid_queries(
+                        tables, unflatten_indices(query_keys[start: start + num_chunks], grid_size), dtype)
+                    logits = geo_decoder(query_embeddings=queries.unsqueeze(0), kv=kv[i:i + 1])
+                    batch_logits.append(logits)
+                    if progress_callback is not None:
+                        progress_callback(octree_depth_now, min(start + num_chunks, query_keys.shape[0]),
+                                          query_keys.shape[0])
+                next_logits[unknown] = torch.cat(batch_logits, dim=1)[0, :, 0]
+                volume = SparseVolume(next_keys, next_logits, octree_depth_now)
+            volumes.append(volume)
+
+        return volumes
 
 
 class FlashVDMVolumeDecoding:
@@ -299,6 +447,8 @@ class FlashVDMVolumeDecoding:
         min_resolution: int = 63,
         mini_grid_num: int = 4,
         enable_pbar: bool = True,
+        progress_callback: Callable = None,
+        cancel_token=None,
         **kwargs,
     ):
         processor = self.processor
@@ -325,111 +475,99 @@ class FlashVDMVolumeDecoding:
             bounds = [-bounds, -bounds, -bounds, bounds, bounds, bounds]
         bbox_min = np.array(bounds[0:3])
         bbox_max = np.array(bounds[3:6])
-        bbox_size = bbox_max - bbox_min
-
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=resolutions[0],
-            indexing="ij"
-        )
 
-        dilate = nn.Conv3d(1, 1, 3, padding=1, bias=False, device=device, dtype=dtype)
-        dilate.weight = torch.nn.Parameter(torch.ones(dilate.weight.shape, dtype=dtype, device=device))
+        coarse_size = resolutions[0] + 1
+        coarse_tables = geo_decoder.grid_query_tables(grid_axes(bbox_min, bbox_max, resolutions[0], device))
+        mini_grid_size = coarse_size // mini_grid_num
+        num_mini_grids = mini_grid_num ** 3
+        mini_grid_index = grid_chunk_indices(0, mini_grid_size ** 3, [mini_grid_size] * 3, device)
+        num_batchs = max(num_chunks // mini_grid_index.shape[0], 1)
 
-        grid_size = np.array(grid_size)
-
-        # 2. latents to 3d volume
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype)
+        # 2. latents to 3d volume, one mini grid per batch of the coarse level; each batch entry
+        # is decoded on its own, the refinement levels only hold the band around its surface
+        kv = geo_decoder.project_latents(latents)
         batch_size = latents.shape[0]
-        mini_grid_size = xyz_samples.shape[0] // mini_grid_num
-        xyz_samples = xyz_samples.view(
-            mini_grid_num, mini_grid_size,
-            mini_grid_num, mini_grid_size,
-            mini_grid_num, mini_grid_size, 3
-        ).permute(
-            0, 2, 4, 1, 3, 5, 6
-        ).reshape(
-            -1, mini_grid_size * mini_grid_size * mini_grid_size, 3
-        )
-        batch_logits = []
-        num_batchs = max(num_chunks // xyz_samples.shape[1], 1)
-        for start in tqdm(range(0, xyz_samples.shape[0], num_batchs),
-                          desc=f"FlashVDM Volume Decoding", disable=not enable_pbar):
-            queries = xyz_samples[start: start + num_batchs, :]
-            batch = queries.shape[0]
-            batch_latents = repeat(latents.squeeze(0), "p c -> b p c", b=batch)
-            processor.topk = True
-            logits = geo_decoder(queries=queries, latents=batch_latents)
-            batch_logits.append(logits)
-        grid_logits = torch.cat(batch_logits, dim=0).reshape(
-            mini_grid_num, mini_grid_num, mini_grid_num,
-            mini_grid_size, mini_grid_size,
-            mini_grid_size
-        ).permute(0, 3, 1, 4, 2, 5).contiguous().view(
-            (batch_size, grid_size[0], grid_size[1], grid_size[2])
-        )
-
-        for octree_depth_now in resolutions[1:]:
-            grid_size = np.array([octree_depth_now + 1] * 3)
-            resolution = bbox_size / octree_depth_now
-            next_index = torch.zeros(tuple(grid_size), dtype=dtype, device=device)
-            next_logits = torch.full(next_index.shape, -10000., dtype=dtype, device=device)
-            curr_points = extract_near_surface_volume_fn(grid_logits.squeeze(0), mc_level)
-            curr_points += grid_logits.squeeze(0).abs() < 0.95
-
-            if octree_depth_now == resolutions[-1]:
-                expand_num = 0
-            else:
-                expand_num = 1
-            for i in range(expand_num):
-                curr_points = dilate(curr_points.unsqueeze(0).to(dtype)).squeeze(0)
-            (cidx_x, cidx_y, cidx_z) = torch.where(curr_points > 0)
-
-            next_index[cidx_x * 2, cidx_y * 2, cidx_z * 2] = 1
-            for i in range(2 - expand_num):
-                next_index = dilate(next_index.unsqueeze(0)).squeeze(0)
-            nidx = torch.where(next_index > 0)
-
-            next_points = torch.stack(nidx, dim=1)
-            next_points = (next_points * torch.tensor(resolution, dtype=torch.float32, device=device) +
-                           torch.tensor(bbox_min, dtype=torch.float32, device=device))
-
-            query_grid_num = 6
-            min_val = next_points.min(axis=0).values
-            max_val = next_points.max(axis=0).values
-            vol_queries_index = (next_points - min_val) / (max_val - min_val) * (query_grid_num - 0.001)
-            index = torch.floor(vol_queries_index).long()
-            index = index[..., 0] * (query_grid_num ** 2) + index[..., 1] * query_grid_num + index[..., 2]
-            index = index.sort()
-            next_points = next_points[index.indices].unsqueeze(0).contiguous()
-            unique_values = torch.unique(index.values, return_counts=True)
-            grid_logits = torch.zeros((next_points.shape[1]), dtype=latents.dtype, device=latents.device)
-            input_grid = [[], []]
-            logits_grid_list = []
-            start_num = 0
-            sum_num = 0
-            for grid_index, count in zip(unique_values[0].cpu().tolist(), unique_values[1].cpu().tolist()):
-                if sum_num + count < num_chunks or sum_num == 0:
-                    sum_num += count
-                    input_grid[0].append(grid_index)
-                    input_grid[1].append(count)
-                else:
+        volumes = []
+        for i in range(batch_size):
+            batch_logits = []
+            for start in tqdm(range(0, num_mini_grids, num_batchs),
+                              desc=f"FlashVDM Volume Decoding", disable=not enable_pbar):
+                check_cancelled(cancel_token)
+                end = min(start + num_batchs, num_mini_grids)
+                origins = grid_chunk_indices(start, end, [mini_grid_num] * 3, device) * mini_grid_size
+                queries = geo_decoder.embed_grid_queries(coarse_tables, origins[:, None] + mini_grid_index, dtype)
+                batch = queries.shape[0]
+                batch_kv = repeat(kv[i], "p c -> b p c", b=batch)
+                processor.topk = True
+                logits = geo_decoder(query_embeddings=queries, kv=batch_kv)
+                batch_logits.append(logits)
+                if progress_callback is not None:
+                    progress_callback(resolutions[0], end, num_mini_grids)
+            grid_logits = torch.cat(batch_logits, dim=0).reshape(
+                mini_grid_num, mini_grid_num, mini_grid_num,
+                mini_grid_size, mini_grid_size,
+                mini_grid_size
+            ).permute(0, 3, 1, 4, 2, 5).reshape(-1)
+            # the coarse level is dense, the refinement levels only hold the band around the surface
+            volume = SparseVolume(torch.arange(coarse_size ** 3, device=device), grid_logits, resolutions[0])
+
+            for octree_depth_now in resolutions[1:]:
+                expand_num = 0 if octree_depth_now == resolutions[-1] else 1
+                next_keys = refine_keys(volume, mc_level, octree_depth_now, expand_num)
+                grid_size = [octree_depth_now + 1] * 3
+                if len(next_keys) == 0:
+                    volume = SparseVolume(next_keys, latents.new_empty(0), octree_depth_now)
+                    continue
+
+                tables = geo_decoder.grid_query_tables(grid_axes(bbox_min, bbox_max, octree_depth_now, device))
+
+                # group the points into query_grid_num^3 blocks of their bounding box, axis by axis
+                query_grid_num = 6
+                index = torch.zeros_like(next_keys)
+                for axis, stride in enumerate(_axis_strides(grid_size)):
+                    coord = next_keys // stride % grid_size[axis]
+                    min_val, max_val = coord.min(), coord.max()
+                    cell = torch.floor((coord - min_val) / (max_val - min_val).float() * (query_grid_num - 0.001))
+                    index = index * query_grid_num + cell.long()
+                index = index.sort()
+                next_points = next_keys[index.indices]
+                unique_values = torch.unique(index.values, return_counts=True)
+                grid_logits = torch.zeros((next_points.shape[0]), dtype=latents.dtype, device=latents.device)
+                input_grid = [[], []]
+                logits_grid_list = []
+                start_num = 0
+                sum_num = 0
+                for grid_index, count in zip(unique_values[0].cpu().tolist(), unique_values[1].cpu().tolist()):
+                    if sum_num + count < num_chunks or sum_num == 0:
+                        sum_num += count
+                        input_grid[0].append(grid_index)
+                        input_grid[1].append(count)
+                    else:
+                        check_cancelled(cancel_token)
+                        processor.topk = input_grid
+                        queries = unflatten_indices(next_points[start_num:start_num + sum_num], grid_size)
+                        logits_grid = geo_decoder(
+                            query_embeddings=geo_decoder.embed_grid_queries(tables, queries.unsqueeze(0), dtype),
+                            kv=kv[i:i + 1])
+                        start_num = start_num + sum_num
+                        logits_grid_list.append(logits_grid)
+                        if progress_callback is not None:
+                            progress_callback(octree_depth_now, start_num, next_points.shape[0])
+                        input_grid = [[grid_index], [count]]
+                        sum_num = count
+                if sum_num > 0:
                     processor.topk = input_grid
-                    logits_grid = geo_decoder(queries=next_points[:, start_num:start_num + sum_num], latents=latents)
-                    start_num = start_num + sum_num
+                    queries = unflatten_indices(next_points[start_num:start_num + sum_num], grid_size)
+                    logits_grid = geo_decoder(
+                        query_embeddings=geo_decoder.embed_grid_queries(tables, queries.unsqueeze(0), dtype),
+                        kv=kv[i:i + 1])
                     logits_grid_list.append(logits_grid)
-                    input_grid = [[grid_index], [count]]
-                    sum_num = count
-            if sum_num > 0:
-                processor.topk = input_grid
-                logits_grid = geo_decoder(queries=next_points[:, start_num:start_num + sum_num], latents=latents)
-                logits_grid_list.append(logits_grid)
-            logits_grid = torch.cat(logits_grid_list, dim=1)
-            grid_logits[index.indices] = logits_grid.squeeze(0).squeeze(-1)
-            next_logits[nidx] = grid_logits
-            grid_logits = next_logits.unsqueeze(0)
-
-        grid_logits[grid_logits == -10000.] = float('nan')
+                    if progress_callback is not None:
+                        progress_callback(octree_depth_now, next_points.shape[0], next_points.shape[0])
+                logits_grid = torch.cat(logits_grid_list, dim=1)
+                grid_logits[index.indices] = logits_grid.squeeze(0).squeeze(-1)
+                volume = SparseVolume(next_keys, grid_logits, octree_depth_now)
 
-        return grid_logits
+            volumes.append(volume)
+
+        return volumes
@@ -16,6 +16,7 @@ import copy
 import importlib
 import inspect
 import os
+import time
 from typing import List, Optional, Union
 
 import numpy as np
@@ -28,8 +29,8 @@ from diffusers.utils.import_utils import is_accelerate_version, is_accelerate_av
 from tqdm import tqdm
 
 from .models.autoencoders import ShapeVAE
-from .models.autoencoders import SurfaceExtractors
-from .utils import logger, synchronize_timer, smart_load_model
+from .models.autoencoders import SurfaceExtractors, MCSurfaceExtractor, VanillaVolumeDecoder
+from .utils import logger, synchronize_timer, smart_load_model, check_cancelled, GenerationPreempted
 
 
 def retrieve_timesteps(
@@ -91,7 +92,7 @@ def retrieve_timesteps(
     return timesteps, num_inference_steps
 
 
-@synchronize_timer('Export to trimesh')
+@synchronize_timer('Export to trimesh', stage='export_trimesh')
 def export_to_trimesh(mesh_output):
     if isinstance(mesh_output, list):
         outputs = []
@@ -109,6 +110,23 @@ def export_to_trimesh(mesh_output):
         return mesh_output
 
 
+def extract_preview_meshes(grid_logits, box_v=1.01, mc_level=0.0, octree_resolution=64):
+    """ Marching cubes of preview volumes from `decode_preview`, CPU only so it can run off the sampling thread. """
+    outputs = MCSurfaceExtractor()(grid_logits, mc_level=mc_level, bounds=box_v, octree_resolution=octree_resolution)
+    return export_to_trimesh(outputs)
+
+
+def move_to_device(value, device):
+    """ Move the tensors of a (nested) dict/list/tuple to `device`. """
+    if torch.is_tensor(value):
+        return value.to(device)
+    if isinstance(value, dict):
+        return {k: move_to_device(v, device) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(move_to_device(v, device) for v in value)
+    return value
+
+
 def get_obj_from_str(string, reload=False):
     module, cls = string.rsplit(".", 1)
     if reload:
@@ -420,7 +438,7 @@ class Hunyuan3DDiTPipeline:
         # make sure the model is in the same state as before calling it
         self.enable_model_cpu_offload()
 
-    @synchronize_timer('Encode cond')
+    @synchronize_timer('Encode cond', stage='cond_encode', gpu=True)
     def encode_cond(self, image, additional_cond_inputs, do_classifier_free_guidance, dual_guidance):
         bsz = image.shape[0]
         cond = self.conditioner(image=image, **additional_cond_inputs)
@@ -487,6 +505,7 @@ class Hunyuan3DDiTPipeline:
         latents = latents * getattr(self.scheduler, 'init_noise_sigma', 1.0)
         return latents
 
+    @synchronize_timer('Prepare image', stage='image_preprocess')
     def prepare_image(self, image) -> dict:
         if isinstance(image, str) and not os.path.exists(image):
             raise FileNotFoundError(f"Couldn't find image at path {image}")
@@ -571,6 +590,8 @@ class Hunyuan3DDiTPipeline:
     ) -> List[List[trimesh.Trimesh]]:
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
+        volume_decode_callback = kwargs.pop("volume_decode_callback", None)
+        cancel_token = kwargs.pop("cancel_token", None)
 
         self.set_surface_extractor(mc_algo)
 
@@ -604,36 +625,38 @@ class Hunyuan3DDiTPipeline:
             guidance_cond = self.get_guidance_scale_embedding(
                 guidance_scale_tensor, embedding_dim=self.model.guidance_cond_proj_dim
             ).to(device=device, dtype=latents.dtype)
-        with synchronize_timer('Diffusion Sampling'):
+        with synchronize_timer('Diffusion Sampling', stage='diffusion', gpu=True):
             for i, t in enumerate(tqdm(timesteps, disable=not enable_pbar, desc="Diffusion Sampling:", leave=False)):
-                # expand the latents if we are doing classifier free guidance
-                if do_classifier_free_guidance:
-                    latent_model_input = torch.cat([latents] * (3 if dual_guidance else 2))
-                else:
-                    latent_model_input = latents
-                latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-
-                # predict the noise residual
-                timestep_tensor = torch.tensor([t], dtype=t_dtype, device=device)
-                timestep_tensor = timestep_tensor.expand(latent_model_input.shape[0])
-                noise_pred = self.model(latent_model_input, timestep_tensor, cond, guidance_cond=guidance_cond)
-
-                # no drop, drop clip, all drop
-                if do_classifier_free_guidance:
-                    if dual_guidance:
-                        noise_pred_clip, noise_pred_dino, noise_pred_uncond = noise_pred.chunk(3)
-                        noise_pred = (
-                            noise_pred_uncond
-                            + guidance_scale * (noise_pred_clip - noise_pred_dino)
-                            + dual_guidance_scale * (noise_pred_dino - noise_pred_uncond)
-                        )
+                check_cancelled(cancel_token)
+                with synchronize_timer(stage='diffusion_step', gpu=True):
+                    # expand the latents if we are doing classifier free guidance
+                    if do_classifier_free_guidance:
+                        latent_model_input = torch.cat([latents] * (3 if dual_guidance else 2))
                     else:
-                        noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
-                        noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
-
-                # compute the previous noisy sample x_t -> x_t-1
-                outputs = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs)
-                latents = outputs.prev_sample
+                        latent_model_input = latents
+                    latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+
+                    # predict the noise residual
+                    timestep_tensor = torch.tensor([t], dtype=t_dtype, device=device)
+                    timestep_tensor = timestep_tensor.expand(latent_model_input.shape[0])
+                    noise_pred = self.model(latent_model_input, timestep_tensor, cond, guidance_cond=guidance_cond)
+
+                    # no drop, drop clip, all drop
+                    if do_classifier_free_guidance:
+                        if dual_guidance:
+                            noise_pred_clip, noise_pred_dino, noise_pred_uncond = noise_pred.chunk(3)
+                            noise_pred = (
+                                noise_pred_uncond
+                                + guidance_scale * (noise_pred_clip - noise_pred_dino)
+                                + dual_guidance_scale * (noise_pred_dino - noise_pred_uncond)
+                            )
+                        else:
+                            noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
+                            noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
+
+                    # compute the previous noisy sample x_t -> x_t-1
+                    outputs = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs)
+                    latents = outputs.prev_sample
 
                 if callback is not None and i % callback_steps == 0:
                     step_idx = i // getattr(self.scheduler, "order", 1)
@@ -643,6 +666,8 @@ class Hunyuan3DDiTPipeline:
             latents,
             output_type,
             box_v, mc_level, num_chunks, octree_resolution, mc_algo,
+            volume_decode_callback=volume_decode_callback,
+            cancel_token=cancel_token,
         )
 
     def _export(
@@ -654,9 +679,12 @@ class Hunyuan3DDiTPipeline:
         num_chunks=20000,
         octree_resolution=256,
         mc_algo='mc',
-        enable_pbar=True
+        enable_pbar=True,
+        volume_decode_callback=None,
+        cancel_token=None,
     ):
         if not output_type == "latent":
+            check_cancelled(cancel_token)
             latents = 1. / self.vae.scale_factor * latents
             latents = self.vae(latents)
             outputs = self.vae.latents2mesh(
@@ -667,6 +695,8 @@ class Hunyuan3DDiTPipeline:
                 octree_resolution=octree_resolution,
                 mc_algo=mc_algo,
                 enable_pbar=enable_pbar,
+                progress_callback=volume_decode_callback,
+                cancel_token=cancel_token,
             )
         else:
             outputs = latents
@@ -676,9 +706,47 @@ class Hunyuan3DDiTPipeline:
 
         return outputs
 
+    def decode_preview(
+        self,
+        latents,
+        box_v=1.01,
+        octree_resolution=64,
+        num_chunks=20000,
+    ):
+        """
+        Cheap volumes of (predicted) latents for progress previews: a single-level dense
+        decode at a low octree resolution, whatever volume decoder the pipeline is configured
+        with. The logits are returned on the host, `extract_preview_meshes` turns them into meshes.
+        """
+        with synchronize_timer('Preview decoding', stage='preview', gpu=True):
+            latents = 1. / self.vae.scale_factor * latents
+            latents = self.vae(latents)
+            grid_logits = VanillaVolumeDecoder()(
+                latents,
+                self.vae.geo_decoder,
+                bounds=box_v,
+                num_chunks=num_chunks,
+                octree_resolution=octree_resolution,
+                enable_pbar=False,
+            )
+            return grid_logits.cpu()
+
 
 class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
 
+    def _park_scheduler(self):
+        # the scheduler is shared by every run of the pipeline, snapshot its per-run state
+        return {
+            name: (value.cpu(), value.device) if torch.is_tensor(value) else copy.copy(value)
+            for name, value in vars(self.scheduler).items()
+        }
+
+    def _restore_scheduler(self, state):
+        for name, value in state.items():
+            if isinstance(value, tuple) and len(value) == 2 and torch.is_tensor(value[0]):
+                value = value[0].to(value[1])
+            setattr(self.scheduler, name, value)
+
     @torch.inference_mode()
     def __call__(
         self,
@@ -700,6 +768,21 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
     ) -> List[List[trimesh.Trimesh]]:
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
+        volume_decode_callback = kwargs.pop("volume_decode_callback", None)
+        cancel_token = kwargs.pop("cancel_token", None)
+        # `preempt()` is polled at step boundaries; when it returns True the run parks its
+        # state in host memory and raises GenerationPreempted, `resume_from` continues it
+        preempt = kwargs.pop("preempt", None)
+        resume_from = kwargs.pop("resume_from", None)
+        # every `preview_steps` steps the clean latents predicted so far for the batch entries in
+        # `preview_indices` (all when None) are decoded into low-resolution volumes, passed as
+        # `preview_callback(step_idx, grid_logits)` in that order. Previews are skipped while
+        # decoding them has taken more than `preview_budget` of the sampling time so far
+        preview_callback = kwargs.pop("preview_callback", None)
+        preview_steps = kwargs.pop("preview_steps", None)
+        preview_octree_resolution = kwargs.pop("preview_octree_resolution", 64)
+        preview_indices = kwargs.pop("preview_indices", None)
+        preview_budget = kwargs.pop("preview_budget", None)
 
         self.set_surface_extractor(mc_algo)
 
@@ -710,26 +793,35 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
             self.model.guidance_embed is True
         )
 
-        cond_inputs = self.prepare_image(image)
-        image = cond_inputs.pop('image')
-        cond = self.encode_cond(
-            image=image,
-            additional_cond_inputs=cond_inputs,
-            do_classifier_free_guidance=do_classifier_free_guidance,
-            dual_guidance=False,
-        )
-        batch_size = image.shape[0]
-
-        # 5. Prepare timesteps
-        # NOTE: this is slightly different from common usage, we start from 0.
-        sigmas = np.linspace(0, 1, num_inference_steps) if sigmas is None else sigmas
-        timesteps, num_inference_steps = retrieve_timesteps(
-            self.scheduler,
-            num_inference_steps,
-            device,
-            sigmas=sigmas,
-        )
-        latents = self.prepare_latents(batch_size, dtype, device, generator)
+        if resume_from is not None:
+            cond = move_to_device(resume_from['cond'], device)
+            latents = resume_from['latents'].to(device)
+            timesteps = resume_from['timesteps'].to(device)
+            self._restore_scheduler(resume_from['scheduler'])
+            batch_size = latents.shape[0]
+            start_step = resume_from['step']
+        else:
+            cond_inputs = self.prepare_image(image)
+            image = cond_inputs.pop('image')
+            cond = self.encode_cond(
+                image=image,
+                additional_cond_inputs=cond_inputs,
+                do_classifier_free_guidance=do_classifier_free_guidance,
+                dual_guidance=False,
+            )
+            batch_size = image.shape[0]
+
+            # 5. Prepare timesteps
+            # NOTE: this is slightly different from common usage, we start from 0.
+            sigmas = np.linspace(0, 1, num_inference_steps) if sigmas is None else sigmas
+            timesteps, num_inference_steps = retrieve_timesteps(
+                self.scheduler,
+                num_inference_steps,
+                device,
+                sigmas=sigmas,
+            )
+            latents = self.prepare_latents(batch_size, dtype, device, generator)
+            start_step = 0
 
         guidance = None
         if hasattr(self.model, 'guidance_embed') and \
@@ -737,34 +829,76 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
             guidance = torch.tensor([guidance_scale] * batch_size, device=device, dtype=dtype)
             # logger.info(f'Using guidance embed with scale {guidance_scale}')
 
-        with synchronize_timer('Diffusion Sampling'):
+        sampling_start, preview_seconds = time.perf_counter(), 0.
+        with synchronize_timer('Diffusion Sampling', stage='diffusion', gpu=True):
             for i, t in enumerate(tqdm(timesteps, disable=not enable_pbar, desc="Diffusion Sampling:")):
-                # expand the latents if we are doing classifier free guidance
-                if do_classifier_free_guidance:
-                    latent_model_input = torch.cat([latents] * 2)
-                else:
-                    latent_model_input = latents
+                if i < start_step:
+                    continue
+                check_cancelled(cancel_token)
+                # every run makes at least one step before it can be preempted again
+                if preempt is not None and i > start_step and preempt():
+                    raise GenerationPreempted({
+                        'step': i,
+                        'latents': latents.cpu(),
+                        'cond': move_to_device(cond, 'cpu'),
+                        'timesteps': timesteps.cpu(),
+                        'scheduler': self._park_scheduler(),
+                    })
+                with synchronize_timer(stage='diffusion_step', gpu=True):
+                    # expand the latents if we are doing classifier free guidance
+                    if do_classifier_free_guidance:
+                        latent_model_input = torch.cat([latents] * 2)
+                    else:
+                        latent_model_input = latents
 
-                # NOTE: we assume model get timesteps ranged from 0 to 1
-                timestep = t.expand(latent_model_input.shape[0]).to(
-                    latents.dtype) / self.scheduler.config.num_train_timesteps
-                noise_pred = self.model(latent_model_input, timestep, cond, guidance=guidance)
+                    # NOTE: we assume model get timesteps ranged from 0 to 1
+                    timestep = t.expand(latent_model_input.shape[0]).to(
+                        latents.dtype) / self.scheduler.config.num_train_timesteps
+                    noise_pred = self.model(latent_model_input, timestep, cond, guidance=guidance)
 
-                if do_classifier_free_guidance:
-                    noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
+                    if do_classifier_free_guidance:
+                        noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
+                        noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
 
-                # compute the previous noisy sample x_t -> x_t-1
-                outputs = self.scheduler.step(noise_pred, t, latents)
-                latents = outputs.prev_sample
+                    # the last step has nothing left to preview
+                    preview = (preview_callback is not None and preview_steps and
+                               (i + 1) % preview_steps == 0 and i + 1 < len(timesteps))
+                    # decoding a preview syncs the device, so the wall clock is accurate at this point
+                    if preview and preview_budget is not None and \
+                            preview_seconds > preview_budget * (time.perf_counter() - sampling_start):
+                        preview = False
+                    if preview:
+                        # sigma runs from 0 (noise) to 1 (data), one Euler step to the end of the schedule
+                        sigma = t / self.scheduler.config.num_train_timesteps
+                        pred_original = latents + (1 - sigma) * noise_pred
+                        if preview_indices is not None:
+                            pred_original = pred_original[preview_indices]
+
+                    # compute the previous noisy sample x_t -> x_t-1
+                    outputs = self.scheduler.step(noise_pred, t, latents)
+                    latents = outputs.prev_sample
 
                 if callback is not None and i % callback_steps == 0:
                     step_idx = i // getattr(self.scheduler, "order", 1)
                     callback(step_idx, t, outputs)
 
+                if preview:
+                    preview_start = time.perf_counter()
+                    try:
+                        grid_logits = self.decode_preview(
+                            pred_original.to(latents.dtype), box_v, preview_octree_resolution, num_chunks)
+                    except Exception as e:
+                        logger.warning(f"Preview decoding failed: {e}")
+                    else:
+                        preview_callback(i // getattr(self.scheduler, "order", 1), grid_logits)
+                    preview_seconds += time.perf_counter() - preview_start
+                    del pred_original
+
         return self._export(
             latents,
             output_type,
             box_v, mc_level, num_chunks, octree_resolution, mc_algo,
             enable_pbar=enable_pbar,
+            volume_decode_callback=volume_decode_callback,
+            cancel_token=cancel_token,
         )
@@ -116,7 +116,7 @@ def import_mesh(mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutpu
 
 
 class FaceReducer:
-    @synchronize_timer('FaceReducer')
+    @synchronize_timer('FaceReducer', stage='face_reducer')
     def __call__(
         self,
         mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str],
@@ -129,7 +129,7 @@ class FaceReducer:
 
 
 class FloaterRemover:
-    @synchronize_timer('FloaterRemover')
+    @synchronize_timer('FloaterRemover', stage='floater_remover')
     def __call__(
         self,
         mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str],
@@ -141,7 +141,7 @@ class FloaterRemover:
 
 
 class DegenerateFaceRemover:
-    @synchronize_timer('DegenerateFaceRemover')
+    @synchronize_timer('DegenerateFaceRemover', stage='degenerate_face_remover')
     def __call__(
         self,
         mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str],
@@ -183,7 +183,7 @@ class MeshSimplifier:
             executable = os.path.join(CURRENT_DIR, "mesh_simplifier.bin")
         self.executable = executable
 
-    @synchronize_timer('MeshSimplifier')
+    @synchronize_timer('MeshSimplifier', stage='mesh_simplifier')
     def __call__(
         self,
         mesh: Union[trimesh.Trimesh],
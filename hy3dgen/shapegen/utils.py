@@ -14,6 +14,8 @@
 
 import logging
 import os
+import threading
+import time
 from functools import wraps
 
 import torch
@@ -35,6 +37,89 @@ def get_logger(name):
 logger = get_logger('hy3dgen.shapgen')
 
 
+class GenerationCancelled(Exception):
+    """ Raised inside a pipeline once its cancellation token has been cancelled. """
+
+
+class CancellationToken:
+    """ Cooperative cancellation flag, checked by the pipelines between steps and chunks. """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class CombinedCancellationToken:
+    """ Cancelled once all of `tokens` are, for work shared by several requests.
+    A `None` entry stands for a request that cannot be cancelled. """
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+
+    @property
+    def cancelled(self):
+        return bool(self.tokens) and all(token is not None and token.cancelled for token in self.tokens)
+
+
+class GenerationPreempted(Exception):
+    """ Raised by a pipeline that gave up the accelerator at a step boundary.
+    `checkpoint` holds everything needed to resume from that exact step, in host memory. """
+
+    def __init__(self, checkpoint):
+        super().__init__(f"preempted at step {checkpoint['step']}")
+        self.checkpoint = checkpoint
+
+
+def check_cancelled(cancel_token):
+    """ Abort the running pipeline if `cancel_token` has been cancelled. """
+    if cancel_token is not None and cancel_token.cancelled:
+        raise GenerationCancelled()
+
+
+_timing_hooks = []
+# (stage, start event, end event) of timers whose kernels may still be queued on the device
+_pending_timings = []
+_pending_timings_lock = threading.Lock()
+
+
+def add_timing_hook(hook):
+    """ Register `hook(stage, seconds)`, called whenever a timer with a `stage` name finishes.
+
+        Hooks run on a thread that ran timed code and should be cheap. With CUDA in use a
+        stage is reported once the device has reached its end, at a later timer exit.
+    """
+    _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+    if hook in _timing_hooks:
+        _timing_hooks.remove(hook)
+
+
+def _report_timing(stage, seconds):
+    for hook in list(_timing_hooks):
+        try:
+            hook(stage, seconds)
+        except Exception as e:
+            logger.warning(f'Timing hook failed for {stage}: {e}')
+
+
+def _drain_timings():
+    """ Report the pending stages the device has finished, without waiting on the rest. """
+    with _pending_timings_lock:
+        done = [timing for timing in _pending_timings if timing[2].query()]
+        for timing in done:
+            _pending_timings.remove(timing)
+    for stage, start, end in done:
+        _report_timing(stage, start.elapsed_time(end) / 1000)
+
+
 class synchronize_timer:
     """ Synchronized timer to count the inference time of `nn.Module.forward`.
 
@@ -52,13 +137,28 @@ class synchronize_timer:
         def export_to_trimesh(mesh_output):
             pass
         ```
+
+        Timers given a `stage` name also report their duration, in seconds, to the
+        hooks registered with `add_timing_hook`. Stages marked `gpu` report the device
+        time between CUDA events when CUDA is in use, so the timed code is never
+        synchronized; all other stages report their wall time.
     """
 
-    def __init__(self, name=None):
+    def __init__(self, name=None, stage=None, gpu=False):
         self.name = name
+        self.stage = stage
+        self.gpu = gpu
 
     def __enter__(self):
         """Context manager entry: start timing."""
+        self.report = self.stage is not None and bool(_timing_hooks)
+        if self.report:
+            # device time between events on the current stream, read once the device gets there
+            self.stage_start = None
+            if self.gpu and torch.cuda.is_available() and torch.cuda.is_initialized():
+                self.stage_start = torch.cuda.Event(enable_timing=True)
+                self.stage_start.record()
+            self.wall_start = time.perf_counter()
         if os.environ.get('HY3DGEN_DEBUG', '0') == '1':
             self.start = torch.cuda.Event(enable_timing=True)
             self.end = torch.cuda.Event(enable_timing=True)
@@ -73,13 +173,23 @@ class synchronize_timer:
             self.time = self.start.elapsed_time(self.end)
             if self.name is not None:
                 logger.info(f'{self.name} takes {self.time} ms')
+        if self.report and exc_type is None:
+            if self.stage_start is None:
+                _report_timing(self.stage, time.perf_counter() - self.wall_start)
+            else:
+                stage_end = torch.cuda.Event(enable_timing=True)
+                stage_end.record()
+                with _pending_timings_lock:
+                    _pending_timings.append((self.stage, self.stage_start, stage_end))
+        if self.report and _pending_timings:
+            _drain_timings()
 
     def __call__(self, func):
         """Decorator: wrap the function to time its execution."""
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            with self:
+            with synchronize_timer(self.name, self.stage, self.gpu):
                 result = func(*args, **kwargs)
             return result
 
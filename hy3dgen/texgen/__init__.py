@@ -13,4 +13,4 @@
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
 
-from .pipelines import Hunyuan3DPaintPipeline, Hunyuan3DTexGenConfig
+from .pipelines import Hunyuan3DPaintPipeline, Hunyuan3DTexGenConfig, TextureBaker
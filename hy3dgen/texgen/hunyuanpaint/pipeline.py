@@ -505,6 +505,8 @@ class HunyuanPaintPipeline(StableDiffusionPipeline):
 
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
+        # any object with a `cancelled` attribute; checked before every step
+        cancel_token = kwargs.pop("cancel_token", None)
 
         if callback is not None:
             deprecate(
@@ -640,6 +642,8 @@ class HunyuanPaintPipeline(StableDiffusionPipeline):
         self._num_timesteps = len(timesteps)
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                if cancel_token is not None and cancel_token.cancelled:
+                    self._interrupt = True
                 if self.interrupt:
                     continue
 
@@ -21,6 +21,7 @@ from PIL import Image
 from typing import List, Union, Optional
 
 
+from ..shapegen.utils import synchronize_timer, check_cancelled
 from .differentiable_renderer.mesh_render import MeshRender
 from .utils.dehighlight_utils import Light_Shadow_Remover
 from .utils.multiview_utils import Multiview_Diffusion_Net
@@ -50,6 +51,102 @@ class Hunyuan3DTexGenConfig:
         self.pipe_name = self.pipe_dict[subfolder_name]
 
 
+class TextureBaker:
+    """
+    Mesh-side stages of texturing: UV unwrapping, rendering of the conditioning maps,
+    baking of the generated views, inpainting and export.
+
+    Every baker owns its `MeshRender`, so several meshes can be textured concurrently
+    while sharing the diffusion models of one `Hunyuan3DPaintPipeline`.
+    """
+
+    def __init__(self, config, render=None):
+        self.config = config
+        self.render = render if render is not None else MeshRender(
+            default_resolution=self.config.render_size,
+            texture_size=self.config.texture_size)
+
+    @synchronize_timer('UV wrap', stage='uv_wrap')
+    def uv_unwrap(self, mesh):
+        mesh = mesh_uv_wrap(mesh)
+        self.render.load_mesh(mesh)
+        return mesh
+
+    def load_mesh(self, mesh):
+        """ Use a mesh that was UV-unwrapped before, e.g. by an earlier run. """
+        self.render.load_mesh(mesh)
+        return mesh
+
+    def render_normal_multiview(self, camera_elevs, camera_azims, use_abs_coor=True):
+        normal_maps = []
+        for elev, azim in zip(camera_elevs, camera_azims):
+            normal_map = self.render.render_normal(
+                elev, azim, use_abs_coor=use_abs_coor, return_type='pl')
+            normal_maps.append(normal_map)
+
+        return normal_maps
+
+    def render_position_multiview(self, camera_elevs, camera_azims):
+        position_maps = []
+        for elev, azim in zip(camera_elevs, camera_azims):
+            position_map = self.render.render_position(
+                elev, azim, return_type='pl')
+            position_maps.append(position_map)
+
+        return position_maps
+
+    @synchronize_timer('Render maps', stage='render_maps')
+    def render_maps(self):
+        normal_maps = self.render_normal_multiview(
+            self.config.candidate_camera_elevs, self.config.candidate_camera_azims, use_abs_coor=True)
+        position_maps = self.render_position_multiview(
+            self.config.candidate_camera_elevs, self.config.candidate_camera_azims)
+        return normal_maps + position_maps
+
+    def bake_from_multiview(self, views, camera_elevs,
+                            camera_azims, view_weights, method='graphcut'):
+        project_textures, project_weighted_cos_maps = [], []
+        project_boundary_maps = []
+        for view, camera_elev, camera_azim, weight in zip(
+            views, camera_elevs, camera_azims, view_weights):
+            project_texture, project_cos_map, project_boundary_map = self.render.back_project(
+                view, camera_elev, camera_azim)
+            project_cos_map = weight * (project_cos_map ** self.config.bake_exp)
+            project_textures.append(project_texture)
+            project_weighted_cos_maps.append(project_cos_map)
+            project_boundary_maps.append(project_boundary_map)
+
+        if method == 'fast':
+            texture, ori_trust_map = self.render.fast_bake_texture(
+                project_textures, project_weighted_cos_maps)
+        else:
+            raise f'no method {method}'
+        return texture, ori_trust_map > 1E-8
+
+    @synchronize_timer('Inpaint', stage='inpaint')
+    def texture_inpaint(self, texture, mask):
+
+        texture_np = self.render.uv_inpaint(texture, mask)
+        texture = torch.tensor(texture_np / 255).float().to(texture.device)
+
+        return texture
+
+    @synchronize_timer('Bake', stage='bake')
+    def bake(self, multiviews):
+        texture, mask = self.bake_from_multiview(multiviews,
+                                                 self.config.candidate_camera_elevs,
+                                                 self.config.candidate_camera_azims,
+                                                 self.config.candidate_view_weights,
+                                                 method=self.config.merge_method)
+        mask_np = (mask.squeeze(-1).cpu().numpy() * 255).astype(np.uint8)
+        return texture, mask_np
+
+    @synchronize_timer('Texture export', stage='texture_export')
+    def export(self, texture):
+        self.render.set_texture(texture)
+        return self.render.save_mesh()
+
+
 class Hunyuan3DPaintPipeline:
     @classmethod
     def from_pretrained(cls, model_path, subfolder='hunyuan3d-paint-v2-0-turbo'):
@@ -89,9 +186,8 @@ class Hunyuan3DPaintPipeline:
     def __init__(self, config):
         self.config = config
         self.models = {}
-        self.render = MeshRender(
-            default_resolution=self.config.render_size,
-            texture_size=self.config.texture_size)
+        self.baker = TextureBaker(self.config)
+        self.render = self.baker.render
 
         self.load_models()
 
@@ -107,51 +203,6 @@ class Hunyuan3DPaintPipeline:
         self.models['delight_model'].pipeline.enable_model_cpu_offload(gpu_id=gpu_id, device=device)
         self.models['multiview_model'].pipeline.enable_model_cpu_offload(gpu_id=gpu_id, device=device)
 
-    def render_normal_multiview(self, camera_elevs, camera_azims, use_abs_coor=True):
-        normal_maps = []
-        for elev, azim in zip(camera_elevs, camera_azims):
-            normal_map = self.render.render_normal(
-                elev, azim, use_abs_coor=use_abs_coor, return_type='pl')
-            normal_maps.append(normal_map)
-
-        return normal_maps
-
-    def render_position_multiview(self, camera_elevs, camera_azims):
-        position_maps = []
-        for elev, azim in zip(camera_elevs, camera_azims):
-            position_map = self.render.render_position(
-                elev, azim, return_type='pl')
-            position_maps.append(position_map)
-
-        return position_maps
-
-    def bake_from_multiview(self, views, camera_elevs,
-                            camera_azims, view_weights, method='graphcut'):
-        project_textures, project_weighted_cos_maps = [], []
-        project_boundary_maps = []
-        for view, camera_elev, camera_azim, weight in zip(
-            views, camera_elevs, camera_azims, view_weights):
-            project_texture, project_cos_map, project_boundary_map = self.render.back_project(
-                view, camera_elev, camera_azim)
-            project_cos_map = weight * (project_cos_map ** self.config.bake_exp)
-            project_textures.append(project_texture)
-            project_weighted_cos_maps.append(project_cos_map)
-            project_boundary_maps.append(project_boundary_map)
-
-        if method == 'fast':
-            texture, ori_trust_map = self.render.fast_bake_texture(
-                project_textures, project_weighted_cos_maps)
-        else:
-            raise f'no method {method}'
-        return texture, ori_trust_map > 1E-8
-
-    def texture_inpaint(self, texture, mask):
-
-        texture_np = self.render.uv_inpaint(texture, mask)
-        texture = torch.tensor(texture_np / 255).float().to(texture.device)
-
-        return texture
-
     def recenter_image(self, image, border_ratio=0.2):
         if image.mode == 'RGB':
             return image
@@ -186,9 +237,7 @@ class Hunyuan3DPaintPipeline:
         new_image.paste(cropped_image, (paste_x, paste_y))
         return new_image
 
-    @torch.no_grad()
-    def __call__(self, mesh, image):
-
+    def prepare_images(self, image):
         if not isinstance(image, List):
             image = [image]
 
@@ -199,42 +248,66 @@ class Hunyuan3DPaintPipeline:
             else:
                 image_prompt = image[i]
             images_prompt.append(image_prompt)
-            
-        images_prompt = [self.recenter_image(image_prompt) for image_prompt in images_prompt]
-
-        images_prompt = [self.models['delight_model'](image_prompt) for image_prompt in images_prompt]
-
-        mesh = mesh_uv_wrap(mesh)
 
-        self.render.load_mesh(mesh)
-
-        selected_camera_elevs, selected_camera_azims, selected_view_weights = \
-            self.config.candidate_camera_elevs, self.config.candidate_camera_azims, self.config.candidate_view_weights
+        return [self.recenter_image(image_prompt) for image_prompt in images_prompt]
 
-        normal_maps = self.render_normal_multiview(
-            selected_camera_elevs, selected_camera_azims, use_abs_coor=True)
-        position_maps = self.render_position_multiview(
-            selected_camera_elevs, selected_camera_azims)
+    @torch.no_grad()
+    @synchronize_timer('Delight', stage='delight', gpu=True)
+    def delight(self, images_prompt):
+        return [self.models['delight_model'](image_prompt) for image_prompt in images_prompt]
 
+    @torch.no_grad()
+    @synchronize_timer('Multiview diffusion', stage='multiview', gpu=True)
+    def multiview(self, images_prompt, control_maps, cancel_token=None, render_size=None):
         camera_info = [(((azim // 30) + 9) % 12) // {-20: 1, 0: 1, 20: 1, -90: 3, 90: 3}[
             elev] + {-20: 0, 0: 12, 20: 24, -90: 36, 90: 40}[elev] for azim, elev in
-                       zip(selected_camera_azims, selected_camera_elevs)]
-        multiviews = self.models['multiview_model'](images_prompt, normal_maps + position_maps, camera_info)
+                       zip(self.config.candidate_camera_azims, self.config.candidate_camera_elevs)]
+        multiviews = self.models['multiview_model'](images_prompt, control_maps, camera_info,
+                                                    cancel_token=cancel_token)
+        # an interrupted diffusion returns noise, never bake it
+        check_cancelled(cancel_token)
 
+        render_size = render_size or self.config.render_size
         for i in range(len(multiviews)):
             # multiviews[i] = self.models['super_model'](multiviews[i])
             multiviews[i] = multiviews[i].resize(
-                (self.config.render_size, self.config.render_size))
+                (render_size, render_size))
+        return multiviews
 
-        texture, mask = self.bake_from_multiview(multiviews,
-                                                 selected_camera_elevs, selected_camera_azims, selected_view_weights,
-                                                 method=self.config.merge_method)
+    @torch.no_grad()
+    def __call__(self, mesh, image, callback=None):
+        """
+        Texture `mesh` from the prompt `image`.
 
-        mask_np = (mask.squeeze(-1).cpu().numpy() * 255).astype(np.uint8)
+        `callback`, if given, is called as `callback(stage)` when each stage starts,
+        with stage one of: delight, uv_wrap, render_maps, multiview, bake, inpaint, export.
+        The stages can also be driven one by one through `delight`/`multiview` and a
+        `TextureBaker`, which is how concurrent jobs share one pipeline.
+        """
 
-        texture = self.texture_inpaint(texture, mask_np)
+        def enter_stage(stage):
+            if callback is not None:
+                callback(stage)
 
-        self.render.set_texture(texture)
-        textured_mesh = self.render.save_mesh()
+        images_prompt = self.prepare_images(image)
+
+        enter_stage('delight')
+        images_prompt = self.delight(images_prompt)
+
+        enter_stage('uv_wrap')
+        self.baker.uv_unwrap(mesh)
+
+        enter_stage('render_maps')
+        control_maps = self.baker.render_maps()
+
+        enter_stage('multiview')
+        multiviews = self.multiview(images_prompt, control_maps)
+
+        enter_stage('bake')
+        texture, mask_np = self.baker.bake(multiviews)
+
+        enter_stage('inpaint')
+        texture = self.baker.texture_inpaint(texture, mask_np)
 
-        return textured_mesh
+        enter_stage('export')
+        return self.baker.export(texture)
@@ -53,7 +53,7 @@ class Multiview_Diffusion_Net():
         torch.manual_seed(seed)
         os.environ["PL_GLOBAL_SEED"] = str(seed)
 
-    def __call__(self, input_images, control_images, camera_info):
+    def __call__(self, input_images, control_images, camera_info, cancel_token=None):
 
         self.seed_everything(0)
 
@@ -81,6 +81,8 @@ class Multiview_Diffusion_Net():
         kwargs['camera_info_ref'] = camera_info_ref
         kwargs["normal_imgs"] = normal_image
         kwargs["position_imgs"] = position_image
+        if cancel_token is not None:
+            kwargs['cancel_token'] = cancel_token
 
         mvd_image = self.pipeline(input_images, num_inference_steps=30, **kwargs).images
 
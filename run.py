@@ -3,11 +3,16 @@ from app.config import settings
 from app.utils.logger import logger
 
 if __name__ == '__main__':
-    uvicorn.run(
-        'app.main:app',
-        host=settings.host,
-        port=settings.port,
-        log_level='info',
-        workers=1,
-        reload=False
-    )
\ No newline at end of file
+    if settings.process_role in ('worker', 'shape-worker', 'texture-worker'):
+        from app.services.worker import run_worker
+        run_worker()
+    else:
+        # API workers only scale out once the models run in separate worker processes
+        uvicorn.run(
+            'app.main:app',
+            host=settings.host,
+            port=settings.port,
+            log_level='info',
+            workers=settings.api_workers if settings.process_role == 'api' else 1,
+            reload=False
+        )
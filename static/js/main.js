@@ -126,6 +126,7 @@ function initThreeJSViewer(modelUrl) {
 // Main Application State
 let currentTaskId = null;
 let statusCheckInterval = null;
+let eventSource = null;
 let generationStartTime = null;
 
 // Progress tracking
@@ -376,7 +377,78 @@ function startStatusChecking() {
     // Start step 1 timer (3 seconds to 25%)
     startStepTimer(1, 3000, 25);
     
-    // Check status from API every 5 seconds
+    if (window.EventSource) {
+        startEventStream();
+    } else {
+        startStatusPolling();
+    }
+}
+
+// Progress is pushed by the server; polling is only a fallback
+function startEventStream() {
+    const taskId = currentTaskId;
+    let finished = false;
+    eventSource = new EventSource(`/api/v1/events/${taskId}`);
+
+    eventSource.addEventListener('status', (e) => {
+        const status = JSON.parse(e.data);
+        handleStatusUpdate(status);
+
+        if (['completed', 'error', 'cancelled'].includes(status.status)) {
+            finished = true;
+            closeEventStream();
+            clearAllStepTimers();
+            if (status.status === 'completed') {
+                onGenerationComplete(status);
+            } else {
+                onGenerationError(status.message);
+            }
+        }
+    });
+
+    eventSource.addEventListener('stage', (e) => {
+        handleStageUpdate(JSON.parse(e.data).stage);
+    });
+
+    eventSource.addEventListener('step', (e) => {
+        const event = JSON.parse(e.data);
+        elements.progressText.textContent = `Diffusion sampling step ${event.step}/${event.total}...`;
+    });
+
+    eventSource.addEventListener('decode', (e) => {
+        const event = JSON.parse(e.data);
+        elements.progressText.textContent = `Decoding volume at resolution ${event.resolution} (${event.percent}%)...`;
+    });
+
+    eventSource.onerror = () => {
+        if (finished || taskId !== currentTaskId) return;
+        console.warn('Progress stream lost, falling back to polling');
+        closeEventStream();
+        startStatusPolling();
+    };
+}
+
+function closeEventStream() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
+function handleStageUpdate(stage) {
+    if (!stage) return;
+
+    if (stage === 'shape' || stage === 'postprocess') {
+        advanceToStep(2);
+    } else if (stage.startsWith('texture')) {
+        advanceToStep(3);
+    } else if (stage === 'save') {
+        advanceToStep(4);
+    }
+}
+
+function startStatusPolling() {
+    // Check status from API every 10 seconds
     statusCheckInterval = setInterval(async () => {
         try {
             const response = await axios.get(`/api/v1/status/${currentTaskId}`);
@@ -389,7 +461,7 @@ function startStatusChecking() {
                 clearInterval(statusCheckInterval);
                 clearAllStepTimers();
                 onGenerationComplete(status);
-            } else if (status.status === 'error') {
+            } else if (status.status === 'error' || status.status === 'cancelled') {
                 clearInterval(statusCheckInterval);
                 clearAllStepTimers();
                 onGenerationError(status.message);
@@ -407,6 +479,11 @@ function startStatusChecking() {
 }
 
 function handleStatusUpdate(status) {
+    if (status.status === 'pending' && status.queue_position) {
+        elements.progressText.textContent = `Waiting in queue (position ${status.queue_position})...`;
+        return;
+    }
+
     if (status.message) {
         elements.progressText.textContent = status.message;
         
@@ -662,6 +739,7 @@ function downloadModel() {
 function resetGeneration() {
     clearAllStepTimers();
     clearInterval(statusCheckInterval);
+    closeEventStream();
     
     elements.progressContainer.classList.add('hidden');
     elements.actionsContainer.classList.add('hidden');
@@ -0,0 +1,121 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("skimage")
+volume_decoders = pytest.importorskip("hy3dgen.shapegen.models.autoencoders.volume_decoders")
+surface_extractors = pytest.importorskip("hy3dgen.shapegen.models.autoencoders.surface_extractors")
+
+BOUNDS = 1.01
+
+
+class SphereDecoder:
+    """Analytic stand-in for CrossAttentionDecoder: each latent is the radius of a sphere"""
+
+    def project_latents(self, latents):
+        return latents
+
+    def grid_query_tables(self, axes):
+        return [torch.eye(3, dtype=torch.float64)[d] * axis.double()[:, None] for d, axis in enumerate(axes)]
+
+    def embed_grid_queries(self, tables, index, dtype):
+        return (tables[0][index[..., 0]] + tables[1][index[..., 1]] + tables[2][index[..., 2]]).to(dtype)
+
+    def set_cross_attention_processor(self, processor):
+        pass
+
+    def __call__(self, query_embeddings=None, kv=None):
+        return 10 * (kv - query_embeddings.norm(dim=-1, keepdim=True))
+
+
+def decode_points(decoder, radius, index, octree_resolution):
+    bbox_min, bbox_max = np.array([-BOUNDS] * 3), np.array([BOUNDS] * 3)
+    tables = decoder.grid_query_tables(volume_decoders.grid_axes(bbox_min, bbox_max, octree_resolution, 'cpu'))
+    queries = decoder.embed_grid_queries(tables, index, torch.float64)
+    return decoder(query_embeddings=queries[None], kv=radius)[0, :, 0]
+
+
+def dense_hierarchical(decoder, radius, octree_resolution, mc_level=0.0, min_resolution=63):
+    """The dense refinement hierarchical decoding did before the sparse band"""
+    resolutions = []
+    while octree_resolution >= min_resolution:
+        resolutions.append(octree_resolution)
+        octree_resolution = octree_resolution // 2
+    resolutions.reverse()
+
+    dilate = torch.nn.Conv3d(1, 1, 3, padding=1, bias=False, dtype=torch.float64)
+    dilate.weight = torch.nn.Parameter(torch.ones(dilate.weight.shape, dtype=torch.float64))
+
+    size = resolutions[0] + 1
+    index = volume_decoders.grid_chunk_indices(0, size ** 3, [size] * 3, 'cpu')
+    grid_logits = decode_points(decoder, radius, index, resolutions[0]).view(size, size, size)
+    with torch.no_grad():
+        for resolution in resolutions[1:]:
+            next_index = torch.zeros((resolution + 1,) * 3, dtype=torch.float64)
+            next_logits = torch.full(next_index.shape, -10000., dtype=torch.float64)
+            curr_points = volume_decoders.extract_near_surface_volume_fn(grid_logits, mc_level)
+            curr_points += grid_logits.abs() < 0.95
+            expand_num = 0 if resolution == resolutions[-1] else 1
+            for _ in range(expand_num):
+                curr_points = dilate(curr_points.unsqueeze(0).to(torch.float64)).squeeze(0)
+            cidx_x, cidx_y, cidx_z = torch.where(curr_points > 0)
+            next_index[cidx_x * 2, cidx_y * 2, cidx_z * 2] = 1
+            for _ in range(2 - expand_num):
+                next_index = dilate(next_index.unsqueeze(0)).squeeze(0)
+            nidx = torch.where(next_index > 0)
+            next_logits[nidx] = decode_points(decoder, radius, torch.stack(nidx, dim=1), resolution)
+            grid_logits = next_logits
+    grid_logits[grid_logits == -10000.] = float('nan')
+    return grid_logits
+
+
+def hierarchical(latents, octree_resolution):
+    return volume_decoders.HierarchicalVolumeDecoding()(
+        latents, SphereDecoder(), bounds=BOUNDS, octree_resolution=octree_resolution, enable_pbar=False)
+
+
+# 128 and 254 reuse coarse logits at their finest level, 255 never does
+@pytest.mark.parametrize('octree_resolution', [128, 254, 255])
+def test_sparse_band_matches_dense_refinement(octree_resolution):
+    latents = torch.tensor([[[0.63]]], dtype=torch.float64)
+    volume, = hierarchical(latents, octree_resolution)
+    expected = dense_hierarchical(SphereDecoder(), latents, octree_resolution)
+
+    assert torch.equal(torch.isnan(volume.to_dense()), torch.isnan(expected))
+    torch.testing.assert_close(volume.to_dense(), expected, rtol=0, atol=1e-5, equal_nan=True)
+
+
+def test_sparse_marching_cubes_matches_dense():
+    latents = torch.tensor([[[0.63]]], dtype=torch.float64)
+    volumes = hierarchical(latents, 128)
+    dense = dense_hierarchical(SphereDecoder(), latents, 128)
+
+    kwargs = dict(mc_level=0.0, bounds=BOUNDS, octree_resolution=128)
+    sparse_mesh, = surface_extractors.MCSurfaceExtractor(brick_size=32)(volumes, **kwargs)
+    dense_mesh, = surface_extractors.MCSurfaceExtractor()(dense[None], **kwargs)
+
+    # the dense run also interpolates cells against the NaN outside the band, the sparse one drops those
+    dense_faces = dense_mesh.mesh_f[np.isfinite(dense_mesh.mesh_v).all(axis=1)[dense_mesh.mesh_f].all(axis=1)]
+    dense_vertices = dense_mesh.mesh_v[np.unique(dense_faces)]
+
+    assert np.isfinite(sparse_mesh.mesh_v).all()
+    assert len(sparse_mesh.mesh_f) == len(dense_faces)
+    assert len(sparse_mesh.mesh_v) == len(dense_vertices)
+    np.testing.assert_allclose(np.sort(sparse_mesh.mesh_v, axis=0), np.sort(dense_vertices, axis=0), atol=1e-5)
+
+
+@pytest.mark.parametrize('decoder_cls', [
+    volume_decoders.HierarchicalVolumeDecoding,
+    volume_decoders.FlashVDMVolumeDecoding,
+])
+def test_one_volume_per_batch_entry(decoder_cls):
+    latents = torch.tensor([[[0.45]], [[0.7]]], dtype=torch.float64)
+    volumes = decoder_cls()(latents, SphereDecoder(), bounds=BOUNDS, octree_resolution=128, enable_pbar=False)
+
+    assert len(volumes) == 2
+    for i, volume in enumerate(volumes):
+        single, = decoder_cls()(
+            latents[i:i + 1], SphereDecoder(), bounds=BOUNDS, octree_resolution=128, enable_pbar=False)
+        assert torch.equal(volume.keys, single.keys)
+        torch.testing.assert_close(volume.values, single.values)
+    assert not torch.equal(volumes[0].keys, volumes[1].keys)